@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+from collections import defaultdict
+from typing import Dict, Optional
+from weakref import WeakSet
+
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+import metrics
+from settings import Settings
+
+HIGH, NORMAL, LOW = 0, 1, 2
+# Служебные маршруты проходят без очереди: метрики нужны как раз под нагрузкой.
+# Поток изменений открыт часами и почти не нагружает процесс — он не должен занимать место в лимитах
+EXEMPT = {"GET /metrics", "GET /grades/changes/stream"}
+
+
+def parse_keys(value: str):
+    # "GET /teachers/me/,POST /grades/" -> {"GET /teachers/me/", "POST /grades/"}
+    return {" ".join(key.split()) for key in value.split(",") if key.strip()}
+
+
+def parse_routes(value: str) -> Dict[str, tuple]:
+    # "GET /grades/=8:32:1000" -> {"GET /grades/": (одновременно, очередь, ожидание в секундах)}
+    routes = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        key, _, limits = item.rpartition("=")
+        limit, queue, wait_ms = limits.split(":")
+        routes[" ".join(key.split())] = (int(limit), int(queue), float(wait_ms) / 1000)
+    return routes
+
+
+def match_route(scope):
+    # Маршрут определяется так же, как его выберет роутер: первый полностью совпавший по пути и методу
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+def route_key(scope) -> Optional[str]:
+    route = match_route(scope)
+    return None if route is None else f"{scope['method']} {route.path}"
+
+
+class Limiter:
+    # Не больше limit запросов одновременно и не больше max_waiting в очереди. Освободившееся место
+    # получает ожидающий с наивысшим приоритетом, при равном — пришедший раньше.
+    # Работает только в цикле событий, поэтому без блокировок
+    def __init__(self, limit: int, max_waiting: int):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._waiters = []  # куча (priority, seq, future)
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int, timeout: float) -> Optional[str]:
+        # None — место получено, иначе причина отказа: "queue_full" или "timeout"
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return None
+        if self.waiting >= self.max_waiting or timeout <= 0:
+            return "queue_full"
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait((future,), timeout=timeout)
+        except BaseException:  # запрос отменён (клиент отключился)
+            self._abandon(future)
+            raise
+        if future.done():
+            return None
+        self._abandon(future)
+        return "timeout"
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done():
+            self.release()  # место уже передано этому запросу — отдаём следующему
+        else:
+            future.cancel()  # из кучи удаляется лениво в release
+            self.waiting -= 1
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.cancelled():
+                # Место переходит ожидающему напрямую: active не меняется
+                self.waiting -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionMiddleware:
+    # Чистый ASGI-middleware перед приложением. Дорогие маршруты (bcrypt в /token, статистика, большие
+    # страницы оценок) ограничены своими лимитами и не занимают весь пул потоков, поэтому дешёвые
+    # чтения не ждут за ними. Сверх лимита запрос ждёт в ограниченной очереди; если очередь полна или
+    # ожидание истекло, сразу отвечаем: 429 — исчерпан лимит маршрута, 503 — общий лимит класса или приложения
+    def __init__(self, app, config: Settings):
+        self.app = app
+        self.capacity = Limiter(config.admission_capacity, config.admission_queue)
+        self.wait = config.admission_wait_ms / 1000
+        self.routes = {
+            key: (Limiter(limit, queue), wait)
+            for key, (limit, queue, wait) in parse_routes(config.admission_routes).items()
+        }
+        self.low = Limiter(config.admission_low_capacity, config.admission_queue)
+        self.priorities = {key: LOW for key in parse_keys(config.admission_low)}
+        self.priorities.update((key, HIGH) for key in parse_keys(config.admission_high))
+        self.rejected = defaultdict(int)  # (route, reason) -> count
+        _middlewares.add(self)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = match_route(scope)
+        if route is None:
+            return await self.app(scope, receive, send)  # 404/405
+        # Отказ отвечает до роутера: шаблон пути для метрик запросов (MetricsMiddleware) ставим сами
+        scope["route"] = route
+        key = f"{scope['method']} {route.path}"
+        if key in EXEMPT:
+            return await self.app(scope, receive, send)  # служебные маршруты
+
+        priority = self.priorities.get(key, NORMAL)
+        # Лимит маршрута (отказ 429), общий лимит класса low и приложения (отказ 503)
+        limits = []
+        if key in self.routes:
+            limits.append((*self.routes[key], 429))
+        if priority == LOW:
+            limits.append((self.low, self.wait, 503))
+        limits.append((self.capacity, self.wait, 503))
+        acquired = []
+        try:
+            for limiter, wait, status_code in limits:
+                reason = await limiter.acquire(priority, wait)
+                if reason:
+                    return await self._reject(scope, receive, send, key, status_code, reason)
+                acquired.append(limiter)
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
+    async def _reject(self, scope, receive, send, key: str, status_code: int, reason: str):
+        self.rejected[(key, reason)] += 1
+        response = JSONResponse(
+            {"detail": "Server is busy, retry later"}, status_code=status_code, headers={"Retry-After": "1"}
+        )
+        await response(scope, receive, send)
+
+    def stats(self) -> dict:
+        pools = {"*": self.capacity, "low": self.low, **{key: limiter for key, (limiter, _) in self.routes.items()}}
+        return {
+            "active": {pool: limiter.active for pool, limiter in pools.items()},
+            "waiting": {pool: limiter.waiting for pool, limiter in pools.items()},
+            "rejected": dict(self.rejected),
+        }
+
+
+_middlewares = WeakSet()
+
+
+def _collect_metrics() -> list:
+    active, waiting, rejected = defaultdict(int), defaultdict(int), defaultdict(int)
+    for middleware in list(_middlewares):
+        stats = middleware.stats()
+        for pool, value in stats["active"].items():
+            active[pool] += value
+        for pool, value in stats["waiting"].items():
+            waiting[pool] += value
+        for key, value in stats["rejected"].items():
+            rejected[key] += value
+    return [
+        ("journal_admission_active", "Requests admitted and running, by limit (* — whole app, low — class).", "gauge",
+         [({"pool": pool}, value) for pool, value in sorted(active.items())]),
+        ("journal_admission_waiting", "Requests waiting for admission, by limit.", "gauge",
+         [({"pool": pool}, value) for pool, value in sorted(waiting.items())]),
+        ("journal_admission_rejected_total", "Requests shed with 429/503 by route and reason.", "counter",
+         [({"route": route, "reason": reason}, value) for (route, reason), value in sorted(rejected.items())]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
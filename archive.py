@@ -0,0 +1,172 @@
+import argparse
+import time
+from datetime import date
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, distinct, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+import changes
+import database
+import models
+import refcache
+import rollups
+import versions
+from settings import settings
+
+# Холодные данные: оценки прошлых учебных лет и выпущенные классы переносятся в grades_archive и
+# students_archive. Рабочие запросы читают только grades, статистика и выгрузка — по запросу и архив.
+GRADE_COLUMNS = ("id", "student_id", "subject_id", "grade", "date")
+STUDENT_COLUMNS = ("id", "full_name", "class_group")
+
+
+def _columns(model, names):
+    return [model.__table__.c[name] for name in names]
+
+
+def grades_source(include_archived: bool):
+    # Таблица grades или UNION ALL с архивом (колонки в .c). SQLite переносит условия WHERE
+    # внутрь ветвей UNION ALL, поэтому индексы обеих таблиц работают
+    if not include_archived:
+        return database.Grade.__table__
+    return union_all(
+        select(*_columns(database.Grade, GRADE_COLUMNS)),
+        select(*_columns(database.ArchivedGrade, GRADE_COLUMNS)),
+    ).subquery("all_grades")
+
+
+def students_source(include_archived: bool):
+    if not include_archived:
+        return database.Student.__table__
+    return union_all(
+        select(*_columns(database.Student, STUDENT_COLUMNS)),
+        select(*_columns(database.ArchivedStudent, STUDENT_COLUMNS)),
+    ).subquery("all_students")
+
+
+def get_student(db: Session, student_id: int, include_archived: bool = False):
+    student = db.get(database.Student, student_id)
+    if student is None and include_archived:
+        student = db.get(database.ArchivedStudent, student_id)
+    if student is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return student
+
+
+def _student_chunks(rows, chunk_size: int):
+    # rows: (student_id, число оценок) по возрастанию id -> списки id примерно по chunk_size оценок
+    chunk, size = [], 0
+    for student_id, count in rows:
+        chunk.append(student_id)
+        size += (count or 0) + 1
+        if size >= chunk_size:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def _move_grades(db: Session, conditions) -> int:
+    # Клиенты ленты изменений видят перенос как удаление, иначе их копия grades расходится с сервером
+    changes.record_where(db, changes.DELETE, *conditions)
+    moved = db.execute(insert(database.ArchivedGrade).from_select(
+        GRADE_COLUMNS, select(*_columns(database.Grade, GRADE_COLUMNS)).where(*conditions)
+    )).rowcount
+    db.execute(delete(database.Grade).where(*conditions).execution_options(synchronize_session=False))
+    return moved
+
+
+def archive_grades(db: Session, before: date, chunk_size: int) -> models.ArchiveReport:
+    # Оценки с датой раньше before переносятся пакетами: каждая транзакция короткая, запись остальных
+    # клиентов ждёт не дольше одного пакета. Пакет — диапазон учеников (индекс student_id, date),
+    # поэтому агрегаты пересчитываются только для его учеников и каждая оценка читается один раз
+    started = time.perf_counter()
+    report = models.ArchiveReport()
+    counts = db.execute(
+        select(database.StudentRollup.student_id, database.StudentRollup.count)
+        .order_by(database.StudentRollup.student_id)
+    ).all()
+    for chunk in _student_chunks(counts, chunk_size):
+        cold = [database.Grade.student_id.between(chunk[0], chunk[-1]), database.Grade.date < before]
+        affected = db.execute(select(func.count(distinct(database.Grade.student_id))).where(*cold)).scalar_one()
+        if not affected:
+            continue
+        report.grades += _move_grades(db, cold)
+        rollups.rebuild_students(db, chunk)
+        versions.bump(db, versions.GRADES)
+        db.commit()
+        report.students += affected
+        report.chunks += 1
+    report.seconds = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _graduate_chunk(db: Session, student_ids: List[int], graduated_on: date) -> int:
+    moved = _move_grades(db, [database.Grade.student_id.in_(student_ids)])
+    graduated = literal(graduated_on, database.ArchivedStudent.graduated_on.type)
+    db.execute(insert(database.ArchivedStudent).from_select(
+        STUDENT_COLUMNS + ("graduated_on",),
+        select(*_columns(database.Student, STUDENT_COLUMNS), graduated).where(database.Student.id.in_(student_ids)),
+    ))
+    db.execute(
+        delete(database.Student).where(database.Student.id.in_(student_ids))
+        .execution_options(synchronize_session=False)
+    )
+    rollups.delete_students(db, student_ids)
+    versions.bump(db, versions.STUDENTS, versions.GRADES)
+    refcache.removed(db, versions.STUDENTS, student_ids)
+    db.commit()
+    return moved
+
+
+def graduate_class(
+        db: Session,
+        class_group: str,
+        chunk_size: int,
+        graduated_on: Optional[date] = None
+) -> models.ArchiveReport:
+    # Выпуск класса: ученики и их оценки уходят в архив пакетами примерно по chunk_size оценок
+    # вместо delete_student на каждого ученика
+    started = time.perf_counter()
+    graduated_on = graduated_on or date.today()
+    # Число оценок ученика — из student_rollups
+    counts = db.execute(
+        select(database.Student.id, database.StudentRollup.count)
+        .outerjoin(database.StudentRollup, database.StudentRollup.student_id == database.Student.id)
+        .where(database.Student.class_group == class_group)
+        .order_by(database.Student.id)
+    ).all()
+    if not counts:
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    report = models.ArchiveReport(students=len(counts))
+    for chunk in _student_chunks(counts, chunk_size):
+        report.grades += _graduate_chunk(db, chunk, graduated_on)
+        report.chunks += 1
+    report.seconds = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move cold grades and graduated classes to the archive tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    grades = commands.add_parser("grades", help="archive grades dated before a cutoff")
+    grades.add_argument("--before", type=date.fromisoformat, required=True, help="e.g. 2024-09-01")
+    graduate = commands.add_parser("graduate", help="archive a whole class_group with its grades")
+    graduate.add_argument("class_group")
+    parser.add_argument("--chunk-size", type=int, default=settings.archive_chunk_size)
+    args = parser.parse_args()
+
+    journal_db = database.Database(settings)
+    journal_db.ensure_schema()
+    with journal_db.SessionLocal() as db:
+        if args.command == "grades":
+            report = archive_grades(db, args.before, args.chunk_size)
+        else:
+            report = graduate_class(db, args.class_group, args.chunk_size)
+    print(report.model_dump_json())
+
+
+if __name__ == "__main__":
+    main()
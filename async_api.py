@@ -0,0 +1,344 @@
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, File, Header, Query, Request, Response, UploadFile, status
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import archive
+import auth
+import changes
+import crud
+import export
+import groupcommit
+import importer
+import models
+import refcache
+import search
+import serialization
+import tenancy
+import versions
+from auth import get_current_teacher_async
+from database import get_async_db, get_async_read_db, get_config, run_batch
+from pagination import page_limit
+from settings import Settings
+
+# Те же эндпоинты, что и в main.py, но на AsyncSession: запрос к БД не занимает поток из пула,
+# логика общая — функции crud выполняются через run_sync на асинхронном соединении.
+router = APIRouter()
+
+
+# ========== Аутентификация ==========
+@router.post("/register/", response_model=models.Teacher, status_code=status.HTTP_201_CREATED)
+async def register_teacher(
+        teacher_data: models.TeacherCreate,
+        hasher: auth.PasswordHasher = Depends(auth.get_password_hasher),
+        db: AsyncSession = Depends(get_async_db)
+):
+    validated_email = await db.run_sync(crud.validate_teacher, teacher_data)
+
+    # bcrypt нагружает CPU — выполняется в отдельном пуле, event loop только ждёт результат
+    hashed_password = await hasher.hash_async(teacher_data.password)
+    return await db.run_sync(crud.create_teacher, validated_email, teacher_data, hashed_password)
+
+
+@router.post("/token", response_model=models.Token)
+async def login_for_access_token(
+        request: Request,
+        form_data: OAuth2PasswordRequestForm = Depends(),
+        hasher: auth.PasswordHasher = Depends(auth.get_password_hasher),
+        db: AsyncSession = Depends(get_async_db)
+):
+    teacher = await auth.authenticate_teacher_async(db, form_data.username, form_data.password, hasher)
+    return crud.issue_token(teacher, tenancy.current_tenant(request))
+
+
+@router.get("/teachers/me/", response_model=models.Teacher)
+async def read_teachers_me(current_teacher: models.Teacher = Depends(get_current_teacher_async)):
+    return current_teacher
+
+
+# ========== Students Endpoints ==========
+@router.post("/students/", response_model=models.Student)
+async def create_student(student: models.StudentCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.create_student, student)
+
+
+@router.get("/students/", response_model=List[models.Student])
+async def read_students(
+        response: Response,
+        skip: int = 0,
+        limit: int = Depends(page_limit),
+        after: Optional[str] = None,
+        config: Settings = Depends(get_config),
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    # Опрос без изменений: 304 по версии таблицы, сами строки не читаются
+    not_modified = await db.run_sync(versions.conditional, versions.STUDENTS, if_none_match, response)
+    if not_modified:
+        return not_modified
+    students, next_cursor = await db.run_sync(crud.list_students, skip, limit, after, config.fast_lists)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return serialization.render(students, response)
+
+
+@router.get("/students/export")
+async def export_students(
+        request: Request,
+        class_group: Optional[str] = None,
+        fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+        include_archived: bool = False
+):
+    query = export.students_query(class_group, include_archived)
+    return export.export_response(await export.stream_rows_async(request, query, fmt), "students", fmt)
+
+
+@router.get("/students/search", response_model=List[models.Student])
+async def search_students(
+        q: str = Query(..., min_length=1, max_length=100),
+        limit: int = Query(20, ge=1, le=100),
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(search.search_students, q, limit)
+
+
+@router.get("/students/{student_id}", response_model=models.Student)
+async def read_student(student_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(crud.get_student, student_id)
+
+
+@router.put("/students/{student_id}", response_model=models.Student)
+async def update_student(student_id: int, student: models.StudentCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.update_student, student_id, student)
+
+
+@router.delete("/students/{student_id}")
+async def delete_student(student_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.delete_student, student_id)
+
+
+# ========== Subjects Endpoints ==========
+@router.post("/subjects/", response_model=models.Subject)
+async def create_subject(subject: models.SubjectCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.create_subject, subject)
+
+
+@router.get("/subjects/", response_model=List[models.Subject])
+async def read_subjects(
+        response: Response,
+        skip: int = 0,
+        limit: int = Depends(page_limit),
+        after: Optional[str] = None,
+        config: Settings = Depends(get_config),
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    # Версия и строки предметов — из копии в памяти (refcache)
+    known = await db.run_sync(refcache.current, versions.SUBJECTS)
+    not_modified = await db.run_sync(versions.conditional, versions.SUBJECTS, if_none_match, response, known)
+    if not_modified:
+        return not_modified
+    subjects, next_cursor = await db.run_sync(crud.list_subjects, skip, limit, after, config.fast_lists)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return serialization.render(subjects, response)
+
+
+@router.get("/subjects/{subject_id}", response_model=models.Subject)
+async def read_subject(subject_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(crud.get_subject, subject_id)
+
+
+@router.put("/subjects/{subject_id}", response_model=models.Subject)
+async def update_subject(subject_id: int, subject: models.SubjectCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.update_subject, subject_id, subject)
+
+
+@router.delete("/subjects/{subject_id}")
+async def delete_subject(subject_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.delete_subject, subject_id)
+
+
+# ========== Grades Endpoints ==========
+@router.post("/grades/", response_model=models.Grade)
+async def create_grade(
+        grade: models.GradeCreate,
+        db: AsyncSession = Depends(get_async_db),
+        writer: Optional[groupcommit.GradeWriter] = Depends(groupcommit.get_async_grade_writer)
+):
+    if writer is not None:
+        return await writer.create_async(grade)
+    return await db.run_sync(crud.create_grade, grade)
+
+
+@router.post("/grades/bulk", response_model=models.GradeBulkResult)
+async def create_grades_bulk(
+        grades: List[models.GradeCreate],
+        atomic: bool = False,
+        db: AsyncSession = Depends(get_async_db)
+):
+    return await db.run_sync(crud.create_grades_bulk, grades, atomic)
+
+
+@router.get("/grades/", response_model=List[models.Grade])
+async def read_grades(
+        response: Response,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        skip: int = 0,
+        limit: int = Depends(page_limit),
+        after: Optional[str] = None,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        config: Settings = Depends(get_config),
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    # fields=grade,date,student.full_name и include=student,subject — один select с JOIN вместо запросов на строку
+    fieldset = serialization.grade_fieldset(fields, include)
+    tables = fieldset.tables if fieldset else (versions.GRADES,)
+    not_modified = await db.run_sync(versions.conditional_many, tables, if_none_match, response)
+    if not_modified:
+        return not_modified
+    grades, next_cursor = await db.run_sync(
+        crud.list_grades, student_id, subject_id, start_date, end_date, skip, limit, after, config.fast_lists,
+        fieldset
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return serialization.render(grades, response)
+
+
+@router.get("/grades/export")
+async def export_grades(
+        request: Request,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+        include_archived: bool = False
+):
+    # Потоковая выгрузка: память не зависит от числа строк
+    query = export.grades_query(student_id, subject_id, start_date, end_date, include_archived)
+    return export.export_response(await export.stream_rows_async(request, query, fmt), "grades", fmt)
+
+
+@router.get("/grades/changes", response_model=List[models.GradeChange])
+async def read_grade_changes(
+        since: int = 0,
+        limit: int = Depends(page_limit),
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        class_group: Optional[str] = None,
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    # Лента изменений: since — seq последнего полученного изменения
+    return await db.run_sync(crud.grade_changes, since, limit, student_id, subject_id, class_group)
+
+
+@router.get("/grades/changes/stream")
+async def stream_grade_changes(
+        request: Request,
+        since: Optional[int] = None,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        class_group: Optional[str] = None,
+):
+    # Server-Sent Events: без since — только новые изменения, при переподключении — с Last-Event-ID
+    return await changes.stream_response(request, since, student_id, subject_id, class_group)
+
+
+@router.get("/grades/{grade_id}", response_model=models.Grade)
+async def read_grade(
+        grade_id: int,
+        response: Response,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    fieldset = serialization.grade_fieldset(fields, include)
+    return serialization.render(await db.run_sync(crud.read_grade, grade_id, fieldset), response)
+
+
+@router.put("/grades/{grade_id}", response_model=models.Grade)
+async def update_grade(grade_id: int, grade: models.GradeCreate, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.update_grade, grade_id, grade)
+
+
+@router.delete("/grades/{grade_id}")
+async def delete_grade(grade_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.delete_grade, grade_id)
+
+
+# ========== Import ==========
+@router.post("/import/csv", response_model=models.ImportReport)
+async def import_gradebook_csv(
+        request: Request,
+        file: UploadFile = File(...),
+        chunk_size: Optional[int] = Query(None, ge=1, le=100_000),
+        config: Settings = Depends(get_config),
+):
+    # CSV с колонками full_name,class_group,subject,grade,date; коммит каждые chunk_size строк.
+    # Разбор файла и пакеты идут в пуле потоков, а не в event loop
+    return await run_batch(request, importer.import_csv, file.file, chunk_size or config.import_chunk_size)
+
+
+# ========== Archive ==========
+@router.post("/archive/grades", response_model=models.ArchiveReport)
+async def archive_grades(
+        request: Request,
+        before: date,
+        chunk_size: Optional[int] = Query(None, ge=1, le=100_000),
+        config: Settings = Depends(get_config),
+):
+    # Оценки раньше before (например, начала текущего учебного года) переносятся в grades_archive.
+    # Пакеты переноса выполняются в пуле потоков, не занимая event loop
+    return await run_batch(request, archive.archive_grades, before, chunk_size or config.archive_chunk_size)
+
+
+@router.post("/classes/{class_group}/graduate", response_model=models.ArchiveReport)
+async def graduate_class(
+        request: Request,
+        class_group: str,
+        chunk_size: Optional[int] = Query(None, ge=1, le=100_000),
+        config: Settings = Depends(get_config),
+):
+    return await run_batch(request, archive.graduate_class, class_group, chunk_size or config.archive_chunk_size)
+
+
+# ========== Statistics Endpoint ==========
+@router.get("/students/{student_id}/stats")
+async def get_student_stats(
+        student_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        include_archived: bool = False,
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(crud.student_stats, student_id, start_date, end_date, include_archived)
+
+
+@router.get("/students/{student_id}/trend", response_model=models.StudentTrend)
+async def get_student_trend(
+        student_id: int,
+        bucket: str = Query("week", pattern="^(week|month)$"),
+        subject_id: Optional[int] = None,
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(crud.student_trend, student_id, bucket, subject_id)
+
+
+@router.get("/classes/{class_group}/report", response_model=models.ClassReport)
+async def get_class_report(
+        class_group: str,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        include_archived: bool = False,
+        db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(crud.class_report, class_group, start_date, end_date, include_archived)
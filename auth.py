@@ -1,65 +1,376 @@
-from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
-from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
-import database
-
-SECRET_KEY = "your-secret-key"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
-
-
-def get_teacher_by_email(db: Session, email: str):
-    return db.query(database.Teacher).filter(database.Teacher.email == email).first()
-
-
-def authenticate_teacher(db: Session, email: str, password: str):
-    teacher = get_teacher_by_email(db, email)
-    if not teacher:
-        return False
-    if not verify_password(password, teacher.hashed_password):
-        return False
-    return teacher
-
-
-def create_access_token(data: dict, expires_delta: timedelta = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-
-async def get_current_teacher(
-        token: str = Depends(oauth2_scheme),
-        db: Session = Depends(database.get_db)
-):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    teacher = get_teacher_by_email(db, email=email)
-    if teacher is None:
-        raise credentials_exception
-    return teacher
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+import asyncio
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+import threading
+import time
+from weakref import WeakSet
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import database
+import metrics
+import models
+from settings import Settings, settings
+
+SECRET_KEY = "your-secret-key"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+def percentiles(values, points=(50, 95, 99)) -> dict:
+    values = sorted(values)
+    if not values:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": values[min(len(values) - 1, len(values) * p // 100)] * 1000 for p in points}
+
+
+class PasswordHasher:
+    # bcrypt выполняется в отдельном пуле потоков фиксированного размера (bcrypt отпускает GIL),
+    # поэтому шторм логинов не занимает общий пул потоков, обслуживающий остальные эндпоинты.
+    # Очередь ограничена: когда она заполнена, запрос сразу получает 503 с Retry-After.
+    # Эндпоинты ждут результат через *_async: синхронные hash/verify_and_update блокируют вызывающий поток
+    # на всё время хеширования и годятся только для CLI и генератора данных.
+    def __init__(self, workers: int, max_pending: int, rounds: int, retry_after: int = 1):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._run_times = deque(maxlen=10000)
+        self._total_times = deque(maxlen=10000)
+        # Суммы и число за всё время — для _sum/_count метрики (окна выше — только для квантилей)
+        self._lock = threading.Lock()
+        self.run_seconds = 0.0
+        self.total_seconds = 0.0
+        self.completed = 0
+        self.rejected = 0
+        _password_hashers.add(self)
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password operations, retry later",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        submitted = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                self._run_times.append(finished - started)
+                self._total_times.append(finished - submitted)
+                with self._lock:
+                    self.run_seconds += finished - started
+                    self.total_seconds += finished - submitted
+                    self.completed += 1
+
+        try:
+            future = self._executor.submit(run)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash(self, password: str) -> str:
+        return self.submit(self.context.hash, password).result()
+
+    def verify_and_update(self, password: str, hashed_password: str):
+        # Возвращает (верен ли пароль, новый хеш если сложность bcrypt изменилась)
+        return self.submit(self.context.verify_and_update, password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self.submit(self.context.hash, password))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str):
+        return await asyncio.wrap_future(
+            self.submit(self.context.verify_and_update, password, hashed_password)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "run_ms": percentiles(self._run_times),
+            "total_ms": percentiles(self._total_times),
+            "rejected": self.rejected,
+        }
+
+
+# Пулы и кеши всех приложений процесса: для метрик и сброса токенов изменённого преподавателя
+_password_hashers = WeakSet()
+_token_caches = WeakSet()
+
+
+def create_password_hasher(config: Settings) -> PasswordHasher:
+    return PasswordHasher(
+        workers=config.hash_workers,
+        max_pending=config.hash_max_pending,
+        rounds=config.bcrypt_rounds,
+        retry_after=config.hash_retry_after,
+    )
+
+
+# Для настроек по умолчанию: CLI, генератор данных и приложение main.app.
+# Приложения со своими Settings получают свои пул и кеш (main.create_app, app.state)
+password_hasher = create_password_hasher(settings)
+
+
+class TokenCache:
+    # LRU-кеш токен -> преподаватель. Запись живёт до exp токена, но не дольше max_ttl секунд,
+    # чтобы изменения, сделанные другими процессами, подхватывались за ограниченное время.
+    def __init__(self, maxsize: int, max_ttl: float, enabled: bool = True):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # token -> (teacher, expires_at)
+        self._tokens_by_email = defaultdict(set)
+        self._lock = threading.Lock()
+        _token_caches.add(self)
+
+    def get(self, token: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, teacher: models.Teacher, expires_at: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[token] = (teacher, min(expires_at, time.time() + self.max_ttl))
+            self._entries.move_to_end(token)
+            self._tokens_by_email[teacher.email].add(token)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_email(self, email: str):
+        with self._lock:
+            for token in list(self._tokens_by_email.get(email, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_email.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, token: str):
+        teacher, _ = self._entries.pop(token)
+        tokens = self._tokens_by_email.get(teacher.email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[teacher.email]
+
+
+def create_token_cache(config: Settings) -> TokenCache:
+    return TokenCache(
+        maxsize=config.token_cache_size,
+        max_ttl=config.token_cache_ttl,
+        enabled=config.token_cache_enabled,
+    )
+
+
+token_cache = create_token_cache(settings)
+
+
+# Зависимости: пул bcrypt и кеш токенов приложения, обрабатывающего запрос
+def get_password_hasher(request: Request) -> PasswordHasher:
+    return request.app.state.password_hasher
+
+
+def get_token_cache(request: Request) -> TokenCache:
+    return request.app.state.token_cache
+
+
+def _collect_metrics() -> list:
+    hashers = list(_password_hashers)
+    caches = [cache.stats() for cache in list(_token_caches)]
+    cache = {key: sum(stats[key] for stats in caches) for key in ("size", "hits", "misses")}
+    completed = sum(hasher.completed for hasher in hashers)
+    summaries = []
+    for stage, window, total in (("run", "_run_times", "run_seconds"), ("total", "_total_times", "total_seconds")):
+        points = percentiles([t for hasher in hashers for t in list(getattr(hasher, window))])
+        quantiles = {str(int(point[1:]) / 100): value / 1000 for point, value in points.items() if value is not None}
+        summaries.append(({"stage": stage}, metrics.Summary(
+            quantiles, sum(getattr(hasher, total) for hasher in hashers), completed
+        )))
+    return [
+        ("journal_password_hash_seconds", "bcrypt time in the hashing pool (run) and including queueing (total).",
+         "summary", summaries),
+        ("journal_password_hash_rejected_total", "Hashing requests rejected with 503 because the queue was full.",
+         "counter", [({}, sum(hasher.rejected for hasher in hashers))]),
+        ("journal_token_cache_entries", "Tokens in the token cache.", "gauge", [({}, cache["size"])]),
+        ("journal_token_cache_hits_total", "Token cache hits.", "counter", [({}, cache["hits"])]),
+        ("journal_token_cache_misses_total", "Token cache misses.", "counter", [({}, cache["misses"])]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def invalidate_teacher(email: str):
+    for cache in list(_token_caches):
+        cache.invalidate_email(email)
+
+
+# Любое изменение или удаление преподавателя через ORM сбрасывает его токены из кеша — после commit:
+# при flush параллельный запрос ещё видит старую строку и вернул бы её в кеш, а откат ничего не меняет
+CHANGED_TEACHERS = "changed_teacher_emails"
+
+
+@event.listens_for(database.Teacher, "after_update")
+@event.listens_for(database.Teacher, "after_delete")
+def _collect_changed_teacher(mapper, connection, target):
+    emails = inspect(target).session.info.setdefault(CHANGED_TEACHERS, set())
+    emails.add(target.email)
+    emails.update(inspect(target).attrs.email.history.deleted or ())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_teachers(session):
+    for email in session.info.pop(CHANGED_TEACHERS, ()):
+        invalidate_teacher(email)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_teachers(session):
+    session.info.pop(CHANGED_TEACHERS, None)
+
+
+def verify_password(plain_password: str, hashed_password: str):
+    return password_hasher.verify_and_update(plain_password, hashed_password)[0]
+
+
+def get_password_hash(password: str):
+    return password_hasher.hash(password)
+
+
+def get_teacher_by_email(db: Session, email: str):
+    return db.query(database.Teacher).filter(database.Teacher.email == email).first()
+
+
+def rehash_teacher(db: Session, teacher: database.Teacher, new_hash: str):
+    # Сложность bcrypt поменялась — прозрачно перехешируем пароль при успешном входе
+    teacher.hashed_password = new_hash
+    db.commit()
+
+
+def authenticate_teacher(db: Session, email: str, password: str, hasher: PasswordHasher = None):
+    teacher = get_teacher_by_email(db, email)
+    if not teacher:
+        return False
+    verified, new_hash = (hasher or password_hasher).verify_and_update(password, teacher.hashed_password)
+    if not verified:
+        return False
+    if new_hash:
+        rehash_teacher(db, teacher, new_hash)
+    return teacher
+
+
+async def _run_db(db, fn, *args):
+    # AsyncSession — через run_sync, синхронная Session — в пуле потоков
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
+
+
+# Для async-эндпоинтов с любой сессией: ожидание bcrypt не занимает поток пула anyio
+async def authenticate_teacher_async(db, email: str, password: str, hasher: PasswordHasher = None):
+    teacher = await _run_db(db, get_teacher_by_email, email)
+    if not teacher:
+        return False
+    hasher = hasher or password_hasher
+    verified, new_hash = await hasher.verify_and_update_async(password, teacher.hashed_password)
+    if not verified:
+        return False
+    if new_hash:
+        await _run_db(db, rehash_teacher, teacher, new_hash)
+    return teacher
+
+
+def create_access_token(data: dict, expires_delta: timedelta = None):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token: str):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        email: str = payload.get("sub")
+        if email is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    return email, payload.get("exp", 0)
+
+
+def teacher_or_401(teacher):
+    if teacher is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return models.Teacher.model_validate(teacher)
+
+
+# Синхронная зависимость выполняется в пуле потоков и не блокирует event loop запросом к БД
+def get_current_teacher(
+        token: str = Depends(oauth2_scheme),
+        token_cache: TokenCache = Depends(get_token_cache),
+        db: Session = Depends(database.get_read_db)
+):
+    teacher = token_cache.get(token)
+    if teacher is not None:
+        return teacher
+    email, expires_at = decode_token(token)
+    teacher = teacher_or_401(get_teacher_by_email(db, email=email))
+    token_cache.put(token, teacher, expires_at)
+    return teacher
+
+
+async def get_current_teacher_async(
+        token: str = Depends(oauth2_scheme),
+        token_cache: TokenCache = Depends(get_token_cache),
+        db: AsyncSession = Depends(database.get_async_read_db)
+):
+    teacher = token_cache.get(token)
+    if teacher is not None:
+        return teacher
+    email, expires_at = decode_token(token)
+    teacher = teacher_or_401(await db.run_sync(get_teacher_by_email, email))
+    token_cache.put(token, teacher, expires_at)
+    return teacher
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+# Бенчмарки запускаются из корня проекта: python -m benchmarks.<name>
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import database  # noqa: E402
+from settings import Settings  # noqa: E402
+
+
+def temp_settings(name: str = "bench", **overrides) -> Settings:
+    path = os.path.join(tempfile.mkdtemp(prefix="journal-"), f"{name}.db")
+    return Settings(database_url=f"sqlite:///{path}", **overrides)
+
+
+def temp_engine(name: str = "bench", **overrides):
+    engine = database.create_engine_from_settings(temp_settings(name, **overrides))
+    database.Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+
+
+def timed(fn, repeat: int = 5):
+    # Возвращает лучшее время из repeat запусков в миллисекундах
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import replace
+from datetime import timedelta
+
+import httpx
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import datagen
+from benchmarks._common import temp_settings
+from benchmarks.suite import POOL, Dataset, percentile
+import auth
+import database
+import main as journal
+
+# Дорогие маршруты насыщаются closed-loop клиентами (каждый шлёт следующий запрос сразу после ответа),
+# а дешёвые замеряются несколькими клиентами рядом с ними: с admission control их p99 не должен расти
+EXPENSIVE = [
+    ("login", lambda rnd, data, token: ("POST", "/token", {"data": {
+        "username": data.teacher, "password": datagen.TEACHER_PASSWORD}})),
+    ("stats", lambda rnd, data, token: ("GET", f"/students/{rnd.randint(1, data.students)}/stats", {"params": {
+        "start_date": str(datagen.SCHOOL_YEAR_START), "end_date": str(datagen.SCHOOL_YEAR_START + timedelta(days=90))
+    }})),
+    ("report", lambda rnd, data, token: ("GET", f"/classes/{rnd.choice(data.class_groups)}/report", {})),
+    ("grades page", lambda rnd, data, token: ("GET", "/grades/", {"params": {
+        "skip": rnd.randint(0, 50_000), "limit": 1000}})),
+]
+CHEAP = [
+    ("student get", lambda rnd, data, token: ("GET", f"/students/{rnd.randint(1, data.students)}", {})),
+    ("teachers me", lambda rnd, data, token: ("GET", "/teachers/me/", {"headers": {
+        "Authorization": f"Bearer {token}"}})),
+    ("grade create", lambda rnd, data, token: ("POST", "/grades/", {"json": {
+        "student_id": rnd.randint(1, data.students), "subject_id": rnd.randint(1, data.subjects),
+        "grade": rnd.randint(1, 5), "date": str(datagen.SCHOOL_YEAR_START)}})),
+]
+
+
+async def load(app, data: Dataset, heavy_clients: int, cheap_clients: int, seconds: float) -> dict:
+    token = auth.create_access_token({"sub": data.teacher}, timedelta(minutes=30))
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    deadline = time.perf_counter() + seconds
+
+    async def client(name, scenario, seed):
+        rnd = random.Random(seed)
+        while time.perf_counter() < deadline:
+            method, url, kwargs = scenario(rnd, data, token)
+            started = time.perf_counter()
+            response = await http.request(method, url, **kwargs)
+            latencies[name].append(time.perf_counter() - started)
+            statuses[name][response.status_code] += 1
+            if "Retry-After" in response.headers:
+                # Клиент уважает отказ: иначе отклонённые запросы крутятся в цикле событий этого же процесса
+                await asyncio.sleep(float(response.headers["Retry-After"]))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        clients = [client(name, scenario, i) for i in range(heavy_clients)
+                   for name, scenario in [EXPENSIVE[i % len(EXPENSIVE)]]]
+        clients += [client(name, scenario, 1000 + i) for i in range(cheap_clients) for name, scenario in CHEAP]
+        await asyncio.gather(*clients)
+    return {name: (sorted(values), statuses[name]) for name, values in latencies.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    datagen.add_arguments(parser)
+    parser.add_argument("--heavy-clients", type=int, default=64)
+    parser.add_argument("--cheap-clients", type=int, default=2, help="per cheap route")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--routes", help="JOURNAL_ADMISSION_ROUTES for the 'on' mode (default: settings)")
+    args = parser.parse_args()
+
+    config = temp_settings("admission", **POOL)
+    scale = datagen.scale_from_args(args)
+    print(f"generating {scale}", flush=True)
+    datagen.generate(config, scale, args.seed)
+    engine = database.create_engine_from_settings(config)
+    data = Dataset(sessionmaker(bind=engine))
+    engine.dispose()
+
+    print(f"{args.heavy_clients} clients on expensive routes, {args.cheap_clients} per cheap route, "
+          f"{args.seconds:.0f} s per mode")
+    print(f"{'mode':<10} | {'route':<12} | {'req/s':>7} | {'p50 ms':>8} | {'p99 ms':>8} | statuses")
+    on = replace(config, admission_control=True)
+    if args.routes is not None:
+        on = replace(on, admission_routes=args.routes)
+    # idle — дешёвые маршруты без нагрузки на дорогие, ориентир для остальных режимов
+    for mode, mode_config, heavy_clients in (("idle", config, 0), ("off", config, args.heavy_clients),
+                                             ("on", on, args.heavy_clients)):
+        app = journal.create_app(mode_config)
+        results = asyncio.run(load(app, data, heavy_clients, args.cheap_clients, args.seconds))
+        for name, _ in CHEAP + EXPENSIVE:
+            values, statuses = results.get(name, ([], Counter()))
+            codes = " ".join(f"{code}:{count}" for code, count in sorted(statuses.items()))
+            print(f"{mode:<10} | {name:<12} | {len(values) / args.seconds:>7.1f} | {percentile(values, 50):>8.1f} "
+                  f"| {percentile(values, 99):>8.1f} | {codes}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import insert, text
+
+from benchmarks._common import temp_engine, timed
+import archive
+import crud
+import database
+import export
+import rollups
+
+SUBJECTS = 12
+CLASS_SIZE = 30
+# Три учебных года; архивируются два прошлых
+FIRST_DAY = date(2022, 9, 1)
+CUTOFF = date(2024, 9, 1)
+YEARS = 3
+
+
+def seed(session_factory, students: int, grades: int):
+    rnd = random.Random(students)
+    with session_factory() as db:
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": f"C{i // CLASS_SIZE:03d}"} for i in range(students)
+        ])
+        batch = 50_000
+        for offset in range(0, grades, batch):
+            db.execute(insert(database.Grade), [
+                {
+                    "student_id": rnd.randint(1, students),
+                    "subject_id": rnd.randint(1, SUBJECTS),
+                    "grade": rnd.randint(1, 5),
+                    "date": FIRST_DAY + timedelta(days=365 * rnd.randrange(YEARS) + rnd.randint(0, 270)),
+                }
+                for _ in range(min(batch, grades - offset))
+            ])
+        db.commit()
+        rollups.rebuild(db)
+
+
+def table_size(db, table: str) -> tuple:
+    # Строки и байты таблицы вместе с её индексами (виртуальная таблица dbstat)
+    rows = db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar_one()
+    size = db.execute(text(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_schema WHERE tbl_name = :table)"
+    ), {"table": table}).scalar_one()
+    return rows, size or 0
+
+
+def queries(db, include_archived: bool = False):
+    # Запросы, которые платят за всю историю: фильтры списка оценок, отчёт класса, выгрузка.
+    # Списки читают только рабочую таблицу, поэтому с архивом не замеряются
+    first, last = date(2024, 10, 1), date(2024, 12, 31)
+    lists = [
+        ("grades by subject, page 50", lambda: crud.list_grades(db, None, 3, None, None, 5000, 100, None)),
+        ("grades by student", lambda: crud.list_grades(db, 7, None, None, None, 0, 1000, None)),
+        ("grades by dates", lambda: crud.list_grades(db, None, None, first, last, 0, 100, None)),
+    ]
+    return ([] if include_archived else lists) + [
+        ("student stats, dates", lambda: crud.student_stats(db, 7, first, last, include_archived)),
+        ("class report", lambda: crud.class_report(db, "C010", None, None, include_archived)),
+        ("class report, dates", lambda: crud.class_report(db, "C010", first, last, include_archived)),
+        ("export subject", lambda: db.execute(export.grades_query(None, 3, None, None, include_archived)).all()),
+    ]
+
+
+def measure(db, include_archived: bool = False) -> dict:
+    return {name: timed(fn)[0] for name, fn in queries(db, include_archived)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=2_000)
+    parser.add_argument("--grades", type=int, default=900_000)
+    parser.add_argument("--chunk-size", type=int, default=5_000)
+    args = parser.parse_args()
+
+    engine, session_factory = temp_engine("archive")
+    seed(session_factory, args.students, args.grades)
+    print(f"{args.students} students, {args.grades} grades over {YEARS} school years, archive before {CUTOFF}")
+    with session_factory() as db:
+        before_rows, before_size = table_size(db, "grades")
+        before = measure(db)
+        report = archive.archive_grades(db, CUTOFF, args.chunk_size)
+        print(f"archived {report.grades} grades in {report.chunks} chunks, {report.seconds} s "
+              f"({report.grades / report.seconds:,.0f} rows/s)")
+        after_rows, after_size = table_size(db, "grades")
+        archive_rows, archive_size = table_size(db, "grades_archive")
+        after = measure(db)
+        with_archive = measure(db, include_archived=True)
+
+        print(f"\n{'table':<16} | {'rows':>9} | {'MiB':>7}")
+        for name, rows, size in (("grades before", before_rows, before_size), ("grades after", after_rows, after_size),
+                                 ("grades_archive", archive_rows, archive_size)):
+            print(f"{name:<16} | {rows:>9} | {size / 2**20:>7.1f}")
+
+        print(f"\n{'query':<28} | {'before ms':>9} | {'after ms':>9} | {'+archive ms':>11}")
+        for name in before:
+            archived = f"{with_archive[name]:>11.2f}" if name in with_archive else f"{'-':>11}"
+            print(f"{name:<28} | {before[name]:>9.2f} | {after[name]:>9.2f} | {archived}")
+
+        # Выпуск класса пакетами против прежнего пути — delete_student на каждого ученика
+        report = archive.graduate_class(db, "C020", args.chunk_size)
+        print(f"\ngraduate C020: {report.students} students, {report.grades} grades, {report.chunks} chunks, "
+              f"{report.seconds * 1000:.1f} ms")
+        ms, _ = timed(lambda: [crud.delete_student(db, student.id) for student in
+                               db.query(database.Student).filter(database.Student.class_group == "C021").all()],
+                      repeat=1)
+        print(f"delete_student per student, C021: {ms:.1f} ms")
+        assert not rollups.verify(db)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
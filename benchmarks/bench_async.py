@@ -0,0 +1,135 @@
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks._common import temp_settings
+import async_api
+import database
+import main
+import rollups
+from settings import settings
+
+STUDENTS = 500
+SUBJECTS = 12
+GRADES = 50_000
+CLIENTS = [50, 200, 1000]
+REQUESTS = 3_000
+# Пул соединений не меньше пула потоков (40), иначе синхронный режим упирается в QueuePool timeout
+POOL = {"pool_size": 40, "max_overflow": 40, "pool_timeout": 5}
+
+
+def seed(session_factory):
+    rnd = random.Random(0)
+    with session_factory() as db:
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": "10A"} for i in range(STUDENTS)
+        ])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, STUDENTS),
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": date(2024, 9, 1) + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(GRADES)
+        ])
+        db.commit()
+        rollups.rebuild(db)
+
+
+def build_sync_app(session_factory):
+    app = FastAPI()
+    main.configure(app, settings)
+    app.include_router(main.router)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    return app
+
+
+def build_async_app(config):
+    async_engine = database.create_async_engine_from_settings(config)
+    sessions = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with sessions() as session:
+            yield session
+
+    app = FastAPI()
+    main.configure(app, config)
+    app.include_router(async_api.router)
+    app.dependency_overrides[database.get_async_db] = override_get_async_db
+    app.dependency_overrides[database.get_async_read_db] = override_get_async_db
+    return app
+
+
+async def run(app, clients: int):
+    rnd = random.Random(clients)
+    paths = [
+        rnd.choice(["/students/{}", "/students/{}/stats", "/grades/?student_id={}&limit=20"])
+        .format(rnd.randint(1, STUDENTS))
+        for _ in range(REQUESTS)
+    ]
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(clients)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(path):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    response.raise_for_status()
+                except Exception:
+                    # В синхронном режиме при нехватке соединений запросы падают по pool_timeout
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(path) for path in paths))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return (REQUESTS - errors) / elapsed, p50, p99, errors
+
+
+def main_():
+    config = temp_settings("async", **POOL)
+    engine = database.create_engine_from_settings(config)
+    database.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    seed(session_factory)
+    builders = {
+        "sync": lambda: build_sync_app(session_factory),
+        "async": lambda: build_async_app(config),
+    }
+
+    print(f"{'clients':>8} | {'mode':>6} | {'req/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'errors':>6}")
+    for clients in CLIENTS:
+        for mode, build in builders.items():
+            # Новое приложение на каждый прогон: асинхронный пул привязан к своему event loop
+            rps, p50, p99, errors = asyncio.run(run(build(), clients))
+            print(f"{clients:>8} | {mode:>6} | {rps:>8.0f} | {p50:>8.1f} | {p99:>8.1f} | {errors:>6}")
+
+
+if __name__ == "__main__":
+    main_()
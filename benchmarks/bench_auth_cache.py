@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from benchmarks._common import count_queries, temp_engine
+import auth
+import database
+import main
+from settings import settings
+
+REQUESTS = 2_000
+
+
+def main_():
+    engine, session_factory = temp_engine("auth")
+    with session_factory() as db:
+        db.add(database.Teacher(
+            email="teacher@example.com",
+            full_name="Bench Teacher",
+            hashed_password=auth.get_password_hash("password"),
+        ))
+        db.commit()
+
+    app = FastAPI()
+    main.configure(app, settings)  # кеш токенов приложения — auth.token_cache
+    app.include_router(main.router)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    client = TestClient(app)
+    token = auth.create_access_token({"sub": "teacher@example.com"}, timedelta(minutes=30))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    print(f"{'cache':>6} | {'req/s':>8} | {'us/req':>8} | {'SQL':>6} | hits/misses")
+    for enabled in (False, True):
+        auth.token_cache.clear()
+        auth.token_cache.enabled = enabled
+        with count_queries(engine) as queries:
+            started = time.perf_counter()
+            for _ in range(REQUESTS):
+                client.get("/teachers/me/", headers=headers).raise_for_status()
+            elapsed = time.perf_counter() - started
+        stats = auth.token_cache.stats()
+        print(f"{'on' if enabled else 'off':>6} | {REQUESTS / elapsed:>8.0f} | {elapsed / REQUESTS * 1e6:>8.0f} "
+              f"| {queries.count:>6} | {stats['hits']}/{stats['misses']}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,71 @@
+import random
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, insert, select
+
+from benchmarks._common import count_queries, temp_engine
+import database
+from main import app
+
+STUDENTS = 300
+SUBJECTS = 12
+GRADES = 10_000
+
+
+def main():
+    engine, session_factory = temp_engine("bulk")
+    with session_factory() as db:
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": "10A"} for i in range(STUDENTS)
+        ])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.commit()
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    client = TestClient(app)
+
+    rnd = random.Random(0)
+    start = date(2024, 9, 1)
+    payload = [
+        {
+            "student_id": rnd.randint(1, STUDENTS),
+            "subject_id": rnd.randint(1, SUBJECTS),
+            "grade": rnd.randint(1, 5),
+            "date": str(start + timedelta(days=rnd.randint(0, 270))),
+        }
+        for _ in range(GRADES)
+    ]
+
+    with count_queries(engine) as queries:
+        started = time.perf_counter()
+        response = client.post("/grades/bulk", json=payload)
+        elapsed = time.perf_counter() - started
+    response.raise_for_status()
+
+    with session_factory() as db:
+        stored = db.execute(select(func.count(database.Grade.id))).scalar_one()
+    print(f"bulk: {response.json()['inserted']} grades in {elapsed * 1000:.1f} ms "
+          f"({GRADES / elapsed:,.0f} grades/s), {queries.count} SQL statements, {stored} stored")
+
+    # Для сравнения — те же оценки по одной через POST /grades/
+    sample = payload[:500]
+    started = time.perf_counter()
+    for item in sample:
+        client.post("/grades/", json=item).raise_for_status()
+    elapsed = time.perf_counter() - started
+    print(f"single: {len(sample)} grades in {elapsed * 1000:.1f} ms ({len(sample) / elapsed:,.0f} grades/s)")
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
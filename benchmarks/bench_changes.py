@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks._common import temp_settings, timed
+import changes
+import crud
+import database
+import models
+
+STUDENTS = 1_000
+CLASSES = 25
+SUBJECTS = 12
+FIRST_DAY = date(2024, 9, 2)
+DAYS = 120
+
+
+def seed(journal_db: database.Database, grades: int):
+    rnd = random.Random(grades)
+    with journal_db.SessionLocal() as db:
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": f"class-{i % CLASSES}"} for i in range(STUDENTS)
+        ])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, STUDENTS),
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": FIRST_DAY + timedelta(days=rnd.randrange(DAYS)),
+            }
+            for _ in range(grades)
+        ])
+        db.commit()
+
+
+def polling_cost(journal_db: database.Database) -> float:
+    # Как сейчас находит новые оценки панель учителя: GET /grades/ по предмету за последние дни
+    with journal_db.SessionLocal() as db:
+        ms, _ = timed(lambda: crud.list_grades(
+            db, None, 3, FIRST_DAY + timedelta(days=DAYS - 7), None, 0, 100, None, True
+        ), repeat=20)
+    return ms
+
+
+async def fanout(journal_db: database.Database, subscribers: int, writes: int, rate: float, poll_ms: float):
+    # subscribers потоков с фильтром по классу; писатель в отдельном потоке создаёт оценки с частотой rate
+    broadcaster = changes.Broadcaster(changes.reader(journal_db), poll_ms, queue_size=1000)
+    rnd = random.Random(subscribers)
+    committed = {}  # grade_id -> время commit
+    latencies = []
+    expected = 0
+    received = asyncio.Event()
+
+    async def consume(class_group: str):
+        events = changes.stream(broadcaster, None, heartbeat=60, class_group=class_group)
+        await anext(events)  # retry
+        async for event in events:
+            payload = json.loads(event.split(b"data: ", 1)[1])
+            latencies.append(time.perf_counter() - committed[payload["grade_id"]])
+            if len(latencies) == expected:
+                received.set()
+
+    clients = [asyncio.create_task(consume(f"class-{i % CLASSES}")) for i in range(subscribers)]
+    while broadcaster.position is None or broadcaster.subscribers() < subscribers:
+        await asyncio.sleep(0.01)
+
+    students = [rnd.randint(1, STUDENTS) for _ in range(writes)]
+    # Подписчиков на класс ученика: каждый получит событие
+    per_class = [sum(1 for i in range(subscribers) if i % CLASSES == c) for c in range(CLASSES)]
+    expected = sum(per_class[(student - 1) % CLASSES] for student in students)
+
+    def writer():
+        with journal_db.SessionLocal() as db:
+            for student in students:
+                grade = crud.create_grade(db, models.GradeCreate(
+                    student_id=student, subject_id=3, grade=5, date=FIRST_DAY + timedelta(days=DAYS)
+                ))
+                committed[grade.id] = time.perf_counter()
+                time.sleep(1 / rate)
+
+    cpu = time.process_time()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    await asyncio.wait_for(received.wait(), timeout=60 + writes / rate)
+    cpu = time.process_time() - cpu
+    thread.join()
+    for client in clients:
+        client.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    latencies.sort()
+    return latencies, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1_000, 5_000])
+    parser.add_argument("--grades", type=int, default=200_000, help="grades already in the journal")
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50.0, help="grade writes per second")
+    parser.add_argument("--poll-ms", type=float, default=500.0)
+    args = parser.parse_args()
+
+    journal_db = database.Database(temp_settings("changes"))
+    journal_db.ensure_schema()
+    seed(journal_db, args.grades)
+    poll_ms = polling_cost(journal_db)
+    print(f"{args.grades} grades, {args.writes} writes at {args.rate:g}/s, change poll every {args.poll_ms:g} ms")
+    print(f"polling GET /grades/ (subject, last 7 days): {poll_ms:.2f} ms per request; "
+          f"stream CPU includes the grade writes themselves")
+    print(f"{'subscribers':>11} | {'poll CPU ms/s':>13} | {'events':>7} | {'stream CPU ms/s':>15} | "
+          f"{'p50 ms':>7} | {'p99 ms':>7}")
+    for subscribers in args.subscribers:
+        latencies, cpu = asyncio.run(fanout(journal_db, subscribers, args.writes, args.rate, args.poll_ms))
+        seconds = args.writes / args.rate
+        # Опрос каждым клиентом раз в poll-интервал против одного опроса журнала на процесс
+        polling = subscribers * (1000 / args.poll_ms) * poll_ms
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000
+        print(f"{subscribers:>11} | {polling:>13.0f} | {len(latencies):>7} | {cpu / seconds * 1000:>15.0f} | "
+              f"{p50:>7.1f} | {p99:>7.1f}")
+    journal_db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks._common import count_queries, temp_engine, timed
+import crud
+import database
+import rollups
+import stats
+
+SUBJECTS = 12
+CLASS_SIZE = 30
+
+
+def seed(session_factory, students: int, grades: int):
+    rnd = random.Random(students)
+    start = date(2024, 9, 1)
+    with session_factory() as db:
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": f"C{i // CLASS_SIZE:03d}"} for i in range(students)
+        ])
+        batch = 50_000
+        for offset in range(0, grades, batch):
+            db.execute(insert(database.Grade), [
+                {
+                    "student_id": rnd.randint(1, students),
+                    "subject_id": rnd.randint(1, SUBJECTS),
+                    "grade": rnd.randint(1, 5),
+                    "date": start + timedelta(days=rnd.randint(0, 270)),
+                }
+                for _ in range(min(batch, grades - offset))
+            ])
+        db.commit()
+        rollups.rebuild(db)
+
+
+def per_student_report(db, class_group: str, start_date=None, end_date=None):
+    # Прежний способ: /students/{id}/stats на каждого ученика класса, ранжирование на клиенте.
+    # Гистограмм по предметам так не получить вовсе
+    students = db.query(database.Student).filter(database.Student.class_group == class_group).all()
+    averages = []
+    for student in students:
+        result = stats.student_stats(db, student, start_date, end_date)
+        averages.append((result.get("average_grade"), student.id))
+    averages.sort(key=lambda item: -(item[0] or 0))
+    return averages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=2_000)
+    parser.add_argument("--grades", type=int, default=500_000)
+    args = parser.parse_args()
+
+    engine, session_factory = temp_engine("class-report")
+    seed(session_factory, args.students, args.grades)
+    class_group = "C010"
+    print(f"{args.students} students, {args.grades} grades, class of {CLASS_SIZE}")
+    print(f"{'variant':<28} | {'queries':>7} | {'ms':>8}")
+    with session_factory() as db:
+        first, last = date(2024, 10, 1), date(2024, 12, 31)
+        variants = [
+            ("per-student /stats", lambda: per_student_report(db, class_group)),
+            ("class report", lambda: crud.class_report(db, class_group, None, None)),
+            ("per-student /stats, dates", lambda: per_student_report(db, class_group, first, last)),
+            ("class report, dates", lambda: crud.class_report(db, class_group, first, last)),
+        ]
+        for name, fn in variants:
+            with count_queries(engine) as queries:
+                fn()
+            ms, _ = timed(fn)
+            print(f"{name:<28} | {queries.count:>7} | {ms:>8.2f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from benchmarks._common import count_queries, temp_engine
+import database
+import rollups
+from main import app
+
+STUDENTS = 500
+SUBJECTS = 12
+GRADES = 50_000
+DASHBOARDS = 10  # каждая панель следит за оценками своего ученика
+
+
+def seed(session_factory):
+    rnd = random.Random(0)
+    start = date(2024, 9, 1)
+    with session_factory() as db:
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": "10A"} for i in range(STUDENTS)
+        ])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, STUDENTS),
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": start + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(GRADES)
+        ])
+        db.commit()
+        rollups.rebuild(db)
+
+
+def poll(client, engine, rounds: int, write_every: int, conditional: bool):
+    urls = ["/students/", "/subjects/"] + [f"/grades/?student_id={i}" for i in range(1, DASHBOARDS + 1)]
+    etags = {}
+    sent = not_modified = 0
+    started = time.perf_counter()
+    with count_queries(engine) as queries:
+        for round_no in range(1, rounds + 1):
+            for url in urls:
+                headers = {"If-None-Match": etags[url]} if conditional and url in etags else {}
+                response = client.get(url, headers=headers)
+                sent += len(response.content)
+                not_modified += response.status_code == 304
+                etags[url] = response.headers.get("ETag", etags.get(url))
+            if round_no % write_every == 0:
+                client.post("/grades/", json={
+                    "student_id": 1, "subject_id": 1, "grade": 5, "date": str(date(2025, 1, 1))
+                })
+    return queries.count, sent, not_modified, time.perf_counter() - started, rounds * len(urls)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--write-every", type=int, default=20)
+    args = parser.parse_args()
+
+    engine, session_factory = temp_engine("conditional-get")
+    seed(session_factory)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    client = TestClient(app)
+
+    print(f"{args.rounds} rounds x {2 + DASHBOARDS} URLs, one grade write every {args.write_every} rounds")
+    print(f"{'mode':<13} | {'requests':>8} | {'304':>6} | {'queries':>8} | {'KiB sent':>9} | {'s':>6}")
+    for name, conditional in (("plain", False), ("If-None-Match", True)):
+        queries, sent, cached, seconds, requests = poll(client, engine, args.rounds, args.write_every, conditional)
+        print(f"{name:<13} | {requests:>8} | {cached:>6} | {queries:>8} | {sent / 1024:>9.1f} | {seconds:>6.2f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
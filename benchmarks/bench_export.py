@@ -0,0 +1,77 @@
+import json
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks._common import temp_engine
+import database
+import export
+import models
+
+SIZES = [10_000, 100_000, 400_000]
+
+
+def seed(session_factory, size: int):
+    rnd = random.Random(size)
+    start = date(2024, 9, 1)
+    with session_factory() as db:
+        db.execute(insert(database.Student), [{"full_name": f"Student {i}", "class_group": "10A"} for i in range(500)])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(12)])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, 500),
+                "subject_id": rnd.randint(1, 12),
+                "grade": rnd.randint(1, 5),
+                "date": start + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(size)
+        ])
+        db.commit()
+
+
+def legacy(session_factory):
+    # Прежний путь: GET /grades/?limit=N — все ORM-объекты и весь JSON в памяти
+    with session_factory() as db:
+        grades = db.query(database.Grade).all()
+        body = json.dumps([models.Grade.model_validate(g, from_attributes=True).model_dump(mode="json") for g in grades])
+        return len(body)
+
+
+def streamed(session_factory, fmt: str):
+    total = 0
+    with session_factory() as db:
+        for chunk in export.encode_rows(db, export.grades_query(), fmt):
+            total += len(chunk)
+    return total
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20, size / 2 ** 20
+
+
+def main():
+    print(f"{'grades':>8} | {'mode':>7} | {'seconds':>7} | {'peak MiB':>8} | {'body MiB':>8}")
+    for size in SIZES:
+        engine, session_factory = temp_engine(f"export-{size}")
+        seed(session_factory, size)
+        for mode, fn in (
+                ("legacy", lambda: legacy(session_factory)),
+                ("ndjson", lambda: streamed(session_factory, "ndjson")),
+                ("csv", lambda: streamed(session_factory, "csv")),
+        ):
+            elapsed, peak, body = measure(fn)
+            print(f"{size:>8} | {mode:>7} | {elapsed:>7.2f} | {peak:>8.1f} | {body:>8.1f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
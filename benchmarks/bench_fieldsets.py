@@ -0,0 +1,111 @@
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from benchmarks._common import count_queries, temp_engine
+import database
+from main import app
+
+STUDENTS = 1_000
+CLASSES = 40
+SUBJECTS = 12
+GRADES = 100_000
+
+
+def seed(session_factory):
+    rnd = random.Random(0)
+    start = date(2024, 9, 1)
+    with session_factory() as db:
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": f"class-{i % CLASSES}"} for i in range(STUDENTS)
+        ])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, STUDENTS),
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": start + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(GRADES)
+        ])
+        db.commit()
+
+
+# Страница журнала: оценки по предмету, для каждой строки — имя ученика и название предмета
+def per_row(client, params):
+    # Как сейчас: список оценок и по два запроса на строку
+    responses = [client.get("/grades/", params=params)]
+    for grade in responses[0].json():
+        responses.append(client.get(f"/students/{grade['student_id']}"))
+        responses.append(client.get(f"/subjects/{grade['subject_id']}"))
+    return responses
+
+
+def per_id(client, params):
+    # Клиент с кешем на странице: по запросу на каждого разного ученика и предмет
+    responses = [client.get("/grades/", params=params)]
+    grades = responses[0].json()
+    for student_id in sorted({grade["student_id"] for grade in grades}):
+        responses.append(client.get(f"/students/{student_id}"))
+    for subject_id in sorted({grade["subject_id"] for grade in grades}):
+        responses.append(client.get(f"/subjects/{subject_id}"))
+    return responses
+
+
+def include(client, params):
+    return [client.get("/grades/", params={**params, "include": "student,subject"})]
+
+
+def fields(client, params):
+    return [client.get("/grades/", params={**params, "fields": "grade,date,student.full_name,subject.name"})]
+
+
+def render(client, engine, pattern, params, repeat: int):
+    pattern(client, params)  # прогрев: типы ответа строятся на первом запросе
+    with count_queries(engine) as queries:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            responses = pattern(client, params)
+        ms = (time.perf_counter() - started) * 1000 / repeat
+    return len(responses), queries.count // repeat, sum(len(r.content) for r in responses), ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine, session_factory = temp_engine("fieldsets")
+    seed(session_factory)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    client = TestClient(app)
+    patterns = [("per-row calls", per_row), ("per-id calls", per_id), ("include", include), ("fields", fields)]
+
+    print(f"{GRADES} grades, {STUDENTS} students, {SUBJECTS} subjects; gradebook page = grades of one subject")
+    print(f"{'rows':>5} | {'pattern':<13} | {'requests':>8} | {'queries':>7} | {'KiB':>8} | {'ms':>8}")
+    for limit in args.page_sizes:
+        params = {"subject_id": 3, "limit": limit}
+        for name, pattern in patterns:
+            requests, queries, sent, ms = render(client, engine, pattern, params, args.repeat)
+            print(f"{limit:>5} | {name:<13} | {requests:>8} | {queries:>7} | {sent / 1024:>8.1f} | {ms:>8.1f}")
+    app.dependency_overrides.clear()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
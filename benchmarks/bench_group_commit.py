@@ -0,0 +1,96 @@
+import argparse
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks._common import temp_settings
+import crud
+import database
+import groupcommit
+import models
+import rollups
+
+SECONDS = 3.0
+
+
+def percentile(values, point: int) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * point // 100)] * 1000 if values else 0.0
+
+
+def run(session_factory, create, clients: int):
+    # clients потоков, как запросы POST /grades/ в пуле потоков: каждый пишет оценку и ждёт подтверждения
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + SECONDS
+    grade = models.GradeCreate(student_id=1, subject_id=1, grade=5, date=date(2024, 9, 2))
+
+    def client():
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            create(grade)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with session_factory() as db:
+        assert db.execute(select(func.count(database.Grade.id))).scalar_one() >= len(latencies)
+        assert not rollups.verify(db)
+    return latencies
+
+
+def setup(name: str, synchronous: str):
+    config = temp_settings(name, sqlite_synchronous=synchronous)
+    engine = database.create_engine_from_settings(config)
+    database.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with session_factory() as db:
+        db.add(database.Student(full_name="Bench Student", class_group="10A"))
+        db.add(database.Subject(name="Mathematics"))
+        db.commit()
+    return engine, session_factory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--interval-ms", type=float, nargs="+", default=[0.0, 2.0])
+    parser.add_argument("--synchronous", default="FULL", help="PRAGMA synchronous: FULL fsyncs every commit")
+    args = parser.parse_args()
+
+    print(f"POST /grades/ path, {SECONDS:.0f} s per run, PRAGMA synchronous={args.synchronous}")
+    print(f"{'mode':<22} | {'clients':>7} | {'grades/s':>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'avg batch':>9}")
+    for clients in args.clients:
+        engine, session_factory = setup(f"commit-{clients}", args.synchronous)
+
+        def per_request(grade):
+            with session_factory() as db:
+                crud.create_grade(db, grade)
+
+        modes = [("commit per request", per_request, None)]
+        for interval in args.interval_ms:
+            writer = groupcommit.GradeWriter(session_factory, args.batch_size, interval, max_pending=100_000)
+            modes.append((f"group commit {interval:g} ms", writer.create, writer))
+
+        for name, create, writer in modes:
+            before = groupcommit.stats.batch_size.count, groupcommit.stats.batch_size.sum
+            latencies = run(session_factory, create, clients)
+            batches = groupcommit.stats.batch_size.count - before[0]
+            batch = f"{(groupcommit.stats.batch_size.sum - before[1]) / batches:>9.1f}" if writer else f"{'1':>9}"
+            print(f"{name:<22} | {clients:>7} | {len(latencies) / SECONDS:>9.0f} | {percentile(latencies, 50):>7.2f} "
+                  f"| {percentile(latencies, 95):>7.2f} | {batch}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import random
+import resource
+import tempfile
+from datetime import date, timedelta
+
+from benchmarks._common import temp_engine
+import importer
+import rollups
+
+CLASSES = [f"{year}{letter}" for year in range(5, 12) for letter in "ABCD"]
+SUBJECTS = [f"Subject {i}" for i in range(30)]
+
+
+def write_csv(path: str, rows: int, students: int):
+    rnd = random.Random(rows)
+    start = date(2024, 9, 1)
+    roster = [(f"Student {i}", CLASSES[i % len(CLASSES)]) for i in range(students)]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("full_name,class_group,subject,grade,date\n")
+        for _ in range(rows):
+            full_name, class_group = rnd.choice(roster)
+            day = start + timedelta(days=rnd.randint(0, 270))
+            f.write(f"{full_name},{class_group},{rnd.choice(SUBJECTS)},{rnd.randint(1, 5)},{day}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--students", type=int, default=20_000)
+    parser.add_argument("--chunk-size", type=int, default=5_000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="journal-"), "gradebook.csv")
+    write_csv(path, args.rows, args.students)
+    engine, session_factory = temp_engine("import")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(path, "rb") as stream, session_factory() as db:
+        report = importer.import_csv(db, stream, args.chunk_size)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with session_factory() as db:
+        drift = rollups.verify(db)
+
+    print(f"file: {os.path.getsize(path) / 2 ** 20:.1f} MiB, {report.rows:,} rows, chunk {args.chunk_size}")
+    print(f"imported in {report.seconds:.1f} s: {report.rows_per_sec:,} rows/s, "
+          f"{report.students_created:,} students, {report.subjects_created} subjects, "
+          f"{report.grades_inserted:,} grades, {report.errors_count} errors")
+    print(f"max RSS growth during import: {(rss_after - rss_before) / 1024:.1f} MiB; rollup drift: {len(drift)}")
+
+
+if __name__ == "__main__":
+    main()
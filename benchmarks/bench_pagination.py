@@ -0,0 +1,77 @@
+import random
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+from benchmarks._common import temp_engine, timed
+import database
+from main import app
+from pagination import encode_cursor
+
+STUDENTS = 2_000
+SUBJECTS = 12
+GRADES = 300_000
+PAGE = 100
+PAGES = [1, 100, 1_000, 2_999]
+
+
+def main():
+    engine, session_factory = temp_engine("pagination")
+    rnd = random.Random(0)
+    start = date(2024, 9, 1)
+    with session_factory() as db:
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": "10A"} for i in range(STUDENTS)
+        ])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, STUDENTS),
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": start + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(GRADES)
+        ])
+        db.commit()
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    client = TestClient(app)
+
+    print(f"{'page':>6} | {'offset ms':>10} | {'cursor ms':>10}")
+    with session_factory() as db:
+        for page in PAGES:
+            skip = (page - 1) * PAGE
+            offset_ms, _ = timed(lambda: client.get("/grades/", params={"skip": skip, "limit": PAGE}))
+
+            # Курсор страницы N — ключ последней строки страницы N-1
+            params = {"limit": PAGE}
+            if skip:
+                last = db.execute(
+                    select(database.Grade.date, database.Grade.id)
+                    .order_by(database.Grade.date, database.Grade.id)
+                    .offset(skip - 1).limit(1)
+                ).one()
+                params["after"] = encode_cursor(last.date, last.id)
+            cursor_ms, _ = timed(lambda: client.get("/grades/", params=params))
+            print(f"{page:>6} | {offset_ms:>10.2f} | {cursor_ms:>10.2f}")
+
+    # Фильтр по студенту и диапазону дат использует составной индекс (student_id, date)
+    filtered_ms, _ = timed(lambda: client.get("/grades/", params={
+        "student_id": 7, "start_date": "2024-10-01", "end_date": "2024-12-31"
+    }))
+    print(f"filter student_id + date range: {filtered_ms:.2f} ms")
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
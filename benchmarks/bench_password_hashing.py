@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import Future
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks._common import temp_settings
+import auth
+import database
+import main
+
+LOGINS = 200
+READS = 400
+# Одновременных клиентов меньше, чем соединений в пуле (80)
+LOGIN_CLIENTS = 50
+READ_CLIENTS = 10
+ROUNDS = 10
+
+
+class InlineHasher(auth.PasswordHasher):
+    # Прежнее поведение: bcrypt прямо в потоке запроса из общего пула
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        started = time.perf_counter()
+        future.set_result(fn(*args))
+        self._run_times.append(time.perf_counter() - started)
+        self._total_times.append(time.perf_counter() - started)
+        return future
+
+
+def build_app(session_factory, config, hasher: auth.PasswordHasher):
+    app = FastAPI()
+    main.configure(app, config)
+    app.state.password_hasher = hasher
+    app.include_router(main.router)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    return app
+
+
+async def storm(app):
+    read_latencies = []
+    statuses = {}
+    login_slots = asyncio.Semaphore(LOGIN_CLIENTS)
+    read_slots = asyncio.Semaphore(READ_CLIENTS)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login():
+            async with login_slots:
+                response = await client.post(
+                    "/token", data={"username": "teacher@example.com", "password": "password"}
+                )
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def read():
+            await asyncio.sleep(0.05)
+            async with read_slots:
+                started = time.perf_counter()
+                (await client.get("/students/1")).raise_for_status()
+                read_latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*[login() for _ in range(LOGINS)], *[read() for _ in range(READS)])
+    return auth.percentiles(read_latencies), statuses
+
+
+def main_():
+    config = temp_settings("hashing", pool_size=40, max_overflow=40)
+    engine = database.create_engine_from_settings(config)
+    database.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    hasher = auth.PasswordHasher(workers=2, max_pending=16, rounds=ROUNDS)
+    with session_factory() as db:
+        db.add(database.Teacher(
+            email="teacher@example.com", full_name="Bench Teacher", hashed_password=hasher.hash("password")
+        ))
+        db.add(database.Student(full_name="Bench Student", class_group="10A"))
+        db.commit()
+
+    for name, hasher in (
+            ("inline", InlineHasher(workers=1, max_pending=0, rounds=ROUNDS)),
+            ("pool", auth.PasswordHasher(workers=2, max_pending=16, rounds=ROUNDS)),
+    ):
+        reads, statuses = asyncio.run(storm(build_app(session_factory, config, hasher)))
+        hashing = hasher.stats()
+        print(f"{name}: cheap read p50/p95/p99 = "
+              f"{reads['p50']:.1f}/{reads['p95']:.1f}/{reads['p99']:.1f} ms; /token statuses {statuses}")
+        print(f"{'':>{len(name)}}  bcrypt run p50/p95/p99 = "
+              + "/".join(f"{v:.1f}" for v in hashing["run_ms"].values())
+              + " ms; queue+run = "
+              + "/".join(f"{v:.1f}" for v in hashing["total_ms"].values()) + " ms")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,83 @@
+import argparse
+import random
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import insert
+
+from benchmarks._common import count_queries, temp_engine, timed
+import bulk
+import crud
+import database
+import models
+import refcache
+
+SUBJECTS = 20
+
+
+def seed(session_factory, students: int):
+    with session_factory() as db:
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": "10A"} for i in range(students)
+        ])
+        db.commit()
+
+
+def measure(engine, fn, repeat: int):
+    with count_queries(engine) as queries:
+        fn()
+    ms, _ = timed(fn, repeat=repeat)
+    return queries.count, ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    engine, session_factory = temp_engine("refcache")
+    seed(session_factory, args.students)
+    rnd = random.Random(1)
+    grade = models.GradeCreate(student_id=args.students // 2, subject_id=3, grade=4, date=date(2024, 9, 2))
+    batch = [
+        models.GradeCreate(student_id=rnd.randint(1, args.students), subject_id=rnd.randint(1, SUBJECTS),
+                           grade=rnd.randint(1, 5), date=date(2024, 9, 2))
+        for _ in range(1000)
+    ]
+    operations = [
+        ("check_grade_refs", lambda db: crud.check_grade_refs(db, grade), args.repeat),
+        ("create_grade", lambda db: crud.create_grade(db, grade), 20),
+        ("validate 1000 grades", lambda db: bulk.validate_grades(db, batch), 20),
+        ("list_subjects (fast)", lambda db: crud.list_subjects(db, 0, 100, None, True), args.repeat),
+    ]
+
+    print(f"{args.students} students, {SUBJECTS} subjects")
+    print(f"{'operation':<22} | {'no cache q':>10} {'ms':>7} | {'cache q':>7} {'ms':>7}")
+    with session_factory() as db:
+        for name, operation, repeat in operations:
+            results = []
+            for enabled in (False, True):
+                refcache.reference_caches.enabled = enabled
+                refcache.warm(db)
+                results.append(measure(engine, lambda: operation(db), repeat))
+            (off_q, off_ms), (on_q, on_ms) = results
+            print(f"{name:<22} | {off_q:>10} {off_ms:>7.3f} | {on_q:>7} {on_ms:>7.3f}")
+
+        # Цена сверки версий: полное перечитывание id после записи другого процесса
+        cache = refcache.ReferenceCache(check_seconds=0)
+        started = time.perf_counter()
+        cache.refresh(db)
+        reload_ms = (time.perf_counter() - started) * 1000
+        ids = cache._ids[refcache.STUDENTS]
+        as_set = set(range(1, args.students + 1))
+        set_bytes = sys.getsizeof(as_set) + sum(sys.getsizeof(i) for i in as_set)
+        print(f"\nfull reload: {reload_ms:.1f} ms; student ids: bitmap {sys.getsizeof(ids._bits) / 1024:.1f} KiB, "
+              f"set of int {set_bytes / 1024:.0f} KiB")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+
+from sqlalchemy import insert, or_, select
+
+from benchmarks import datagen
+from benchmarks._common import temp_engine
+import database
+import search
+
+CYRILLIC_FIRST = ["Александр", "Мария", "Иван", "Анна", "Дмитрий", "Елена", "Сергей", "Ольга", "Никита", "Дарья"]
+CYRILLIC_LAST = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов", "Новиков"]
+# Как набирает пользователь: короткие префиксы, части фамилий, имя с фамилией, класс, кириллица
+QUERIES = [
+    "i", "Iv", "iva", "ivan", "Ivanov", "Ivanov Mar", "ova", "petrov anna", "kuzn", "S01-05", "S03",
+    "Ив", "Иван", "иванова мария", "соко", "ikhail", "zzz",
+]
+
+
+def seed(session_factory, students: int):
+    rnd = random.Random(students)
+    rows = []
+    for i in range(students):
+        if rnd.random() < 0.3:
+            name = f"{rnd.choice(CYRILLIC_LAST)} {rnd.choice(CYRILLIC_FIRST)}"
+        else:
+            name = f"{rnd.choice(datagen.LAST_NAMES)} {rnd.choice(datagen.FIRST_NAMES)}"
+        rows.append({"full_name": name, "class_group": datagen.class_group(i)})
+    with session_factory() as db:
+        started = time.perf_counter()
+        db.execute(insert(database.Student), rows)
+        db.commit()
+        return time.perf_counter() - started
+
+
+def like_scan(db, q: str, limit: int):
+    # Без индекса: LIKE '%слово%' по каждому слову — полный просмотр students
+    conditions = [
+        or_(database.Student.full_name.like(f"%{w}%"), database.Student.class_group.like(f"%{w}%")) for w in q.split()
+    ]
+    return db.execute(
+        select(database.Student.id, database.Student.full_name, database.Student.class_group)
+        .where(*conditions).order_by(database.Student.full_name).limit(limit)
+    ).all()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    engine, session_factory = temp_engine("search")
+    seconds = seed(session_factory, args.students)
+    print(f"{args.students} students inserted with the FTS triggers in {seconds:.2f} s")
+    print(f"{'query':<16} | {'hits':>5} | {'fts p50':>8} | {'fts p95':>8} | {'LIKE p50':>8} | {'LIKE p95':>8}")
+    overall = {"fts": [], "like": []}
+    with session_factory() as db:
+        for q in QUERIES:
+            timings = {"fts": [], "like": []}
+            for _ in range(args.repeat):
+                for name, fn in (("fts", search.search_students), ("like", like_scan)):
+                    started = time.perf_counter()
+                    rows = fn(db, q, args.limit)
+                    timings[name].append(time.perf_counter() - started)
+                    if name == "fts":
+                        hits = len(rows)
+            for name in overall:
+                overall[name] += timings[name]
+            fts, like = percentiles(timings["fts"]), percentiles(timings["like"])
+            print(f"{q:<16} | {hits:>5} | {fts[0]:>8.2f} | {fts[1]:>8.2f} | {like[0]:>8.2f} | {like[1]:>8.2f}")
+    fts, like = percentiles(overall["fts"]), percentiles(overall["like"])
+    print(f"{'all queries':<16} | {'':>5} | {fts[0]:>8.2f} | {fts[1]:>8.2f} | {like[0]:>8.2f} | {like[1]:>8.2f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import random
+from datetime import date, timedelta
+from typing import List
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+
+from benchmarks._common import temp_engine, timed
+import crud
+import database
+import models
+from main import app
+from settings import settings
+
+GRADES = 50_000
+LIMITS = [100, 1_000]
+
+
+def seed(session_factory):
+    rnd = random.Random(0)
+    start = date(2024, 9, 1)
+    with session_factory() as db:
+        db.execute(insert(database.Student), [{"full_name": f"Student {i}", "class_group": "10A"} for i in range(500)])
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(12)])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, 500),
+                "subject_id": rnd.randint(1, 12),
+                "grade": rnd.randint(1, 5),
+                "date": start + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(GRADES)
+        ])
+        db.commit()
+
+
+def main():
+    engine, session_factory = temp_engine("serialization")
+    seed(session_factory)
+    # Так FastAPI обрабатывает response_model: валидация ORM-объектов, затем сериализация
+    response_model = TypeAdapter(List[models.Grade])
+
+    def orm_path(db, limit):
+        grades, _ = crud.list_grades(db, None, None, None, None, 0, limit, None)
+        return response_model.dump_json(response_model.validate_python(grades))
+
+    def fast_path(db, limit):
+        grades, _ = crud.list_grades(db, None, None, None, None, 0, limit, None, fast=True)
+        return grades
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    client = TestClient(app)
+
+    print("read_grades, microseconds per row")
+    print(f"{'limit':>6} | {'orm':>7} {'fast':>7} | {'http orm':>9} {'http fast':>9}")
+    for limit in LIMITS:
+        with session_factory() as db:
+            assert orm_path(db, limit) == fast_path(db, limit)
+            orm_ms, _ = timed(lambda: (orm_path(db, limit), db.expunge_all()), repeat=20)
+            fast_ms, _ = timed(lambda: fast_path(db, limit), repeat=20)
+        http = {}
+        for fast in (False, True):
+            settings.fast_lists = fast
+            http[fast], _ = timed(lambda: client.get("/grades/", params={"limit": limit}), repeat=20)
+        settings.fast_lists = False
+        per_row = [ms * 1000 / limit for ms in (orm_ms, fast_ms, http[False], http[True])]
+        print(f"{limit:>6} | {per_row[0]:>7.2f} {per_row[1]:>7.2f} | {per_row[2]:>9.2f} {per_row[3]:>9.2f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks._common import temp_settings
+import database
+
+WRITERS = 8
+READERS = 8
+SECONDS = 3.0
+
+
+def run(write_engine, read_engine):
+    database.Base.metadata.create_all(bind=write_engine)
+    writes = sessionmaker(bind=write_engine)
+    reads = sessionmaker(bind=read_engine)
+    with writes() as db:
+        db.add(database.Student(full_name="Bench Student", class_group="10A"))
+        db.add(database.Subject(name="Mathematics"))
+        db.commit()
+
+    counters = {"writes": 0, "reads": 0, "locked": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + SECONDS
+
+    def writer():
+        while time.perf_counter() < deadline:
+            try:
+                with writes() as db:
+                    db.add(database.Grade(student_id=1, subject_id=1, grade=5, date=date.today()))
+                    db.commit()
+                key = "writes"
+            except OperationalError:
+                key = "locked"
+            with lock:
+                counters[key] += 1
+
+    def reader():
+        while time.perf_counter() < deadline:
+            try:
+                with reads() as db:
+                    db.execute(select(func.count(database.Grade.id))).scalar_one()
+                key = "reads"
+            except OperationalError:
+                key = "locked"
+            with lock:
+                counters[key] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(WRITERS)]
+    threads += [threading.Thread(target=reader) for _ in range(READERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counters
+
+
+def main():
+    # Прежняя конфигурация: create_engine без PRAGMA, один пул на чтение и запись
+    plain = create_engine(
+        temp_settings("plain").database_url,
+        connect_args={"check_same_thread": False, "timeout": 0.1},
+    )
+    baseline = run(plain, plain)
+
+    config = temp_settings("factory")
+    tuned = run(
+        database.create_engine_from_settings(config),
+        database.create_engine_from_settings(config, read_only=True),
+    )
+
+    print(f"{'engine':>8} | {'writes/s':>9} | {'reads/s':>9} | {'locked':>6}")
+    for name, counters in (("plain", baseline), ("factory", tuned)):
+        print(f"{name:>8} | {counters['writes'] / SECONDS:>9.0f} | {counters['reads'] / SECONDS:>9.0f} "
+              f"| {counters['locked']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks._common import count_queries, temp_engine, timed
+import database
+import rollups
+import stats
+
+SUBJECTS = 12
+SIZES = [10, 100, 1_000, 10_000]
+
+
+def seed(session_factory, grades_count: int) -> int:
+    rnd = random.Random(grades_count)
+    with session_factory() as db:
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        student = database.Student(full_name="Bench Student", class_group="10A")
+        db.add(student)
+        db.flush()
+        start = date(2024, 9, 1)
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": student.id,
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": start + timedelta(days=rnd.randint(0, 270)),
+            }
+            for _ in range(grades_count)
+        ])
+        db.commit()
+        rollups.rebuild(db)
+        return student.id
+
+
+def legacy_stats(db, student):
+    # Прежняя реализация: все оценки в Python + SELECT предмета на каждую оценку
+    grades = db.query(database.Grade).filter(database.Grade.student_id == student.id).all()
+    subjects_grades = defaultdict(list)
+    for grade in grades:
+        subject = db.query(database.Subject).filter(database.Subject.id == grade.subject_id).first()
+        subjects_grades[subject.name].append(grade.grade)
+    return {name: sum(values) / len(values) for name, values in subjects_grades.items()}
+
+
+def main():
+    print(f"{'grades':>8} | {'legacy q':>8} {'legacy ms':>10} | {'agg q':>6} {'agg ms':>8} | {'rollup q':>8} {'rollup ms':>9}")
+    for size in SIZES:
+        engine, session_factory = temp_engine(f"stats-{size}")
+        student_id = seed(session_factory, size)
+        with session_factory() as db:
+            student = db.get(database.Student, student_id)
+
+            with count_queries(engine) as legacy_q:
+                legacy_stats(db, student)
+            legacy_ms, _ = timed(lambda: legacy_stats(db, student), repeat=1 if size >= 10_000 else 3)
+
+            # С фильтром по датам — сгруппированный запрос по grades
+            first_day = date(2024, 9, 1)
+            with count_queries(engine) as agg_q:
+                stats.student_stats(db, student, start_date=first_day)
+            agg_ms, _ = timed(lambda: stats.student_stats(db, student, start_date=first_day))
+
+            # Без фильтров — готовые агрегаты из grade_rollups
+            with count_queries(engine) as rollup_q:
+                stats.student_stats(db, student)
+            rollup_ms, _ = timed(lambda: stats.student_stats(db, student))
+
+        print(f"{size:>8} | {legacy_q.count:>8} {legacy_ms:>10.2f} | {agg_q.count:>6} {agg_ms:>8.2f} "
+              f"| {rollup_q.count:>8} {rollup_ms:>9.2f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks import _common  # noqa: F401  (корень проекта в sys.path для дочерних процессов)
+import crud
+import models
+import tenancy
+from settings import Settings
+
+# Пропускная способность записи: N процессов-писателей пишут оценки (crud.create_grade — вставка,
+# агрегаты и версия таблицы в одной транзакции) либо в одну общую базу, либо каждый в базу своей школы.
+# В общей базе писатели упираются в единственную блокировку записи SQLite, в базах школ — нет.
+SECONDS = 3.0
+WRITERS = (1, 2, 4, 8)
+
+
+def writer(config: Settings, tenant: str, deadline: float, results):
+    databases = tenancy.TenantDatabases(config)
+    entry, _ = databases.acquire(tenant)
+    databases._prepare(entry)
+    grade = models.GradeCreate(student_id=1, subject_id=1, grade=5, date=date(2024, 9, 1))
+    writes = locked = 0
+    while time.time() < deadline:
+        try:
+            with entry.database.SessionLocal() as db:
+                crud.create_grade(db, grade)
+            writes += 1
+        except OperationalError:
+            locked += 1
+    entry.database.close()
+    results.put((writes, locked))
+
+
+def prepare(config: Settings, tenant: str):
+    databases = tenancy.TenantDatabases(config)
+    entry, _ = databases.acquire(tenant)
+    databases._prepare(entry)
+    with entry.database.SessionLocal() as db:
+        crud.create_student(db, models.StudentCreate(full_name="Bench Student", class_group="10A"))
+        crud.create_subject(db, models.SubjectCreate(name="Mathematics"))
+    entry.database.close()
+
+
+def run(config: Settings, tenants) -> tuple:
+    for tenant in set(tenants):
+        prepare(config, tenant)
+    results = multiprocessing.Queue()
+    deadline = time.time() + 1.0 + SECONDS  # секунда на запуск процессов
+    processes = [
+        multiprocessing.Process(target=writer, args=(config, tenant, deadline, results)) for tenant in tenants
+    ]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return sum(w for w, _ in counts) / SECONDS, sum(locked for _, locked in counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write throughput: one shared database vs a database per school")
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous (FULL fsyncs every commit)")
+    args = parser.parse_args()
+
+    print(f"cpus: {os.cpu_count()}, synchronous={args.synchronous}")
+    print(f"{'writers':>7} | {'shared writes/s':>15} | {'locked':>6} | {'per-school writes/s':>19} | {'locked':>6}")
+    for writers in WRITERS:
+        directory = tempfile.mkdtemp(prefix="journal-tenancy-")
+        config = Settings(
+            tenant_database_url=f"sqlite:///{directory}/{{tenant}}.db", sqlite_synchronous=args.synchronous
+        )
+        shared = run(config, ["shared"] * writers)
+        per_school = run(config, [f"school{i}" for i in range(writers)])
+        print(f"{writers:>7} | {shared[0]:>15.0f} | {shared[1]:>6} | {per_school[0]:>19.0f} | {per_school[1]:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks._common import count_queries, temp_engine, timed
+import crud
+import database
+import models
+import rollups
+import stats
+
+SUBJECTS = 12
+SIZES = [100, 1_000, 10_000, 50_000]
+FIRST_DAY = date(2022, 9, 1)
+DAYS = 3 * 365
+
+
+def seed(session_factory, students: int, grades_count: int):
+    rnd = random.Random(grades_count)
+    with session_factory() as db:
+        db.execute(insert(database.Subject), [{"name": f"Subject {i}"} for i in range(SUBJECTS)])
+        db.execute(insert(database.Student), [
+            {"full_name": f"Student {i}", "class_group": "10A"} for i in range(students)
+        ])
+        db.execute(insert(database.Grade), [
+            {
+                "student_id": rnd.randint(1, students),
+                "subject_id": rnd.randint(1, SUBJECTS),
+                "grade": rnd.randint(1, 5),
+                "date": FIRST_DAY + timedelta(days=rnd.randrange(DAYS)),
+            }
+            for _ in range(grades_count)
+        ])
+        db.commit()
+
+
+def client_side(db, student_id: int, bucket: str):
+    # Как сейчас строит график клиент: все оценки ученика через read_grades и группировка у себя
+    grades = db.query(database.Grade).filter(database.Grade.student_id == student_id).all()
+    buckets = defaultdict(list)
+    for grade in grades:
+        buckets[rollups.bucket_start(bucket, grade.date)].append(grade.grade)
+    return [(start, len(values), sum(values) / len(values)) for start, values in sorted(buckets.items())]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backfill-students", type=int, default=2_000)
+    parser.add_argument("--backfill-grades", type=int, default=500_000)
+    args = parser.parse_args()
+
+    print(f"one student, grades over {DAYS // 365} years")
+    print(f"{'grades':>8} | {'bucket':>6} | {'points':>6} | {'client ms':>9} | {'rollup q':>8} {'rollup ms':>9}")
+    for size in SIZES:
+        engine, session_factory = temp_engine(f"trend-{size}")
+        seed(session_factory, 1, size)
+        with session_factory() as db:
+            rollups.rebuild(db)
+            for bucket in rollups.TREND_BUCKETS:
+                client_ms, _ = timed(lambda: client_side(db, 1, bucket), repeat=1 if size >= 10_000 else 3)
+                with count_queries(engine) as rollup_q:
+                    points = stats.student_trend(db, 1, bucket)
+                rollup_ms, _ = timed(lambda: stats.student_trend(db, 1, bucket))
+                print(f"{size:>8} | {bucket:>6} | {len(points):>6} | {client_ms:>9.2f} | "
+                      f"{rollup_q.count:>8} {rollup_ms:>9.2f}")
+        engine.dispose()
+
+    # Стоимость поддержки: запись одной оценки и первичное заполнение
+    engine, session_factory = temp_engine("trend-backfill")
+    seed(session_factory, args.backfill_students, args.backfill_grades)
+    with session_factory() as db:
+        ms, _ = timed(lambda: (rollups.rebuild_trends(db), db.commit()), repeat=1)
+        print(f"\nbackfill {args.backfill_grades} grades of {args.backfill_students} students: {ms:.0f} ms")
+        rollups.rebuild(db)
+        grade = models.GradeCreate(student_id=7, subject_id=3, grade=4, date=date(2024, 3, 5))
+        with count_queries(engine) as write_q:
+            crud.create_grade(db, grade)
+        ms, _ = timed(lambda: crud.create_grade(db, grade), repeat=20)
+        print(f"create_grade with rollups and trends: {write_q.count} queries, {ms:.2f} ms")
+        assert not rollups.verify(db)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import random
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks._common import temp_settings
+import auth
+import database
+import rollups
+import versions
+from settings import Settings
+
+# Детерминированный генератор данных: одинаковые параметры и seed дают одинаковую базу.
+# Масштаб задаётся числом школ: python -m benchmarks.datagen --schools 50 --database-url sqlite:///./load.db
+STUDENTS_PER_SCHOOL = 2_000
+GRADES_PER_STUDENT = 100
+TEACHERS_PER_SCHOOL = 10
+CLASS_SIZE = 30
+SUBJECTS = 30
+TEACHER_PASSWORD = "password"
+SCHOOL_YEAR_START = date(2024, 9, 1)
+SCHOOL_YEAR_DAYS = 270
+BATCH = 50_000
+
+FIRST_NAMES = [
+    "Alexander", "Maria", "Ivan", "Anna", "Dmitry", "Elena", "Sergey", "Olga", "Nikita", "Daria",
+    "Mikhail", "Sofia", "Artem", "Polina", "Kirill", "Victoria", "Egor", "Alina", "Maxim", "Ksenia",
+]
+LAST_NAMES = [
+    "Ivanov", "Smirnov", "Kuznetsov", "Popov", "Vasiliev", "Petrov", "Sokolov", "Mikhailov", "Novikov",
+    "Fedorov", "Morozov", "Volkov", "Alekseev", "Lebedev", "Semenov", "Egorov", "Pavlov", "Kozlov",
+]
+SUBJECT_NAMES = [
+    "Mathematics", "Algebra", "Geometry", "Physics", "Chemistry", "Biology", "Russian", "Literature",
+    "English", "History", "Geography", "Computer Science", "Social Studies", "Physical Education", "Art",
+    "Music", "Astronomy", "Economics", "Law", "Ecology", "German", "French", "Technology", "Drawing",
+    "Health and Safety", "Statistics", "Philosophy", "Psychology", "Latin", "Handwriting",
+]
+# Оценки распределены неравномерно, как в настоящем журнале
+GRADE_WEIGHTS = [3, 7, 30, 38, 22]
+
+
+@dataclass
+class Scale:
+    students: int
+    subjects: int
+    grades: int
+    teachers: int
+
+    @classmethod
+    def schools(cls, schools: int) -> "Scale":
+        return cls(
+            students=schools * STUDENTS_PER_SCHOOL,
+            subjects=SUBJECTS,
+            grades=schools * STUDENTS_PER_SCHOOL * GRADES_PER_STUDENT,
+            teachers=schools * TEACHERS_PER_SCHOOL,
+        )
+
+
+def class_group(student_index: int) -> str:
+    school, position = divmod(student_index, STUDENTS_PER_SCHOOL)
+    return f"S{school + 1:02d}-{position // CLASS_SIZE + 1:02d}"
+
+
+def subject_name(index: int) -> str:
+    if index < len(SUBJECT_NAMES):
+        return SUBJECT_NAMES[index]
+    return f"{SUBJECT_NAMES[index % len(SUBJECT_NAMES)]} {index // len(SUBJECT_NAMES) + 1}"
+
+
+def batches(total: int, make_row, rnd: random.Random):
+    for offset in range(0, total, BATCH):
+        yield [make_row(i, rnd) for i in range(offset, min(total, offset + BATCH))]
+
+
+def generate(config: Settings, scale: Scale, seed: int = 0, progress: bool = False) -> dict:
+    engine = database.create_engine_from_settings(config)
+    database.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+
+    with session_factory() as db:
+        if db.execute(select(func.count()).select_from(database.Student)).scalar_one():
+            raise SystemExit(f"{config.database_url} is not empty")
+
+        # bcrypt считается один раз: пароль у всех сгенерированных преподавателей одинаковый
+        hashed = auth.get_password_hash(TEACHER_PASSWORD)
+        db.execute(insert(database.Teacher), [
+            {"email": f"teacher{i}@school.example", "full_name": f"Teacher {i}", "hashed_password": hashed}
+            for i in range(scale.teachers)
+        ])
+        db.execute(insert(database.Subject), [{"name": subject_name(i)} for i in range(scale.subjects)])
+        for rows in batches(scale.students, lambda i, r: {
+            "full_name": f"{r.choice(LAST_NAMES)} {r.choice(FIRST_NAMES)}",
+            "class_group": class_group(i),
+        }, rnd):
+            db.execute(insert(database.Student), rows)
+        db.commit()
+
+        last_day = SCHOOL_YEAR_DAYS - 1
+        written = 0
+        for rows in batches(scale.grades, lambda i, r: {
+            "student_id": r.randint(1, scale.students),
+            "subject_id": r.randint(1, scale.subjects),
+            "grade": r.choices(range(1, 6), GRADE_WEIGHTS)[0],
+            "date": SCHOOL_YEAR_START + timedelta(days=r.randint(0, last_day)),
+        }, rnd):
+            db.execute(insert(database.Grade), rows)
+            db.commit()
+            written += len(rows)
+            if progress:
+                print(f"  grades {written:,}/{scale.grades:,} ({time.perf_counter() - started:.0f} s)", flush=True)
+
+        rollups.rebuild(db)
+        versions.bump(db, versions.STUDENTS, versions.SUBJECTS, versions.GRADES)
+        db.commit()
+
+    engine.dispose()
+    return {
+        "students": scale.students,
+        "subjects": scale.subjects,
+        "grades": scale.grades,
+        "teachers": scale.teachers,
+        "seed": seed,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--schools", type=int, default=1, help=f"{STUDENTS_PER_SCHOOL} students each")
+    parser.add_argument("--students", type=int, help="override the number of students")
+    parser.add_argument("--subjects", type=int, help="override the number of subjects")
+    parser.add_argument("--grades", type=int, help="override the number of grades")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def scale_from_args(args) -> Scale:
+    scale = Scale.schools(args.schools)
+    for name in ("students", "subjects", "grades"):
+        if getattr(args, name) is not None:
+            setattr(scale, name, getattr(args, name))
+    return scale
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the journal schema with deterministic synthetic data")
+    parser.add_argument("--database-url", help="target database (default: a new temporary SQLite file)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    config = Settings(database_url=args.database_url) if args.database_url else temp_settings("datagen")
+    scale = scale_from_args(args)
+    print(f"generating {scale} into {config.database_url}")
+    summary = generate(config, scale, args.seed, progress=True)
+    print(f"done in {summary['seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import datagen
+from benchmarks._common import temp_settings
+import async_api
+import auth
+import database
+import main as journal
+from settings import Settings
+
+# Нагрузочный прогон настоящего приложения по сценариям. Результаты — в JSON,
+# --compare сравнивает с прошлым прогоном и завершается с кодом 1 при регрессии:
+#   python -m benchmarks.suite --output baseline.json
+#   python -m benchmarks.suite --compare baseline.json --tolerance 0.15
+# Пул соединений не меньше пула потоков (40), иначе синхронный режим упирается в QueuePool timeout
+POOL = {"pool_size": 40, "max_overflow": 40, "pool_timeout": 30}
+
+
+class Dataset:
+    def __init__(self, session_factory):
+        with session_factory() as db:
+            self.students = db.execute(select(func.max(database.Student.id))).scalar_one()
+            self.subjects = db.execute(select(func.max(database.Subject.id))).scalar_one()
+            self.grades = db.execute(select(func.max(database.Grade.id))).scalar_one()
+            self.class_groups = db.execute(select(database.Student.class_group).distinct()).scalars().all()
+            self.teacher = db.execute(select(database.Teacher.email).limit(1)).scalar_one()
+
+    def summary(self) -> dict:
+        return {
+            "students": self.students, "subjects": self.subjects, "grades": self.grades,
+            "class_groups": len(self.class_groups),
+        }
+
+
+def random_day(rnd: random.Random) -> date:
+    return datagen.SCHOOL_YEAR_START + timedelta(days=rnd.randint(0, datagen.SCHOOL_YEAR_DAYS - 1))
+
+
+# Сценарий: функция (rnd, dataset, token) -> (method, url, kwargs). Доля запросов задаётся весом
+def student_get(rnd, data, token):
+    return "GET", f"/students/{rnd.randint(1, data.students)}", {}
+
+
+def students_list(rnd, data, token):
+    return "GET", "/students/", {"params": {"skip": rnd.randint(0, 1000), "limit": 100}}
+
+
+def grades_by_student(rnd, data, token):
+    return "GET", "/grades/", {"params": {"student_id": rnd.randint(1, data.students), "limit": 100}}
+
+
+def grades_date_range(rnd, data, token):
+    start = random_day(rnd)
+    return "GET", "/grades/", {"params": {
+        "subject_id": rnd.randint(1, data.subjects),
+        "start_date": str(start), "end_date": str(start + timedelta(days=7)), "limit": 100,
+    }}
+
+
+def student_stats(rnd, data, token):
+    return "GET", f"/students/{rnd.randint(1, data.students)}/stats", {}
+
+
+def student_stats_range(rnd, data, token):
+    start = random_day(rnd)
+    return "GET", f"/students/{rnd.randint(1, data.students)}/stats", {"params": {
+        "start_date": str(start), "end_date": str(start + timedelta(days=30)),
+    }}
+
+
+def class_report(rnd, data, token):
+    return "GET", f"/classes/{rnd.choice(data.class_groups)}/report", {}
+
+
+def student_create(rnd, data, token):
+    return "POST", "/students/", {"json": {"full_name": "Load Student", "class_group": rnd.choice(data.class_groups)}}
+
+
+def grade_create(rnd, data, token):
+    return "POST", "/grades/", {"json": {
+        "student_id": rnd.randint(1, data.students), "subject_id": rnd.randint(1, data.subjects),
+        "grade": rnd.randint(1, 5), "date": str(random_day(rnd)),
+    }}
+
+
+def grade_update(rnd, data, token):
+    return "PUT", f"/grades/{rnd.randint(1, data.grades)}", {"json": {
+        "student_id": rnd.randint(1, data.students), "subject_id": rnd.randint(1, data.subjects),
+        "grade": rnd.randint(1, 5), "date": str(random_day(rnd)),
+    }}
+
+
+def auth_me(rnd, data, token):
+    return "GET", "/teachers/me/", {"headers": {"Authorization": f"Bearer {token}"}}
+
+
+def auth_login(rnd, data, token):
+    return "POST", "/token", {"data": {"username": data.teacher, "password": datagen.TEACHER_PASSWORD}}
+
+
+# (сценарий, доля от --requests): bcrypt в /token на порядки дороже остальных запросов
+SCENARIOS = {
+    "student_get": (student_get, 1.0),
+    "students_list": (students_list, 1.0),
+    "grades_by_student": (grades_by_student, 1.0),
+    "grades_date_range": (grades_date_range, 1.0),
+    "student_stats": (student_stats, 1.0),
+    "student_stats_range": (student_stats_range, 1.0),
+    "class_report": (class_report, 0.5),
+    "student_create": (student_create, 0.5),
+    "grade_create": (grade_create, 1.0),
+    "grade_update": (grade_update, 0.5),
+    "auth_me": (auth_me, 1.0),
+    "auth_login": (auth_login, 0.05),
+}
+
+
+def build_app(config: Settings, async_mode: bool) -> FastAPI:
+    # Настоящие роутеры и middleware приложения, но база — из config
+    app = FastAPI()
+    journal.configure(app, config)
+    app.add_middleware(journal.metrics.MetricsMiddleware)
+    if async_mode:
+        async_engine = database.create_async_engine_from_settings(config)
+        sessions = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+        async def override_get_async_db():
+            async with sessions() as session:
+                yield session
+
+        app.include_router(async_api.router)
+        app.dependency_overrides[database.get_async_db] = override_get_async_db
+        app.dependency_overrides[database.get_async_read_db] = override_get_async_db
+    else:
+        engines = {False: database.create_engine_from_settings(config),
+                   True: database.create_engine_from_settings(config, read_only=True)}
+
+        def override(read_only: bool):
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=engines[read_only])
+
+            def get_session():
+                db = factory()
+                try:
+                    yield db
+                finally:
+                    db.close()
+            return get_session
+
+        app.include_router(journal.router)
+        app.dependency_overrides[database.get_db] = override(False)
+        app.dependency_overrides[database.get_read_db] = override(True)
+    return app
+
+
+def percentile(sorted_values, point: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * point / 100))] * 1000
+
+
+async def run_scenario(client, scenario, requests: int, concurrency: int, data: Dataset, token: str, seed: int):
+    rnd = random.Random(seed)
+    calls = [scenario(rnd, data, token) for _ in range(requests)]
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(method, url, kwargs):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                errors += response.status_code >= 400
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*call) for call in calls))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+async def run_suite(app: FastAPI, data: Dataset, names, requests: int, concurrency: int, seed: int) -> dict:
+    token = auth.create_access_token({"sub": data.teacher}, timedelta(minutes=30))
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://suite", timeout=60) as client:
+        for name in names:
+            scenario, share = SCENARIOS[name]
+            count = max(concurrency, int(requests * share))
+            # Короткий прогрев: кеши SQLite, пулы соединений и потоков
+            await run_scenario(client, scenario, min(count, concurrency * 2), concurrency, data, token, seed + 1)
+            results[name] = await run_scenario(client, scenario, count, concurrency, data, token, seed)
+            r = results[name]
+            print(f"{name:<20} | {r['throughput_rps']:>9.1f} | {r['p50_ms']:>8.2f} | {r['p95_ms']:>8.2f} "
+                  f"| {r['p99_ms']:>8.2f} | {r['errors']:>6}", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    # Регрессия: пропускная способность упала или p95 вырос больше чем на tolerance
+    regressions = []
+    print(f"\n{'scenario':<20} | {'rps':>16} | {'p95 ms':>17} | verdict")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            print(f"{name:<20} | {'new scenario':>16} |")
+            continue
+        rps_change = current["throughput_rps"] / previous["throughput_rps"] - 1
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        failed = rps_change < -tolerance or p95_change > tolerance
+        if failed:
+            regressions.append(name)
+        print(f"{name:<20} | {current['throughput_rps']:>8.1f} {rps_change:>+7.1%} "
+              f"| {current['p95_ms']:>9.2f} {p95_change:>+7.1%} | {'REGRESSION' if failed else 'ok'}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load/benchmark suite over the journal API")
+    parser.add_argument("--database-url", help="existing database filled by benchmarks.datagen")
+    datagen.add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario (scaled by its share)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="use the AsyncSession router")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON; exit with code 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.database_url:
+        config = Settings(database_url=args.database_url, **POOL)
+    else:
+        config = temp_settings("suite", **POOL)
+        scale = datagen.scale_from_args(args)
+        print(f"generating {scale}", flush=True)
+        datagen.generate(config, scale, args.seed)
+
+    engine = database.create_engine_from_settings(config)
+    data = Dataset(sessionmaker(bind=engine))
+    engine.dispose()
+
+    print(f"{'scenario':<20} | {'req/s':>9} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'errors':>6}")
+    app = build_app(config, args.async_mode)
+    scenarios = asyncio.run(run_suite(app, data, names, args.requests, args.concurrency, args.seed))
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "mode": "async" if args.async_mode else "sync",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "dataset": data.summary(),
+        },
+        "scenarios": scenarios,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
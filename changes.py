@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+from weakref import WeakKeyDictionary
+
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+import models
+from refcache import IN_CHUNK_SIZE
+from settings import settings
+
+CREATE, UPDATE, DELETE = "create", "update", "delete"
+# Сколько изменений читается за один запрос опроса или догона
+BATCH_SIZE = 1000
+COLUMNS = ["op", "grade_id", "student_id", "subject_id", "class_group", "grade", "date", "changed_at"]
+
+logger = logging.getLogger("journal.changes")
+
+
+# ========== Запись ==========
+# Строки журнала копируются из grades одним INSERT ... SELECT: класс ученика берётся там же,
+# без отдельного запроса. create и update пишутся после flush, delete — до удаления строк
+def _from_grades(op: str, condition):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    query = (
+        select(
+            literal(op), database.Grade.id, database.Grade.student_id, database.Grade.subject_id,
+            database.Student.class_group, database.Grade.grade, database.Grade.date,
+            literal(now, database.GradeChange.changed_at.type),
+        )
+        .select_from(database.Grade)
+        .outerjoin(database.Student, database.Student.id == database.Grade.student_id)
+        .where(condition)
+        .order_by(database.Grade.id)
+    )
+    return insert(database.GradeChange).from_select(COLUMNS, query)
+
+
+def record(db: Session, op: str, grade_ids: Iterable[int]):
+    grade_ids = sorted(set(grade_ids))
+    if grade_ids and grade_ids[-1] - grade_ids[0] + 1 == len(grade_ids):
+        # id без пропусков (обычно — пакетная вставка одной транзакции): одно условие по диапазону вместо IN
+        db.execute(_from_grades(op, database.Grade.id.between(grade_ids[0], grade_ids[-1])))
+        return
+    for i in range(0, len(grade_ids), IN_CHUNK_SIZE):
+        db.execute(_from_grades(op, database.Grade.id.in_(grade_ids[i:i + IN_CHUNK_SIZE])))
+
+
+def record_student(db: Session, student_id: int):
+    # Все оценки удаляемого ученика
+    db.execute(_from_grades(DELETE, database.Grade.student_id == student_id))
+
+
+def record_where(db: Session, op: str, *conditions):
+    # Оценки по условию — для переноса в архив (archive.py): для ленты это удаление из grades
+    db.execute(_from_grades(op, and_(*conditions)))
+
+
+# ========== Чтение ==========
+def read(
+        db: Session,
+        since: int,
+        limit: int,
+        until: Optional[int] = None,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        class_group: Optional[str] = None,
+) -> List[models.GradeChange]:
+    change = database.GradeChange
+    query = select(change).where(change.seq > since).order_by(change.seq).limit(limit)
+    if until is not None:
+        query = query.where(change.seq <= until)
+    if student_id is not None:
+        query = query.where(change.student_id == student_id)
+    if subject_id is not None:
+        query = query.where(change.subject_id == subject_id)
+    if class_group is not None:
+        query = query.where(change.class_group == class_group)
+    return [
+        models.GradeChange(
+            seq=row.seq, op=row.op, grade_id=row.grade_id, class_group=row.class_group, changed_at=row.changed_at,
+            grade=models.Grade(
+                id=row.grade_id, student_id=row.student_id, subject_id=row.subject_id, grade=row.grade, date=row.date
+            ),
+        )
+        for row in db.execute(query).scalars()
+    ]
+
+
+def last_seq(db: Session) -> int:
+    return db.execute(select(func.max(database.GradeChange.seq))).scalar() or 0
+
+
+def check_since(db: Session, since: int):
+    # Журнал чистится по сроку хранения: если часть ленты после since удалена, клиенту нужно
+    # перечитать оценки целиком и продолжить с текущего seq
+    first = db.execute(select(func.min(database.GradeChange.seq))).scalar()
+    if first is not None and since < first - 1:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=f"Changes after {since} were pruned; reload grades and continue from seq {first - 1}",
+        )
+
+
+def prune(db: Session, before: datetime) -> int:
+    # Последняя строка остаётся всегда: по ней check_since видит, что более ранние удалены
+    result = db.execute(
+        delete(database.GradeChange)
+        .where(database.GradeChange.changed_at < before)
+        .where(database.GradeChange.seq < select(func.max(database.GradeChange.seq)).scalar_subquery())
+    )
+    db.commit()
+    return result.rowcount
+
+
+def reader(journal_db: database.Database):
+    # Чтение для потока: своя короткая сессия на каждый запрос, как у зависимостей get_read_db.
+    # Замыкание держит только фабрики сессий, не сам Database — он ключ WeakKeyDictionary
+    if journal_db.config.async_mode:
+        async_factory = journal_db.AsyncReadSessionLocal
+
+        async def read_db(fn, *args):
+            async with async_factory() as db:
+                return await db.run_sync(fn, *args)
+
+        return read_db
+    factory = journal_db.ReadSessionLocal
+
+    def run_sync(fn, *args):
+        with factory() as db:
+            return fn(db, *args)
+
+    async def read_db(fn, *args):
+        return await run_in_threadpool(run_sync, fn, *args)
+
+    return read_db
+
+
+# ========== Рассылка ==========
+def encode(change: models.GradeChange) -> bytes:
+    return f"id: {change.seq}\nevent: {change.op}\ndata: {change.model_dump_json()}\n\n".encode()
+
+
+class Subscriber:
+    def __init__(self, student_id: Optional[int], subject_id: Optional[int], class_group: Optional[str],
+                 queue_size: int):
+        self.student_id = student_id
+        self.subject_id = subject_id
+        self.class_group = class_group
+        self.queue = asyncio.Queue(maxsize=queue_size)  # (seq, событие)
+        # seq, начиная с которого (не включая) события приходят в очередь; известен после первого опроса
+        self.start = asyncio.get_running_loop().create_future()
+        self.overflowed = False
+
+    def matches(self, change: models.GradeChange) -> bool:
+        return (
+            (self.student_id is None or self.student_id == change.grade.student_id)
+            and (self.subject_id is None or self.subject_id == change.grade.subject_id)
+            and (self.class_group is None or self.class_group == change.class_group)
+        )
+
+    def index_key(self):
+        # Подписчик лежит в одном индексе — по самому избирательному из своих фильтров
+        if self.student_id is not None:
+            return "student", self.student_id
+        if self.class_group is not None:
+            return "class_group", self.class_group
+        if self.subject_id is not None:
+            return "subject", self.subject_id
+        return "all", None
+
+
+class Broadcaster:
+    # Одна задача на базу опрашивает grade_changes раз в poll_seconds и раскладывает новые изменения
+    # по очередям подписчиков: стоимость опроса не зависит от их числа, событие кодируется один раз.
+    # Кандидаты на событие ищутся по индексам фильтров, а не перебором всех подписчиков.
+    # Изменения других процессов видны так же, как свои: источник — таблица, а не вызовы crud.
+    # Подписчик с переполненной очередью отключается от рассылки и догоняет ленту из БД (stream)
+    def __init__(self, read_db, poll_ms: float, queue_size: int):
+        self.read_db = read_db  # reader()
+        self.poll_seconds = poll_ms / 1000
+        self.queue_size = queue_size
+        self.position: Optional[int] = None  # последний разосланный seq
+        self._index = defaultdict(set)  # index_key -> подписчики
+        self._count = 0
+        self._task = None
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, student_id=None, subject_id=None, class_group=None) -> Subscriber:
+        subscriber = Subscriber(student_id, subject_id, class_group, self.queue_size)
+        self._index[subscriber.index_key()].add(subscriber)
+        self._count += 1
+        if self.position is not None:
+            subscriber.start.set_result(self.position)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._index.get(subscriber.index_key())
+        if subscribers and subscriber in subscribers:
+            subscribers.remove(subscriber)
+            self._count -= 1
+            if not subscribers:
+                del self._index[subscriber.index_key()]
+
+    def subscribers(self) -> int:
+        return self._count
+
+    async def _run(self):
+        try:
+            while self._count:
+                try:
+                    if self.position is None:
+                        self.position = await self.read_db(last_seq)
+                        for subscribers in self._index.values():
+                            for subscriber in subscribers:
+                                if not subscriber.start.done():
+                                    subscriber.start.set_result(self.position)
+                    batch = await self.read_db(read, self.position, BATCH_SIZE)
+                except Exception:  # база недоступна — подписчики ждут, опрос повторяется
+                    logger.exception("grade changes poll failed")
+                    batch = []
+                for change in batch:
+                    self._publish(change)
+                if batch:
+                    self.position = batch[-1].seq
+                if len(batch) < BATCH_SIZE:
+                    await asyncio.sleep(self.poll_seconds)
+        finally:
+            # Без подписчиков опрос останавливается; позиция сбрасывается, т.к. следующие подписчики
+            # придут позже и должны получить start не раньше текущего конца журнала
+            self._task = None
+            self.position = None
+
+    def _publish(self, change: models.GradeChange):
+        event = None
+        keys = (("all", None), ("student", change.grade.student_id), ("class_group", change.class_group),
+                ("subject", change.grade.subject_id))
+        for key in keys:
+            for subscriber in list(self._index.get(key, ())):
+                if not subscriber.matches(change):
+                    continue
+                if event is None:
+                    event = encode(change)
+                try:
+                    subscriber.queue.put_nowait((change.seq, event))
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    subscriber.overflowed = True
+                    self.overflows += 1
+                    self.unsubscribe(subscriber)
+
+
+async def stream(
+        broadcaster: Broadcaster,
+        since: Optional[int],
+        heartbeat: float,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        class_group: Optional[str] = None,
+):
+    filters = {"student_id": student_id, "subject_id": subject_id, "class_group": class_group}
+    last = since
+    yield b"retry: 1000\n\n"
+    while True:
+        subscriber = broadcaster.subscribe(**filters)
+        try:
+            start = await subscriber.start
+            # Догон из БД до start, дальше — из очереди: на стыке ничего не теряется и не повторяется
+            if last is None:
+                last = start
+            while last < start:
+                page = await broadcaster.read_db(read, last, BATCH_SIZE, start, *filters.values())
+                for change in page:
+                    yield encode(change)
+                last = page[-1].seq if len(page) == BATCH_SIZE else start
+            while not (subscriber.overflowed and subscriber.queue.empty()):
+                try:
+                    seq, event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"  # комментарий SSE: соединение живо, прокси не закроют его по простою
+                    continue
+                if seq > last:
+                    last = seq
+                    yield event
+        finally:
+            broadcaster.unsubscribe(subscriber)
+        # Очередь переполнилась: подписываемся заново и догоняем пропущенное из БД
+
+
+_broadcasters = WeakKeyDictionary()  # Database -> Broadcaster
+
+
+def broadcaster(journal_db: database.Database) -> Broadcaster:
+    # Вызывается только из цикла событий, поэтому без блокировки
+    instance = _broadcasters.get(journal_db)
+    if instance is None:
+        config = journal_db.config
+        instance = _broadcasters[journal_db] = Broadcaster(
+            reader(journal_db), config.changes_poll_ms, config.changes_queue_size
+        )
+    return instance
+
+
+async def stream_response(
+        request: Request,
+        since: Optional[int],
+        student_id: Optional[int],
+        subject_id: Optional[int],
+        class_group: Optional[str],
+) -> StreamingResponse:
+    # При переподключении EventSource присылает Last-Event-ID — продолжаем с него
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    async with request.app.state.database.lease_async(request) as journal_db:
+        if since is not None:
+            await reader(journal_db)(check_since, since)
+
+    async def events():
+        # База школы остаётся занятой, пока открыт поток
+        async with request.app.state.database.lease_async(request) as journal_db:
+            async for chunk in stream(broadcaster(journal_db), since, journal_db.config.changes_heartbeat_seconds,
+                                      student_id, subject_id, class_group):
+                yield chunk
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _collect_metrics() -> list:
+    broadcasters = list(_broadcasters.values())
+    return [
+        ("journal_grade_changes_subscribers", "Open grade change streams.", "gauge",
+         [({}, sum(b.subscribers() for b in broadcasters))]),
+        ("journal_grade_changes_delivered_total", "Grade change events queued for stream subscribers.", "counter",
+         [({}, sum(b.delivered for b in broadcasters))]),
+        ("journal_grade_changes_overflows_total", "Subscribers that fell behind and caught up from the database.",
+         "counter", [({}, sum(b.overflows for b in broadcasters))]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the grade change log")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prune_parser = commands.add_parser("prune", help="delete changes older than the retention period")
+    prune_parser.add_argument("--days", type=int, default=settings.changes_retention_days)
+    args = parser.parse_args()
+
+    journal_db = database.Database(settings)
+    journal_db.ensure_schema()
+    with journal_db.SessionLocal() as db:
+        before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=args.days)
+        print(f"{prune(db, before)} changes pruned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+from datetime import date, timedelta
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import exists, or_, select, tuple_
+from sqlalchemy.orm import Session
+
+import archive
+import auth
+import bulk
+import changes
+import database
+import models
+import refcache
+import rollups
+import serialization
+import stats
+import tenancy
+import versions
+from pagination import decode_cursor, encode_cursor
+
+# Операции над БД, общие для синхронных (main.py) и асинхронных (async_api.py) эндпоинтов.
+# Асинхронные эндпоинты вызывают их через AsyncSession.run_sync.
+
+
+# ========== Аутентификация ==========
+def validate_teacher(db: Session, teacher_data: models.TeacherCreate) -> str:
+    # Проверяем валидность email
+    try:
+        validated_email = models.TeacherBase(email=teacher_data.email, full_name=teacher_data.full_name).email
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+
+    # Проверяем не зарегистрирован ли уже преподаватель
+    db_teacher = auth.get_teacher_by_email(db, validated_email)
+    if db_teacher:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    return validated_email
+
+
+def create_teacher(db: Session, email: str, teacher_data: models.TeacherCreate, hashed_password: str):
+    db_teacher = database.Teacher(
+        email=email,
+        full_name=teacher_data.full_name,
+        hashed_password=hashed_password
+    )
+    db.add(db_teacher)
+    db.commit()
+    db.refresh(db_teacher)
+    return db_teacher
+
+
+def issue_token(teacher: database.Teacher, tenant: Optional[str] = None) -> dict:
+    if not teacher:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # Создаем токен доступа
+    access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+    data = {"sub": teacher.email}
+    if tenant is not None:
+        # Школа в токене: следующие запросы преподавателя попадают в его базу без заголовка
+        data[tenancy.TENANT_CLAIM] = tenant
+    access_token = auth.create_access_token(
+        data=data,
+        expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+# ========== Students ==========
+def create_student(db: Session, student: models.StudentCreate):
+    db_student = database.Student(**student.model_dump())
+    db.add(db_student)
+    versions.bump(db, versions.STUDENTS)
+    db.commit()
+    db.refresh(db_student)
+    refcache.added(db, versions.STUDENTS, [db_student.id])
+    return db_student
+
+
+def list_students(db: Session, skip: int, limit: int, after: Optional[str], fast: bool = False):
+    # fast=True — строки-кортежи вместо ORM-объектов и готовый JSON (bytes) вместо списка моделей
+    entities = serialization.STUDENTS.columns if fast else [database.Student]
+    query = db.query(*entities).order_by(database.Student.id)
+    # Keyset-пагинация: продолжаем после последнего id из курсора вместо OFFSET
+    if after:
+        (last_id,) = decode_cursor(after, int)
+        query = query.filter(database.Student.id > last_id)
+    else:
+        query = query.offset(skip)
+
+    students = query.limit(limit).all()
+    next_cursor = encode_cursor(students[-1].id) if len(students) == limit else None
+    return (serialization.STUDENTS.dump(students) if fast else students), next_cursor
+
+
+def get_student(db: Session, student_id: int):
+    db_student = db.query(database.Student).filter(database.Student.id == student_id).first()
+    if not db_student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return db_student
+
+
+def update_student(db: Session, student_id: int, student: models.StudentCreate):
+    db_student = get_student(db, student_id)
+
+    for key, value in student.model_dump().items():
+        setattr(db_student, key, value)
+
+    versions.bump(db, versions.STUDENTS)
+    db.commit()
+    db.refresh(db_student)
+    return db_student
+
+
+def delete_student(db: Session, student_id: int):
+    # Сначала удаляем все оценки студента (в журнал изменений — до удаления строк)
+    changes.record_student(db, student_id)
+    db.query(database.Grade).filter(database.Grade.student_id == student_id).delete()
+    rollups.delete_student(db, student_id)
+
+    # Затем удаляем самого студента
+    db_student = get_student(db, student_id)
+
+    db.delete(db_student)
+    versions.bump(db, versions.STUDENTS, versions.GRADES)
+    refcache.removed(db, versions.STUDENTS, [student_id])
+    db.commit()
+    return {"message": "Student deleted successfully"}
+
+
+# ========== Subjects ==========
+def create_subject(db: Session, subject: models.SubjectCreate):
+    db_subject = database.Subject(**subject.model_dump())
+    db.add(db_subject)
+    versions.bump(db, versions.SUBJECTS)
+    db.commit()
+    db.refresh(db_subject)
+    refcache.added(db, versions.SUBJECTS, [db_subject.id])
+    return db_subject
+
+
+def list_subjects(db: Session, skip: int, limit: int, after: Optional[str], fast: bool = False):
+    (last_id,) = decode_cursor(after, int) if after else (None,)
+    # Таблица небольшая и меняется редко: страница вырезается из копии в памяти (refcache)
+    cached = refcache.subjects(db)
+    if cached is not None:
+        subjects = cached.page(skip, limit, last_id)
+    else:
+        entities = serialization.SUBJECTS.columns if fast else [database.Subject]
+        query = db.query(*entities).order_by(database.Subject.id)
+        if after:
+            query = query.filter(database.Subject.id > last_id)
+        else:
+            query = query.offset(skip)
+        subjects = query.limit(limit).all()
+    next_cursor = encode_cursor(subjects[-1].id) if len(subjects) == limit else None
+    return (serialization.SUBJECTS.dump(subjects) if fast else subjects), next_cursor
+
+
+def get_subject(db: Session, subject_id: int):
+    db_subject = db.query(database.Subject).filter(database.Subject.id == subject_id).first()
+    if not db_subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+    return db_subject
+
+
+def update_subject(db: Session, subject_id: int, subject: models.SubjectCreate):
+    db_subject = get_subject(db, subject_id)
+
+    for key, value in subject.model_dump().items():
+        setattr(db_subject, key, value)
+
+    versions.bump(db, versions.SUBJECTS)
+    db.commit()
+    db.refresh(db_subject)
+    refcache.changed(db, versions.SUBJECTS)
+    return db_subject
+
+
+def delete_subject(db: Session, subject_id: int):
+    # Проверяем есть ли оценки по этому предмету — в журнале и в архиве, одним запросом
+    has_grades = db.query(or_(
+        exists().where(database.Grade.subject_id == subject_id),
+        exists().where(database.ArchivedGrade.subject_id == subject_id),
+    )).scalar()
+    if has_grades:
+        raise HTTPException(
+            status_code=400,
+            detail="Cannot delete subject with existing grades. Delete grades first."
+        )
+
+    db_subject = get_subject(db, subject_id)
+
+    db.delete(db_subject)
+    versions.bump(db, versions.SUBJECTS)
+    refcache.removed(db, versions.SUBJECTS, [subject_id])
+    db.commit()
+    return {"message": "Subject deleted successfully"}
+
+
+# ========== Grades ==========
+def check_grade_refs(db: Session, grade: models.GradeCreate):
+    # Проверяем что оценка от 1 до 5
+    if grade.grade < 1 or grade.grade > 5:
+        raise HTTPException(status_code=400, detail="Grade must be between 1 and 5")
+
+    # Проверяем что студент существует (по кешу id, в БД — только при промахе)
+    if not refcache.exists(db, refcache.STUDENTS, grade.student_id):
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    # Проверяем что предмет существует
+    if not refcache.exists(db, refcache.SUBJECTS, grade.subject_id):
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+
+def create_grade(db: Session, grade: models.GradeCreate):
+    check_grade_refs(db, grade)
+
+    db_grade = database.Grade(**grade.model_dump())
+    db.add(db_grade)
+    db.flush()
+    # Агрегаты и журнал изменений обновляются в той же транзакции
+    changes.record(db, changes.CREATE, [db_grade.id])
+    rollups.apply(db, added=[(grade.student_id, grade.subject_id, grade.grade, grade.date)])
+    versions.bump(db, versions.GRADES)
+    db.commit()
+    db.refresh(db_grade)
+    return db_grade
+
+
+def create_grades_bulk(db: Session, grades: List[models.GradeCreate], atomic: bool):
+    # atomic=true — режим "всё или ничего": при любой ошибке ничего не вставляется
+    result = bulk.insert_grades(db, grades, atomic=atomic)
+    if atomic and result.errors:
+        raise HTTPException(status_code=400, detail=[error.model_dump() for error in result.errors])
+    return result
+
+
+def grade_filters(
+        student_id: Optional[int],
+        subject_id: Optional[int],
+        start_date: Optional[date],
+        end_date: Optional[date],
+        grades=database.Grade.__table__
+) -> list:
+    # Условия фильтрации, общие для списка оценок и экспорта
+    conditions = []
+    if student_id:
+        conditions.append(grades.c.student_id == student_id)
+    if subject_id:
+        conditions.append(grades.c.subject_id == subject_id)
+    if start_date:
+        conditions.append(grades.c.date >= start_date)
+    if end_date:
+        conditions.append(grades.c.date <= end_date)
+    return conditions
+
+
+def list_grades(
+        db: Session,
+        student_id: Optional[int],
+        subject_id: Optional[int],
+        start_date: Optional[date],
+        end_date: Optional[date],
+        skip: int,
+        limit: int,
+        after: Optional[str],
+        fast: bool = False,
+        fieldset: Optional[serialization.GradeFieldset] = None,
+):
+    # fieldset — fields=/include=: выбранные колонки одним select с JOIN, ответ готовым JSON
+    if fieldset is not None:
+        query = fieldset.query(db)
+    else:
+        query = db.query(*(serialization.GRADES.columns if fast else [database.Grade]))
+    # Стабильный порядок (date, id) — по нему строится курсор
+    query = (
+        query
+        .filter(*grade_filters(student_id, subject_id, start_date, end_date))
+        .order_by(database.Grade.date, database.Grade.id)
+    )
+
+    if after:
+        last_date, last_id = decode_cursor(after, date, int)
+        query = query.filter(tuple_(database.Grade.date, database.Grade.id) > (last_date, last_id))
+    else:
+        query = query.offset(skip)
+
+    grades = query.limit(limit).all()
+    next_cursor = encode_cursor(grades[-1].date, grades[-1].id) if len(grades) == limit else None
+    if fieldset is not None:
+        return fieldset.dump(grades), next_cursor
+    return (serialization.GRADES.dump(grades) if fast else grades), next_cursor
+
+
+def get_grade(db: Session, grade_id: int):
+    db_grade = db.query(database.Grade).filter(database.Grade.id == grade_id).first()
+    if not db_grade:
+        raise HTTPException(status_code=404, detail="Grade not found")
+    return db_grade
+
+
+def read_grade(db: Session, grade_id: int, fieldset: Optional[serialization.GradeFieldset] = None):
+    if fieldset is None:
+        return get_grade(db, grade_id)
+    row = fieldset.query(db).filter(database.Grade.id == grade_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Grade not found")
+    return fieldset.dump_one(row)
+
+
+def update_grade(db: Session, grade_id: int, grade: models.GradeCreate):
+    db_grade = get_grade(db, grade_id)
+    check_grade_refs(db, grade)
+
+    old_key = (db_grade.student_id, db_grade.subject_id, db_grade.grade, db_grade.date)
+    for key, value in grade.model_dump().items():
+        setattr(db_grade, key, value)
+
+    db.flush()
+    changes.record(db, changes.UPDATE, [grade_id])
+    rollups.apply(db, added=[(grade.student_id, grade.subject_id, grade.grade, grade.date)], removed=[old_key])
+    versions.bump(db, versions.GRADES)
+    db.commit()
+    db.refresh(db_grade)
+    return db_grade
+
+
+def delete_grade(db: Session, grade_id: int):
+    db_grade = get_grade(db, grade_id)
+
+    changes.record(db, changes.DELETE, [grade_id])
+    db.delete(db_grade)
+    db.flush()
+    rollups.apply(db, removed=[(db_grade.student_id, db_grade.subject_id, db_grade.grade, db_grade.date)])
+    versions.bump(db, versions.GRADES)
+    db.commit()
+    return {"message": "Grade deleted successfully"}
+
+
+def grade_changes(
+        db: Session,
+        since: int,
+        limit: int,
+        student_id: Optional[int],
+        subject_id: Optional[int],
+        class_group: Optional[str],
+):
+    changes.check_since(db, since)
+    return changes.read(db, since, limit, None, student_id, subject_id, class_group)
+
+
+# ========== Statistics ==========
+def student_stats(
+        db: Session,
+        student_id: int,
+        start_date: Optional[date],
+        end_date: Optional[date],
+        include_archived: bool = False
+):
+    # Проверяем что студент существует (с include_archived — и среди выпущенных)
+    student = archive.get_student(db, student_id, include_archived)
+
+    # Все агрегаты (count/sum/avg/min/max по предметам) считаются одним запросом в БД
+    return stats.student_stats(db, student, start_date, end_date, archive.grades_source(include_archived))
+
+
+def student_trend(db: Session, student_id: int, bucket: str, subject_id: Optional[int]):
+    archive.get_student(db, student_id)
+    return models.StudentTrend(
+        student_id=student_id,
+        bucket=bucket,
+        subject_id=subject_id,
+        points=stats.student_trend(db, student_id, bucket, subject_id),
+    )
+
+
+def class_report(
+        db: Session,
+        class_group: str,
+        start_date: Optional[date],
+        end_date: Optional[date],
+        include_archived: bool = False
+):
+    student_table = archive.students_source(include_archived)
+    students = db.execute(
+        select(student_table.c.id, student_table.c.full_name)
+        .where(student_table.c.class_group == class_group)
+        .order_by(student_table.c.id)
+    ).all()
+    if not students:
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    # Средние, ранги, перцентили и гистограммы класса — один сгруппированный запрос по оценкам
+    return stats.class_report(
+        db, class_group, students, start_date, end_date, archive.grades_source(include_archived)
+    )
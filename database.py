@@ -1,44 +1,429 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, ForeignKey, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./journal.db"
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base = declarative_base()
-
-class Teacher(Base):
-    __tablename__ = "teachers"
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True)
-    full_name = Column(String)
-    hashed_password = Column(String)
-    is_active = Column(Boolean, default=True)
-
-class Student(Base):
-    __tablename__ = "students"
-    id = Column(Integer, primary_key=True, index=True)
-    full_name = Column(String, index=True)
-    class_group = Column(String)
-
-class Subject(Base):
-    __tablename__ = "subjects"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True)
-
-class Grade(Base):
-    __tablename__ = "grades"
-    id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"))
-    subject_id = Column(Integer, ForeignKey("subjects.id"))
-    grade = Column(Integer)  # 1-5
-    date = Column(Date)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.pool import StaticPool
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+import metrics
+from settings import Settings, bind_engine, to_async_url
+
+
+def is_sqlite_memory(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+def set_sqlite_pragmas(engine, config: Settings, read_only: bool = False):
+    # PRAGMA выполняются для каждого нового соединения пула
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if config.sqlite_wal and not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={config.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA cache_size={int(config.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.sqlite_mmap_size)}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def engine_options(url: str, config: Settings, read_only: bool = False, is_async: bool = False) -> dict:
+    # Пул с замером времени получения соединения (метрика journal_db_pool_checkout_seconds)
+    poolclass = metrics.TimedAsyncQueuePool if is_async else metrics.TimedQueuePool
+    if make_url(url).get_backend_name() != "sqlite":
+        return {
+            "poolclass": poolclass,
+            "pool_size": config.read_pool_size if read_only else config.pool_size,
+            "max_overflow": config.read_max_overflow if read_only else config.max_overflow,
+            "pool_timeout": config.pool_timeout,
+            "pool_pre_ping": True,
+        }
+    options = {"connect_args": {"check_same_thread": False}}
+    # In-memory SQLite живёт в единственном соединении: StaticPool отдаёт его всем потокам и сессиям,
+    # иначе каждый поток видел бы свою пустую базу
+    if is_sqlite_memory(url):
+        options["poolclass"] = StaticPool
+    else:
+        options.update(
+            poolclass=poolclass,
+            pool_size=config.read_pool_size if read_only else config.pool_size,
+            max_overflow=config.read_max_overflow if read_only else config.max_overflow,
+            pool_timeout=config.pool_timeout,
+        )
+    return options
+
+
+def create_engine_from_settings(config: Settings, read_only: bool = False):
+    url = (config.read_database_url or config.database_url) if read_only else config.database_url
+    engine = create_engine(url, **engine_options(url, config, read_only))
+    bind_engine(engine, config)
+    if engine.dialect.name == "sqlite":
+        set_sqlite_pragmas(engine, config, read_only)
+    return engine
+
+
+def create_async_engine_from_settings(config: Settings, read_only: bool = False):
+    url = (config.read_database_url or config.database_url) if read_only else config.database_url
+    async_engine = create_async_engine(to_async_url(url), **engine_options(url, config, read_only, is_async=True))
+    bind_engine(async_engine.sync_engine, config)
+    if async_engine.dialect.name == "sqlite":
+        set_sqlite_pragmas(async_engine.sync_engine, config, read_only)
+    return async_engine
+
+
+Base = declarative_base()
+
+class Teacher(Base):
+    __tablename__ = "teachers"
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, unique=True, index=True)
+    full_name = Column(String)
+    hashed_password = Column(String)
+    is_active = Column(Boolean, default=True)
+
+class Student(Base):
+    __tablename__ = "students"
+    id = Column(Integer, primary_key=True, index=True)
+    full_name = Column(String, index=True)
+    class_group = Column(String, index=True)
+
+    # AUTOINCREMENT: id выпущенного в архив ученика не достаётся новому (см. archive.py)
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class Subject(Base):
+    __tablename__ = "subjects"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True)
+
+class Grade(Base):
+    __tablename__ = "grades"
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"))
+    subject_id = Column(Integer, ForeignKey("subjects.id"))
+    grade = Column(Integer)  # 1-5
+    date = Column(Date)
+
+    __table_args__ = (
+        Index("ix_grades_student_date", "student_id", "date"),
+        Index("ix_grades_subject_date", "subject_id", "date"),
+        Index("ix_grades_student_subject", "student_id", "subject_id", "grade"),
+        Index("ix_grades_date_id", "date", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+class ArchivedGrade(Base):
+    # Оценки прошлых учебных лет и выпущенных классов (archive.py): рабочая таблица grades
+    # и её индексы не растут бесконечно. id сохраняется из grades
+    __tablename__ = "grades_archive"
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer)
+    subject_id = Column(Integer)
+    grade = Column(Integer)
+    date = Column(Date)
+
+    __table_args__ = (
+        Index("ix_grades_archive_student_date", "student_id", "date"),
+        Index("ix_grades_archive_subject_date", "subject_id", "date"),
+        Index("ix_grades_archive_date_id", "date", "id"),
+    )
+
+class ArchivedStudent(Base):
+    __tablename__ = "students_archive"
+    id = Column(Integer, primary_key=True)
+    full_name = Column(String)
+    class_group = Column(String, index=True)
+    graduated_on = Column(Date)
+
+class GradeRollup(Base):
+    # Накопительные агрегаты по паре (студент, предмет), обновляются при каждой записи оценок
+    __tablename__ = "grade_rollups"
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Integer, nullable=False, default=0)
+    min = Column(Integer)
+    max = Column(Integer)
+
+class StudentRollup(Base):
+    __tablename__ = "student_rollups"
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Integer, nullable=False, default=0)
+
+class GradeTrendRollup(Base):
+    # Агрегаты по календарным периодам (неделя с понедельника, месяц) для графиков динамики:
+    # /students/{id}/trend читает по строке на период, а не все оценки ученика
+    __tablename__ = "grade_trend_rollups"
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), primary_key=True)
+    bucket = Column(String, primary_key=True)  # week | month
+    start = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Integer, nullable=False, default=0)
+
+class StudentTrendRollup(Base):
+    # То же по всем предметам ученика
+    __tablename__ = "student_trend_rollups"
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    bucket = Column(String, primary_key=True)
+    start = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Integer, nullable=False, default=0)
+
+class TableVersion(Base):
+    # Счётчик изменений таблицы: увеличивается в транзакции каждой записи, из него строится ETag
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+class GradeChange(Base):
+    # Журнал изменений оценок (changes.py): строка пишется в транзакции самой записи.
+    # seq с AUTOINCREMENT только растёт — по нему клиенты продолжают ленту (?since=, Last-Event-ID).
+    # Поля оценки — её состояние после изменения, для delete — последнее перед удалением
+    __tablename__ = "grade_changes"
+    seq = Column(Integer, primary_key=True)
+    op = Column(String, nullable=False)  # create | update | delete
+    grade_id = Column(Integer, nullable=False)
+    student_id = Column(Integer)
+    subject_id = Column(Integer)
+    class_group = Column(String)
+    grade = Column(Integer)
+    date = Column(Date)
+    changed_at = Column(DateTime)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# Полнотекстовый индекс учеников (search.py): FTS5 с триграммами ищет по подстроке без учёта регистра,
+# в том числе кириллицу. Внешнее содержимое — таблица students, синхронизация триггерами, поэтому индекс
+# видит и пакетные вставки (импорт, генератор данных), и удаления при выпуске класса
+STUDENTS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE students_fts USING fts5("
+    "full_name, class_group, content='students', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER students_fts_insert AFTER INSERT ON students BEGIN "
+    "INSERT INTO students_fts(rowid, full_name, class_group) VALUES (new.id, new.full_name, new.class_group); END",
+    "CREATE TRIGGER students_fts_delete AFTER DELETE ON students BEGIN "
+    "INSERT INTO students_fts(students_fts, rowid, full_name, class_group) "
+    "VALUES ('delete', old.id, old.full_name, old.class_group); END",
+    "CREATE TRIGGER students_fts_update AFTER UPDATE OF full_name, class_group ON students BEGIN "
+    "INSERT INTO students_fts(students_fts, rowid, full_name, class_group) "
+    "VALUES ('delete', old.id, old.full_name, old.class_group); "
+    "INSERT INTO students_fts(rowid, full_name, class_group) VALUES (new.id, new.full_name, new.class_group); END",
+    # Индекс для учеников, добавленных до появления students_fts
+    "INSERT INTO students_fts(students_fts) VALUES ('rebuild')",
+)
+
+@event.listens_for(Base.metadata, "after_create")
+def create_students_fts(target, connection, **kw):
+    # create_all не создаёт виртуальные таблицы; на других СУБД поиск работает без индекса (search.py)
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students_fts'"
+    ).scalar()
+    if not exists:
+        for statement in STUDENTS_FTS_DDL:
+            connection.exec_driver_sql(statement)
+
+# Увеличивается при изменении моделей. create_all создаёт только недостающие таблицы: индексы и
+# AUTOINCREMENT существующих таблиц добавляет migrate
+SCHEMA_VERSION = 5
+
+# Где ещё встречаются id таблицы после удаления строк: счётчик AUTOINCREMENT при миграции
+# начинается выше них, чтобы id выпущенного ученика или перенесённой в архив оценки не достался новой строке
+ISSUED_IDS = {
+    "students": (("students_archive", "id"),),
+    "grades": (("grades_archive", "id"), ("grade_changes", "grade_id")),
+}
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+def schema_version(connection):
+    try:
+        # Готовый SQL: при старте не тратим время на конфигурацию мапперов и компиляцию запроса
+        return connection.exec_driver_sql("SELECT version FROM schema_version WHERE id = 1").scalar()
+    except DBAPIError:  # таблицы ещё нет — новая база
+        connection.rollback()
+        return None
+
+def _sqlite_tables(connection) -> dict:
+    return dict(connection.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'table'").all())
+
+def _rebuild_with_autoincrement(connection, table, existing: dict):
+    # SQLite не умеет ALTER TABLE ... AUTOINCREMENT: новая таблица, копия строк, замена старой.
+    # Индексы и триггеры удаляются вместе со старой таблицей и создаются заново (migrate, create_all)
+    name = table.name
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect)).strip()
+    connection.exec_driver_sql(ddl.replace(f"CREATE TABLE {name} ", f"CREATE TABLE _new_{name} ", 1))
+    old_columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({name})")}
+    columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+    connection.exec_driver_sql(f"INSERT INTO _new_{name} ({columns}) SELECT {columns} FROM {name}")
+    issued = [
+        f"(SELECT MAX({column}) FROM {source})" for source, column in ISSUED_IDS.get(name, ()) if source in existing
+    ]
+    if issued:
+        # Строки в sqlite_sequence нет, если таблица пуста (все ученики выпущены)
+        connection.exec_driver_sql(
+            f"INSERT INTO sqlite_sequence (name, seq) SELECT '_new_{name}', 0 "
+            f"WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '_new_{name}')"
+        )
+        connection.exec_driver_sql(
+            f"UPDATE sqlite_sequence SET seq = MAX(seq, {', '.join(f'COALESCE({i}, 0)' for i in issued)}) "
+            f"WHERE name = '_new_{name}'"
+        )
+    if name == "students" and "students_fts" in existing:
+        # Триггеры полнотекстового индекса пропадут со старой таблицей — create_all создаст индекс заново
+        connection.exec_driver_sql("DROP TABLE students_fts")
+    connection.exec_driver_sql(f"DROP TABLE {name}")
+    connection.exec_driver_sql(f"ALTER TABLE _new_{name} RENAME TO {name}")
+
+def migrate(connection):
+    # Изменения существующих таблиц, которые create_all не делает. Выполняется до create_all
+    if connection.dialect.name == "sqlite":
+        existing = _sqlite_tables(connection)
+        for table in Base.metadata.sorted_tables:
+            sql = existing.get(table.name)
+            if sql and table.dialect_options["sqlite"]["autoincrement"] and "AUTOINCREMENT" not in sql.upper():
+                _rebuild_with_autoincrement(connection, table, existing)
+
+def create_missing_indexes(connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def ensure_schema(connection) -> bool:
+    # Один SELECT, если схема актуальна; DDL выполняется только для новой или устаревшей базы.
+    # Возвращает True, если схема обновлялась
+    if schema_version(connection) == SCHEMA_VERSION:
+        return False
+    try:
+        migrate(connection)
+        Base.metadata.create_all(bind=connection)
+        create_missing_indexes(connection)
+        connection.execute(SchemaVersion.__table__.delete())
+        connection.execute(SchemaVersion.__table__.insert().values(id=1, version=SCHEMA_VERSION))
+        connection.commit()
+    except DBAPIError:
+        # Параллельный воркер успел создать схему первым
+        connection.rollback()
+        if schema_version(connection) != SCHEMA_VERSION:
+            raise
+        return False
+    return True
+
+class Database:
+    # Движки и фабрики сессий для одних настроек. Конструктор не подключается к БД:
+    # схема проверяется в lifespan приложения (main.create_app).
+    # В in-memory режиме синхронный и асинхронный движки — разные базы, поэтому
+    # приложение работает только с движками своего режима (settings.async_mode)
+    def __init__(self, config: Settings):
+        self.config = config
+        self.engine = create_engine_from_settings(config)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Отдельный пул только для чтения (GET-эндпоинты): в режиме WAL читатели не ждут писателей.
+        # Для in-memory базы отдельный пул увидел бы другую БД, поэтому используется общий движок.
+        self.read_engine = (
+            self.engine if is_sqlite_memory(config.database_url) else create_engine_from_settings(config, read_only=True)
+        )
+        self.ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.read_engine)
+
+        self.async_engine = create_async_engine_from_settings(config)
+        # expire_on_commit=False: после commit атрибуты не перечитываются лениво вне greenlet
+        self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        self.async_read_engine = (
+            self.async_engine if is_sqlite_memory(config.database_url)
+            else create_async_engine_from_settings(config, read_only=True)
+        )
+        self.AsyncReadSessionLocal = async_sessionmaker(
+            self.async_read_engine, autoflush=False, expire_on_commit=False
+        )
+
+    def ensure_schema(self) -> bool:
+        with self.engine.connect() as connection:
+            return ensure_schema(connection)
+
+    async def ensure_schema_async(self) -> bool:
+        async with self.async_engine.connect() as connection:
+            return await connection.run_sync(ensure_schema)
+
+    # Единая база на всё приложение; с несколькими школами вместо Database — tenancy.TenantDatabases
+    @contextmanager
+    def lease(self, request: Request):
+        yield self
+
+    @asynccontextmanager
+    async def lease_async(self, request: Request):
+        yield self
+
+    def databases(self) -> list:
+        # Открытые базы: одна; у TenantDatabases — базы школ
+        return [self]
+
+    def close(self):
+        # Только синхронные движки: асинхронные закрываются в dispose()
+        self.engine.dispose()
+        if self.read_engine is not self.engine:
+            self.read_engine.dispose()
+
+    async def dispose(self):
+        self.close()
+        await self.async_engine.dispose()
+        if self.async_read_engine is not self.async_engine:
+            await self.async_read_engine.dispose()
+
+# Зависимости берут движки из приложения, созданного main.create_app (для школы из запроса, если их несколько)
+def get_config(request: Request) -> Settings:
+    return request.app.state.config
+
+def get_db(request: Request):
+    with request.app.state.database.lease(request) as database:
+        db = database.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+def get_read_db(request: Request):
+    with request.app.state.database.lease(request) as database:
+        db = database.ReadSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+async def get_async_db(request: Request):
+    async with request.app.state.database.lease_async(request) as database:
+        async with database.AsyncSessionLocal() as db:
+            yield db
+
+async def get_async_read_db(request: Request):
+    async with request.app.state.database.lease_async(request) as database:
+        async with database.AsyncReadSessionLocal() as db:
+            yield db
+
+# Долгие пакетные операции асинхронного режима (импорт CSV, архивация): AsyncSession.run_sync выполняет
+# функцию в потоке event loop, и разбор файла с пакетами INSERT...SELECT на минуты остановил бы все запросы.
+# Поэтому функция crud идёт в пуле потоков на синхронной сессии той же базы. У in-memory SQLite
+# синхронный движок — другая база: там остаётся run_sync
+async def run_batch(request: Request, fn, *args):
+    async with request.app.state.database.lease_async(request) as database:
+        if is_sqlite_memory(database.config.database_url):
+            async with database.AsyncSessionLocal() as db:
+                return await db.run_sync(fn, *args)
+        return await run_in_threadpool(_run_in_session, database.SessionLocal, fn, args)
+
+def _run_in_session(session_factory, fn, args):
+    with session_factory() as db:
+        return fn(db, *args)
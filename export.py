@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+from datetime import date
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import archive
+import crud
+
+# Сколько строк читается из курсора и сериализуется за один раз
+EXPORT_CHUNK_SIZE = 1000
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def grades_query(
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        include_archived: bool = False
+):
+    # Только нужные колонки — без ORM-объектов и identity map
+    grades = archive.grades_source(include_archived)
+    return (
+        select(grades.c.id, grades.c.student_id, grades.c.subject_id, grades.c.grade, grades.c.date)
+        .where(*crud.grade_filters(student_id, subject_id, start_date, end_date, grades))
+        .order_by(grades.c.date, grades.c.id)
+    )
+
+
+def students_query(class_group: Optional[str] = None, include_archived: bool = False):
+    students = archive.students_source(include_archived)
+    query = select(students.c.id, students.c.full_name, students.c.class_group)
+    if class_group:
+        query = query.where(students.c.class_group == class_group)
+    return query.order_by(students.c.id)
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def header_chunk(columns, fmt: str) -> bytes:
+    if fmt != "csv":
+        return b""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue().encode()
+
+
+def encode_chunk(columns, rows, fmt: str) -> bytes:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=_json_default) + "\n" for row in rows
+    ).encode()
+
+
+def encode_rows(db: Session, query, fmt: str):
+    result = db.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+    columns = list(result.keys())
+    yield header_chunk(columns, fmt)
+    for rows in result.partitions():
+        yield encode_chunk(columns, rows, fmt)
+
+
+def stream_rows(request: Request, query, fmt: str):
+    # Тело StreamingResponse выполняется уже после выхода из зависимостей (get_read_db): база школы
+    # (tenancy) освобождена и может быть закрыта. Поэтому генератор сам занимает базу и открывает сессию,
+    # как changes.stream_response. Короткая аренда до ответа — чтобы ошибки школы (400/403/421) пришли кодом
+    with request.app.state.database.lease(request):
+        pass
+
+    def chunks():
+        with request.app.state.database.lease(request) as database, database.ReadSessionLocal() as db:
+            yield from encode_rows(db, query, fmt)
+
+    return chunks()
+
+
+async def stream_rows_async(request: Request, query, fmt: str):
+    async with request.app.state.database.lease_async(request):
+        pass
+
+    async def chunks():
+        async with request.app.state.database.lease_async(request) as database:
+            async with database.AsyncReadSessionLocal() as db:
+                result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+                columns = list(result.keys())
+                yield header_chunk(columns, fmt)
+                async for rows in result.partitions():
+                    yield encode_chunk(columns, rows, fmt)
+
+    return chunks()
+
+
+def export_response(chunks, name: str, fmt: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
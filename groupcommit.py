@@ -0,0 +1,243 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from weakref import WeakKeyDictionary
+
+from fastapi import HTTPException, Request, status
+
+import changes
+import database
+import metrics
+import models
+import refcache
+import rollups
+import versions
+from settings import Settings
+
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Поток записи завершается после простоя и запускается заново следующей оценкой
+IDLE_SECONDS = 1.0
+
+
+class GroupCommitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batch_size = metrics.Histogram(BATCH_BUCKETS)
+        self.flush_seconds = metrics.Histogram(metrics.LATENCY_BUCKETS)  # транзакция пакета
+        self.wait_seconds = metrics.Histogram(metrics.LATENCY_BUCKETS)  # от постановки в очередь до ответа
+        self.rejected = 0
+
+    def observe_batch(self, size: int, seconds: float, waits):
+        with self._lock:
+            self.batch_size.observe(size)
+            self.flush_seconds.observe(seconds)
+            for wait in waits:
+                self.wait_seconds.observe(wait)
+
+
+stats = GroupCommitStats()
+
+
+def _check(grade: models.GradeCreate, students, subjects):
+    # Те же проверки и ответы, что у crud.create_grade
+    if not 1 <= grade.grade <= 5:
+        return HTTPException(status_code=400, detail="Grade must be between 1 and 5")
+    if grade.student_id not in students:
+        return HTTPException(status_code=404, detail="Student not found")
+    if grade.subject_id not in subjects:
+        return HTTPException(status_code=404, detail="Subject not found")
+    return None
+
+
+class GradeWriter:
+    # Один поток записи на базу: забирает из очереди до batch_size оценок (ждёт следующие не дольше
+    # interval_ms после первой) и записывает их одной транзакцией — один fsync и одна блокировка записи
+    # SQLite на пакет вместо каждой оценки. Запрос ждёт commit своего пакета, поэтому подтверждённая
+    # оценка так же надёжно записана, как при commit на каждый запрос.
+    # Очередь ограничена: когда она заполнена, запрос сразу получает 503 с Retry-After.
+    # Если транзакция пакета не прошла, оценки пишутся по одной: ошибку получает только запрос плохой строки.
+    # При остановке приложения (close) очередь дописывается до закрытия движков
+    def __init__(self, session_factory, batch_size: int, interval_ms: float, max_pending: int, retry_after: int = 1):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.retry_after = retry_after
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, grade: models.GradeCreate) -> Future:
+        future = Future()
+        with self._lock:
+            try:
+                if self._closed:
+                    raise queue.Full
+                self._queue.put_nowait((grade, future, time.perf_counter()))
+            except queue.Full:
+                stats.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many pending grade writes, retry later",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="grade-writer", daemon=True)
+                self._thread.start()
+        return future
+
+    def create(self, grade: models.GradeCreate) -> models.Grade:
+        # Блокирует вызывающий поток до commit пакета; эндпоинты ждут через create_async
+        return self.submit(grade).result()
+
+    def close(self):
+        # Новые оценки больше не принимаются; поток дописывает очередь и завершается.
+        # Пустой элемент в конце очереди будит поток, ждущий следующую оценку
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    async def create_async(self, grade: models.GradeCreate) -> models.Grade:
+        return await asyncio.wrap_future(self.submit(grade))
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=IDLE_SECONDS)
+        except queue.Empty:
+            return None
+        if first is None:  # close: всё, что было в очереди, уже записано
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            batch.append(item)
+        # Запросы, отменённые до записи (клиент ушёл), пропускаются
+        return [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                # Проверка и выход под той же блокировкой, под которой submit кладёт оценку в очередь
+                with self._lock:
+                    if self._closed or self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception as e:
+            pending = [item for item in batch if not item[1].done()]
+            if len(pending) == 1:
+                pending[0][1].set_exception(e)
+            else:
+                # Одна плохая строка не должна отменять весь пакет: повторяем по одной оценке
+                for item in pending:
+                    try:
+                        self._write([item])
+                    except Exception as error:
+                        item[1].set_exception(error)
+        finished = time.perf_counter()
+        stats.observe_batch(len(batch), finished - started, (finished - queued for _, _, queued in batch))
+
+    def _write(self, batch):
+        accepted = []
+        with self.session_factory() as db:
+            grades = [grade for grade, _, _ in batch]
+            students = refcache.existing(db, refcache.STUDENTS, (g.student_id for g in grades))
+            subjects = refcache.existing(db, refcache.SUBJECTS, (g.subject_id for g in grades))
+            for grade, future, _ in batch:
+                error = _check(grade, students, subjects)
+                if error is None:
+                    accepted.append((database.Grade(**grade.model_dump()), future))
+                else:
+                    future.set_exception(error)
+            if not accepted:
+                return
+            db.add_all(db_grade for db_grade, _ in accepted)
+            db.flush()
+            changes.record(db, changes.CREATE, (db_grade.id for db_grade, _ in accepted))
+            rollups.apply(db, added=[(g.student_id, g.subject_id, g.grade, g.date) for g, _ in accepted])
+            versions.bump(db, versions.GRADES)
+            # Ответы собираются до commit: id уже известны после flush, refresh не нужен
+            results = [models.Grade.model_validate(db_grade) for db_grade, _ in accepted]
+            db.commit()
+        for (_, future), result in zip(accepted, results):
+            future.set_result(result)
+
+
+_writers = WeakKeyDictionary()  # Database -> GradeWriter
+_writers_lock = threading.Lock()
+
+
+def writer(journal_db: database.Database) -> GradeWriter:
+    with _writers_lock:
+        grade_writer = _writers.get(journal_db)
+        if grade_writer is None:
+            config: Settings = journal_db.config
+            grade_writer = _writers[journal_db] = GradeWriter(
+                journal_db.SessionLocal,
+                batch_size=config.group_commit_batch_size,
+                interval_ms=config.group_commit_interval_ms,
+                max_pending=config.group_commit_max_pending,
+            )
+        return grade_writer
+
+
+def close_writers(databases):
+    # Остановка приложения (lifespan): очереди баз дописываются до закрытия их движков
+    with _writers_lock:
+        writers = [_writers.pop(journal_db) for journal_db in databases if journal_db in _writers]
+    for grade_writer in writers:
+        grade_writer.close()
+
+
+# Зависимости: писатель базы из запроса (для школы — её базы) или None, если group commit выключен
+def get_grade_writer(request: Request):
+    with request.app.state.database.lease(request) as journal_db:
+        yield writer(journal_db) if journal_db.config.group_commit else None
+
+
+async def get_async_grade_writer(request: Request):
+    async with request.app.state.database.lease_async(request) as journal_db:
+        yield writer(journal_db) if journal_db.config.group_commit else None
+
+
+def _collect_metrics() -> list:
+    with _writers_lock:
+        depth = sum(grade_writer.depth() for grade_writer in _writers.values())
+    with stats._lock:
+        return [
+            ("journal_group_commit_queue_depth", "Grades waiting for the group commit writer.", "gauge", [({}, depth)]),
+            ("journal_group_commit_batch_size", "Grades written per group commit transaction.",
+             "histogram", [({}, stats.batch_size)]),
+            ("journal_group_commit_flush_seconds", "Duration of a group commit transaction.",
+             "histogram", [({}, stats.flush_seconds)]),
+            ("journal_group_commit_wait_seconds", "Time from enqueueing a grade to its commit.",
+             "histogram", [({}, stats.wait_seconds)]),
+            ("journal_group_commit_rejected_total", "Grade writes rejected with 503 because the queue was full.",
+             "counter", [({}, stats.rejected)]),
+        ]
+
+
+metrics.register_collector(_collect_metrics)
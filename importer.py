@@ -0,0 +1,174 @@
+import csv
+import io
+import time
+from datetime import date
+from itertools import islice
+from typing import BinaryIO, Dict, List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+import changes
+import database
+import models
+import rollups
+import versions
+
+IMPORT_COLUMNS = ("full_name", "class_group", "subject", "grade", "date")
+# В отчёт попадают только первые ошибки, чтобы память не росла с размером файла
+MAX_REPORTED_ERRORS = 100
+KEYS_CHUNK_SIZE = 400
+
+
+def _resolve_students(db: Session, keys) -> Tuple[Dict[Tuple[str, str], int], int]:
+    # Поиск по индексированному full_name, class_group сверяется уже в Python
+    keys = set(keys)
+    names = sorted({full_name for full_name, _ in keys})
+    found = {}
+    for i in range(0, len(names), KEYS_CHUNK_SIZE):
+        chunk = names[i:i + KEYS_CHUNK_SIZE]
+        rows = db.execute(
+            select(database.Student.id, database.Student.full_name, database.Student.class_group)
+            .where(database.Student.full_name.in_(chunk))
+            .order_by(database.Student.id)
+        )
+        for student_id, full_name, class_group in rows:
+            if (full_name, class_group) in keys:
+                found.setdefault((full_name, class_group), student_id)
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        db.execute(insert(database.Student), [
+            {"full_name": full_name, "class_group": class_group} for full_name, class_group in missing
+        ])
+        created, _ = _resolve_students(db, missing)
+        found.update(created)
+    return found, len(missing)
+
+
+def _resolve_subjects(db: Session, names) -> Tuple[Dict[str, int], int]:
+    names = list(names)
+    found = {}
+    for i in range(0, len(names), KEYS_CHUNK_SIZE):
+        chunk = names[i:i + KEYS_CHUNK_SIZE]
+        found.update(db.execute(
+            select(database.Subject.name, database.Subject.id).where(database.Subject.name.in_(chunk))
+        ).all())
+
+    missing = [name for name in names if name not in found]
+    if missing:
+        db.execute(insert(database.Subject), [{"name": name} for name in missing])
+        created, _ = _resolve_subjects(db, missing)
+        found.update(created)
+    return found, len(missing)
+
+
+def _parse_row(row: dict):
+    # Возвращает (ключ студента | None, предмет | None, оценка | None, дата | None)
+    full_name = (row.get("full_name") or "").strip()
+    class_group = (row.get("class_group") or "").strip()
+    subject = (row.get("subject") or "").strip()
+    grade = (row.get("grade") or "").strip()
+    day = (row.get("date") or "").strip()
+
+    if bool(full_name) != bool(class_group):
+        raise ValueError("full_name and class_group must be given together")
+    student = (full_name, class_group) if full_name else None
+
+    if not grade:
+        if day:
+            raise ValueError("date given without grade")
+        if not student and not subject:
+            raise ValueError("empty row")
+        return student, subject or None, None, None
+
+    if not student or not subject:
+        raise ValueError("grade requires full_name, class_group and subject")
+    value = int(grade)
+    if value < 1 or value > 5:
+        raise ValueError("Grade must be between 1 and 5")
+    return student, subject, value, date.fromisoformat(day)
+
+
+def _import_chunk(db: Session, rows: List[Tuple[int, dict]], report: models.ImportReport):
+    parsed = []
+    for line, row in rows:
+        try:
+            parsed.append(_parse_row(row))
+        except ValueError as e:
+            report.errors_count += 1
+            if len(report.errors) < MAX_REPORTED_ERRORS:
+                report.errors.append(models.ImportRowError(line=line, detail=str(e)))
+
+    # Пакетное разрешение студентов и предметов: по запросу на каждые KEYS_CHUNK_SIZE ключей
+    students, students_created = _resolve_students(db, {p[0] for p in parsed if p[0]})
+    subjects, subjects_created = _resolve_subjects(db, {p[1] for p in parsed if p[1]})
+
+    grades = [
+        {"student_id": students[student], "subject_id": subjects[subject], "grade": grade, "date": day}
+        for student, subject, grade, day in parsed if grade is not None
+    ]
+    if grades:
+        grade_ids = db.execute(insert(database.Grade).returning(database.Grade.id), grades).scalars().all()
+        changes.record(db, changes.CREATE, grade_ids)
+        rollups.apply(db, added=[(g["student_id"], g["subject_id"], g["grade"], g["date"]) for g in grades])
+    changed = [
+        table for table, count in (
+            (versions.STUDENTS, students_created), (versions.SUBJECTS, subjects_created), (versions.GRADES, len(grades))
+        ) if count
+    ]
+    versions.bump(db, *changed)
+    db.commit()
+
+    report.students_created += students_created
+    report.subjects_created += subjects_created
+    report.grades_inserted += len(grades)
+    report.chunks += 1
+
+
+def import_csv(db: Session, stream: BinaryIO, chunk_size: int) -> models.ImportReport:
+    # Файл читается построчно, в памяти не больше chunk_size строк
+    started = time.perf_counter()
+    report = models.ImportReport()
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    try:
+        if not set(IMPORT_COLUMNS) & set(reader.fieldnames or ()):
+            report.errors_count = 1
+            report.errors.append(models.ImportRowError(
+                line=1, detail=f"Expected a header with columns: {', '.join(IMPORT_COLUMNS)}"
+            ))
+            return report
+
+        numbered = ((reader.line_num, row) for row in reader)
+        while True:
+            rows = list(islice(numbered, chunk_size))
+            if not rows:
+                break
+            _import_chunk(db, rows, report)
+            report.rows += len(rows)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Файл не в UTF-8 или сломан CSV. Ошибка возникает при чтении следующего пакета, до его записи:
+        # уже закоммиченные пакеты (report.chunks) остаются, клиент получает 400 с отчётом о них
+        db.rollback()
+        if isinstance(e, UnicodeDecodeError):
+            # Текст декодируется блоками, поэтому строка — первая ещё не прочитанная, а не точная
+            line, detail = reader.line_num + 1, "File is not valid UTF-8"
+        else:
+            line, detail = reader.line_num, f"Malformed CSV: {e}"
+        report.errors_count += 1
+        report.errors.append(models.ImportRowError(line=line, detail=detail))
+        _finish(report, started)
+        raise HTTPException(status_code=400, detail=report.model_dump(mode="json"))
+    finally:
+        # Не даём TextIOWrapper закрыть загруженный файл — им владеет UploadFile
+        text.detach()
+
+    _finish(report, started)
+    return report
+
+
+def _finish(report: models.ImportReport, started: float):
+    report.seconds = round(time.perf_counter() - started, 3)
+    report.rows_per_sec = round(report.rows / report.seconds) if report.seconds else report.rows
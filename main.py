@@ -1,316 +1,394 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import date, timedelta
-from typing import List, Optional
-import models
-from database import get_db, engine, Base
-import auth
-from auth import get_current_teacher
-import database
-
-app = FastAPI()
-
-Base.metadata.create_all(bind=engine)
-
-
-# ========== Аутентификация ==========
-@app.post("/register/", response_model=models.Teacher, status_code=status.HTTP_201_CREATED)
-def register_teacher(
-        teacher_data: models.TeacherCreate,
-        db: Session = Depends(get_db)
-):
-    # Проверяем валидность email
-    try:
-        validated_email = models.TeacherBase(email=teacher_data.email, full_name=teacher_data.full_name).email
-    except ValueError as e:
-        raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail=str(e)
-        )
-
-    # Проверяем не зарегистрирован ли уже преподаватель
-    db_teacher = auth.get_teacher_by_email(db, validated_email)
-    if db_teacher:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-
-    # Хешируем пароль и создаем преподавателя
-    hashed_password = auth.get_password_hash(teacher_data.password)
-    db_teacher = database.Teacher(
-        email=validated_email,
-        full_name=teacher_data.full_name,
-        hashed_password=hashed_password
-    )
-    db.add(db_teacher)
-    db.commit()
-    db.refresh(db_teacher)
-    return db_teacher
-
-
-@app.post("/token", response_model=models.Token)
-def login_for_access_token(
-        form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
-):
-    teacher = auth.authenticate_teacher(db, form_data.username, form_data.password)
-    if not teacher:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    # Создаем токен доступа
-    access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(
-        data={"sub": teacher.email},
-        expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
-
-
-@app.get("/teachers/me/", response_model=models.Teacher)
-def read_teachers_me(current_teacher: models.Teacher = Depends(get_current_teacher)):
-    return current_teacher
-
-
-# ========== Students Endpoints ==========
-@app.post("/students/", response_model=models.Student)
-def create_student(student: models.StudentCreate, db: Session = Depends(get_db)):
-    db_student = database.Student(**student.dict())
-    db.add(db_student)
-    db.commit()
-    db.refresh(db_student)
-    return db_student
-
-
-@app.get("/students/", response_model=List[models.Student])
-def read_students(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(database.Student).offset(skip).limit(limit).all()
-
-
-@app.get("/students/{student_id}", response_model=models.Student)
-def read_student(student_id: int, db: Session = Depends(get_db)):
-    db_student = db.query(database.Student).filter(database.Student.id == student_id).first()
-    if not db_student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    return db_student
-
-
-@app.put("/students/{student_id}", response_model=models.Student)
-def update_student(student_id: int, student: models.StudentCreate, db: Session = Depends(get_db)):
-    db_student = db.query(database.Student).filter(database.Student.id == student_id).first()
-    if not db_student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    for key, value in student.dict().items():
-        setattr(db_student, key, value)
-
-    db.commit()
-    db.refresh(db_student)
-    return db_student
-
-
-@app.delete("/students/{student_id}")
-def delete_student(student_id: int, db: Session = Depends(get_db)):
-    # Сначала удаляем все оценки студента
-    db.query(database.Grade).filter(database.Grade.student_id == student_id).delete()
-
-    # Затем удаляем самого студента
-    db_student = db.query(database.Student).filter(database.Student.id == student_id).first()
-    if not db_student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    db.delete(db_student)
-    db.commit()
-    return {"message": "Student deleted successfully"}
-
-
-# ========== Subjects Endpoints ==========
-@app.post("/subjects/", response_model=models.Subject)
-def create_subject(subject: models.SubjectCreate, db: Session = Depends(get_db)):
-    db_subject = database.Subject(**subject.dict())
-    db.add(db_subject)
-    db.commit()
-    db.refresh(db_subject)
-    return db_subject
-
-
-@app.get("/subjects/", response_model=List[models.Subject])
-def read_subjects(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(database.Subject).offset(skip).limit(limit).all()
-
-
-@app.get("/subjects/{subject_id}", response_model=models.Subject)
-def read_subject(subject_id: int, db: Session = Depends(get_db)):
-    db_subject = db.query(database.Subject).filter(database.Subject.id == subject_id).first()
-    if not db_subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-    return db_subject
-
-
-@app.put("/subjects/{subject_id}", response_model=models.Subject)
-def update_subject(subject_id: int, subject: models.SubjectCreate, db: Session = Depends(get_db)):
-    db_subject = db.query(database.Subject).filter(database.Subject.id == subject_id).first()
-    if not db_subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-
-    for key, value in subject.dict().items():
-        setattr(db_subject, key, value)
-
-    db.commit()
-    db.refresh(db_subject)
-    return db_subject
-
-
-@app.delete("/subjects/{subject_id}")
-def delete_subject(subject_id: int, db: Session = Depends(get_db)):
-    # Проверяем есть ли оценки по этому предмету
-    has_grades = db.query(database.Grade).filter(database.Grade.subject_id == subject_id).first()
-    if has_grades:
-        raise HTTPException(
-            status_code=400,
-            detail="Cannot delete subject with existing grades. Delete grades first."
-        )
-
-    db_subject = db.query(database.Subject).filter(database.Subject.id == subject_id).first()
-    if not db_subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-
-    db.delete(db_subject)
-    db.commit()
-    return {"message": "Subject deleted successfully"}
-
-
-# ========== Grades Endpoints ==========
-@app.post("/grades/", response_model=models.Grade)
-def create_grade(grade: models.GradeCreate, db: Session = Depends(get_db)):
-    # Проверяем что оценка от 1 до 5
-    if grade.grade < 1 or grade.grade > 5:
-        raise HTTPException(status_code=400, detail="Grade must be between 1 and 5")
-
-    # Проверяем что студент существует
-    student = db.query(database.Student).filter(database.Student.id == grade.student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    # Проверяем что предмет существует
-    subject = db.query(database.Subject).filter(database.Subject.id == grade.subject_id).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-
-    db_grade = database.Grade(**grade.dict())
-    db.add(db_grade)
-    db.commit()
-    db.refresh(db_grade)
-    return db_grade
-
-
-@app.get("/grades/", response_model=List[models.Grade])
-def read_grades(
-        student_id: Optional[int] = None,
-        subject_id: Optional[int] = None,
-        start_date: Optional[date] = None,
-        end_date: Optional[date] = None,
-        skip: int = 0,
-        limit: int = 100,
-        db: Session = Depends(get_db)
-):
-    query = db.query(database.Grade)
-
-    if student_id:
-        query = query.filter(database.Grade.student_id == student_id)
-    if subject_id:
-        query = query.filter(database.Grade.subject_id == subject_id)
-    if start_date:
-        query = query.filter(database.Grade.date >= start_date)
-    if end_date:
-        query = query.filter(database.Grade.date <= end_date)
-
-    return query.offset(skip).limit(limit).all()
-
-
-@app.get("/grades/{grade_id}", response_model=models.Grade)
-def read_grade(grade_id: int, db: Session = Depends(get_db)):
-    db_grade = db.query(database.Grade).filter(database.Grade.id == grade_id).first()
-    if not db_grade:
-        raise HTTPException(status_code=404, detail="Grade not found")
-    return db_grade
-
-
-@app.put("/grades/{grade_id}", response_model=models.Grade)
-def update_grade(grade_id: int, grade: models.GradeCreate, db: Session = Depends(get_db)):
-    if grade.grade < 1 or grade.grade > 5:
-        raise HTTPException(status_code=400, detail="Grade must be between 1 and 5")
-
-    db_grade = db.query(database.Grade).filter(database.Grade.id == grade_id).first()
-    if not db_grade:
-        raise HTTPException(status_code=404, detail="Grade not found")
-
-    # Проверяем что студент существует
-    student = db.query(database.Student).filter(database.Student.id == grade.student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    # Проверяем что предмет существует
-    subject = db.query(database.Subject).filter(database.Subject.id == grade.subject_id).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-
-    for key, value in grade.dict().items():
-        setattr(db_grade, key, value)
-
-    db.commit()
-    db.refresh(db_grade)
-    return db_grade
-
-
-@app.delete("/grades/{grade_id}")
-def delete_grade(grade_id: int, db: Session = Depends(get_db)):
-    db_grade = db.query(database.Grade).filter(database.Grade.id == grade_id).first()
-    if not db_grade:
-        raise HTTPException(status_code=404, detail="Grade not found")
-
-    db.delete(db_grade)
-    db.commit()
-    return {"message": "Grade deleted successfully"}
-
-
-# ========== Statistics Endpoint ==========
-@app.get("/students/{student_id}/stats")
-def get_student_stats(student_id: int, db: Session = Depends(get_db)):
-    # Проверяем что студент существует
-    student = db.query(database.Student).filter(database.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    # Получаем все оценки студента
-    grades = db.query(database.Grade).filter(database.Grade.student_id == student_id).all()
-
-    if not grades:
-        return {"message": "No grades found for this student"}
-
-    # Вычисляем средний балл
-    avg_grade = sum(grade.grade for grade in grades) / len(grades)
-
-    # Группируем оценки по предметам
-    from collections import defaultdict
-    subjects_grades = defaultdict(list)
-    for grade in grades:
-        subject = db.query(database.Subject).filter(database.Subject.id == grade.subject_id).first()
-        subjects_grades[subject.name].append(grade.grade)
-
-    # Вычисляем средний балл по каждому предмету
-    subjects_avg = {subject: sum(grades) / len(grades)
-                    for subject, grades in subjects_grades.items()}
-
-    return {
-        "student_id": student_id,
-        "full_name": student.full_name,
-        "class_group": student.class_group,
-        "average_grade": round(avg_grade, 2),
-        "subjects": subjects_avg
-    }
+from fastapi import APIRouter, FastAPI, Depends, File, Header, Query, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
+import models
+from database import Database, get_config, get_db, get_read_db
+import admission
+import archive
+import async_api
+import auth
+import changes
+import crud
+import export
+import groupcommit
+import importer
+import metrics
+import refcache
+import search
+import serialization
+import tenancy
+import versions
+from auth import get_current_teacher
+from pagination import page_limit
+from settings import Settings, settings
+
+router = APIRouter()
+
+
+# ========== Аутентификация ==========
+@router.post("/register/", response_model=models.Teacher, status_code=status.HTTP_201_CREATED)
+async def register_teacher(
+        teacher_data: models.TeacherCreate,
+        hasher: auth.PasswordHasher = Depends(auth.get_password_hasher),
+        db: Session = Depends(get_db)
+):
+    # async: пока bcrypt в своём пуле, запрос не держит поток общего пула anyio —
+    # в пуле потоков выполняются только обращения к БД
+    validated_email = await run_in_threadpool(crud.validate_teacher, db, teacher_data)
+
+    # Хешируем пароль и создаем преподавателя
+    hashed_password = await hasher.hash_async(teacher_data.password)
+    return await run_in_threadpool(crud.create_teacher, db, validated_email, teacher_data, hashed_password)
+
+
+@router.post("/token", response_model=models.Token)
+async def login_for_access_token(
+        request: Request,
+        form_data: OAuth2PasswordRequestForm = Depends(),
+        hasher: auth.PasswordHasher = Depends(auth.get_password_hasher),
+        db: Session = Depends(get_db)
+):
+    teacher = await auth.authenticate_teacher_async(db, form_data.username, form_data.password, hasher)
+    return crud.issue_token(teacher, tenancy.current_tenant(request))
+
+
+@router.get("/teachers/me/", response_model=models.Teacher)
+def read_teachers_me(current_teacher: models.Teacher = Depends(get_current_teacher)):
+    return current_teacher
+
+
+# ========== Students Endpoints ==========
+@router.post("/students/", response_model=models.Student)
+def create_student(student: models.StudentCreate, db: Session = Depends(get_db)):
+    return crud.create_student(db, student)
+
+
+@router.get("/students/", response_model=List[models.Student])
+def read_students(
+        response: Response,
+        skip: int = 0,
+        limit: int = Depends(page_limit),
+        after: Optional[str] = None,
+        config: Settings = Depends(get_config),
+        if_none_match: Optional[str] = Header(None),
+        db: Session = Depends(get_read_db)
+):
+    # Опрос без изменений: 304 по версии таблицы, сами строки не читаются
+    not_modified = versions.conditional(db, versions.STUDENTS, if_none_match, response)
+    if not_modified:
+        return not_modified
+    students, next_cursor = crud.list_students(db, skip, limit, after, config.fast_lists)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return serialization.render(students, response)
+
+
+@router.get("/students/export")
+def export_students(
+        request: Request,
+        class_group: Optional[str] = None,
+        fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+        include_archived: bool = False
+):
+    query = export.students_query(class_group, include_archived)
+    return export.export_response(export.stream_rows(request, query, fmt), "students", fmt)
+
+
+@router.get("/students/search", response_model=List[models.Student])
+def search_students(
+        q: str = Query(..., min_length=1, max_length=100),
+        limit: int = Query(20, ge=1, le=100),
+        db: Session = Depends(get_read_db)
+):
+    # Подстрока имени или класса (FTS5 с триграммами): частичные совпадения, кириллица, набор по префиксу
+    return search.search_students(db, q, limit)
+
+
+@router.get("/students/{student_id}", response_model=models.Student)
+def read_student(student_id: int, db: Session = Depends(get_read_db)):
+    return crud.get_student(db, student_id)
+
+
+@router.put("/students/{student_id}", response_model=models.Student)
+def update_student(student_id: int, student: models.StudentCreate, db: Session = Depends(get_db)):
+    return crud.update_student(db, student_id, student)
+
+
+@router.delete("/students/{student_id}")
+def delete_student(student_id: int, db: Session = Depends(get_db)):
+    return crud.delete_student(db, student_id)
+
+
+# ========== Subjects Endpoints ==========
+@router.post("/subjects/", response_model=models.Subject)
+def create_subject(subject: models.SubjectCreate, db: Session = Depends(get_db)):
+    return crud.create_subject(db, subject)
+
+
+@router.get("/subjects/", response_model=List[models.Subject])
+def read_subjects(
+        response: Response,
+        skip: int = 0,
+        limit: int = Depends(page_limit),
+        after: Optional[str] = None,
+        config: Settings = Depends(get_config),
+        if_none_match: Optional[str] = Header(None),
+        db: Session = Depends(get_read_db)
+):
+    # Версия и строки предметов — из копии в памяти (refcache)
+    known = refcache.current(db, versions.SUBJECTS)
+    not_modified = versions.conditional(db, versions.SUBJECTS, if_none_match, response, known)
+    if not_modified:
+        return not_modified
+    subjects, next_cursor = crud.list_subjects(db, skip, limit, after, config.fast_lists)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return serialization.render(subjects, response)
+
+
+@router.get("/subjects/{subject_id}", response_model=models.Subject)
+def read_subject(subject_id: int, db: Session = Depends(get_read_db)):
+    return crud.get_subject(db, subject_id)
+
+
+@router.put("/subjects/{subject_id}", response_model=models.Subject)
+def update_subject(subject_id: int, subject: models.SubjectCreate, db: Session = Depends(get_db)):
+    return crud.update_subject(db, subject_id, subject)
+
+
+@router.delete("/subjects/{subject_id}")
+def delete_subject(subject_id: int, db: Session = Depends(get_db)):
+    return crud.delete_subject(db, subject_id)
+
+
+# ========== Grades Endpoints ==========
+@router.post("/grades/", response_model=models.Grade)
+async def create_grade(
+        grade: models.GradeCreate,
+        db: Session = Depends(get_db),
+        writer: Optional[groupcommit.GradeWriter] = Depends(groupcommit.get_grade_writer)
+):
+    # С JOURNAL_GROUP_COMMIT оценка записывается пакетом вместе с параллельными запросами.
+    # Ожидание commit пакета — в event loop, а не в потоке пула на каждый запрос
+    if writer is not None:
+        return await writer.create_async(grade)
+    return await run_in_threadpool(crud.create_grade, db, grade)
+
+
+@router.post("/grades/bulk", response_model=models.GradeBulkResult)
+def create_grades_bulk(
+        grades: List[models.GradeCreate],
+        atomic: bool = False,
+        db: Session = Depends(get_db)
+):
+    return crud.create_grades_bulk(db, grades, atomic)
+
+
+@router.get("/grades/", response_model=List[models.Grade])
+def read_grades(
+        response: Response,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        skip: int = 0,
+        limit: int = Depends(page_limit),
+        after: Optional[str] = None,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        config: Settings = Depends(get_config),
+        if_none_match: Optional[str] = Header(None),
+        db: Session = Depends(get_read_db)
+):
+    # fields=grade,date,student.full_name и include=student,subject — один select с JOIN вместо запросов на строку
+    fieldset = serialization.grade_fieldset(fields, include)
+    tables = fieldset.tables if fieldset else (versions.GRADES,)
+    not_modified = versions.conditional_many(db, tables, if_none_match, response)
+    if not_modified:
+        return not_modified
+    grades, next_cursor = crud.list_grades(
+        db, student_id, subject_id, start_date, end_date, skip, limit, after, config.fast_lists, fieldset
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return serialization.render(grades, response)
+
+
+@router.get("/grades/export")
+def export_grades(
+        request: Request,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+        include_archived: bool = False
+):
+    # Потоковая выгрузка: память не зависит от числа строк
+    query = export.grades_query(student_id, subject_id, start_date, end_date, include_archived)
+    return export.export_response(export.stream_rows(request, query, fmt), "grades", fmt)
+
+
+@router.get("/grades/changes", response_model=List[models.GradeChange])
+def read_grade_changes(
+        since: int = 0,
+        limit: int = Depends(page_limit),
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        class_group: Optional[str] = None,
+        db: Session = Depends(get_read_db)
+):
+    # Лента изменений: since — seq последнего полученного изменения
+    return crud.grade_changes(db, since, limit, student_id, subject_id, class_group)
+
+
+@router.get("/grades/changes/stream")
+async def stream_grade_changes(
+        request: Request,
+        since: Optional[int] = None,
+        student_id: Optional[int] = None,
+        subject_id: Optional[int] = None,
+        class_group: Optional[str] = None,
+):
+    # Server-Sent Events: без since — только новые изменения, при переподключении — с Last-Event-ID
+    return await changes.stream_response(request, since, student_id, subject_id, class_group)
+
+
+@router.get("/grades/{grade_id}", response_model=models.Grade)
+def read_grade(
+        grade_id: int,
+        response: Response,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        db: Session = Depends(get_read_db)
+):
+    fieldset = serialization.grade_fieldset(fields, include)
+    return serialization.render(crud.read_grade(db, grade_id, fieldset), response)
+
+
+@router.put("/grades/{grade_id}", response_model=models.Grade)
+def update_grade(grade_id: int, grade: models.GradeCreate, db: Session = Depends(get_db)):
+    return crud.update_grade(db, grade_id, grade)
+
+
+@router.delete("/grades/{grade_id}")
+def delete_grade(grade_id: int, db: Session = Depends(get_db)):
+    return crud.delete_grade(db, grade_id)
+
+
+# ========== Import ==========
+@router.post("/import/csv", response_model=models.ImportReport)
+def import_gradebook_csv(
+        file: UploadFile = File(...),
+        chunk_size: Optional[int] = Query(None, ge=1, le=100_000),
+        config: Settings = Depends(get_config),
+        db: Session = Depends(get_db)
+):
+    # CSV с колонками full_name,class_group,subject,grade,date; коммит каждые chunk_size строк
+    return importer.import_csv(db, file.file, chunk_size or config.import_chunk_size)
+
+
+# ========== Archive ==========
+@router.post("/archive/grades", response_model=models.ArchiveReport)
+def archive_grades(
+        before: date,
+        chunk_size: Optional[int] = Query(None, ge=1, le=100_000),
+        config: Settings = Depends(get_config),
+        db: Session = Depends(get_db)
+):
+    # Оценки раньше before (например, начала текущего учебного года) переносятся в grades_archive
+    return archive.archive_grades(db, before, chunk_size or config.archive_chunk_size)
+
+
+@router.post("/classes/{class_group}/graduate", response_model=models.ArchiveReport)
+def graduate_class(
+        class_group: str,
+        chunk_size: Optional[int] = Query(None, ge=1, le=100_000),
+        config: Settings = Depends(get_config),
+        db: Session = Depends(get_db)
+):
+    return archive.graduate_class(db, class_group, chunk_size or config.archive_chunk_size)
+
+
+# ========== Statistics Endpoint ==========
+@router.get("/students/{student_id}/stats")
+def get_student_stats(
+        student_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        include_archived: bool = False,
+        db: Session = Depends(get_read_db)
+):
+    return crud.student_stats(db, student_id, start_date, end_date, include_archived)
+
+
+@router.get("/students/{student_id}/trend", response_model=models.StudentTrend)
+def get_student_trend(
+        student_id: int,
+        bucket: str = Query("week", pattern="^(week|month)$"),
+        subject_id: Optional[int] = None,
+        db: Session = Depends(get_read_db)
+):
+    # Средняя оценка по неделям или месяцам, по одному предмету или по всем
+    return crud.student_trend(db, student_id, bucket, subject_id)
+
+
+@router.get("/classes/{class_group}/report", response_model=models.ClassReport)
+def get_class_report(
+        class_group: str,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        include_archived: bool = False,
+        db: Session = Depends(get_read_db)
+):
+    return crud.class_report(db, class_group, start_date, end_date, include_archived)
+
+
+def configure(app: FastAPI, config: Settings):
+    # Настройки приложения читаются из app.state (database.get_config), а не из глобального settings:
+    # у двух приложений с разными Settings разные размеры страниц, быстрые списки, пул bcrypt и кеш токенов.
+    # Приложение с настройками по умолчанию делит пул и кеш с CLI (auth.password_hasher, auth.token_cache)
+    app.state.config = config
+    default = config is settings
+    app.state.password_hasher = auth.password_hasher if default else auth.create_password_hasher(config)
+    app.state.token_cache = auth.token_cache if default else auth.create_token_cache(config)
+
+
+def create_app(config: Settings = settings) -> FastAPI:
+    # Импорт модуля не трогает БД: движки создаются здесь, а схема проверяется при старте приложения
+    # С шаблоном tenant_database_url у каждой школы своя база, иначе одна общая
+    database = tenancy.TenantDatabases(config) if config.tenant_database_url else Database(config)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Если версия схемы актуальна — один SELECT вместо create_all с инспекцией всех таблиц
+        if config.async_mode:
+            await database.ensure_schema_async()
+        else:
+            await run_in_threadpool(database.ensure_schema)
+        if isinstance(database, Database):
+            # Кеш id учеников и предметов; базы школ заполняют его при первом обращении
+            await refcache.warm_database(database, config.async_mode)
+        yield
+        # Принятые, но ещё не записанные оценки group commit дописываются до закрытия движков
+        await run_in_threadpool(groupcommit.close_writers, database.databases())
+        await database.dispose()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.database = database
+    configure(app, config)
+    if config.admission_control:
+        # Внутри MetricsMiddleware: отказы 429/503 попадают в метрики запросов с шаблоном маршрута
+        app.add_middleware(admission.AdmissionMiddleware, config=config)
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(metrics.router)
+    # JOURNAL_ASYNC=1 — все эндпоинты работают через AsyncSession (aiosqlite) без пула потоков
+    app.include_router(async_api.router if config.async_mode else router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,269 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from fastapi import APIRouter, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from settings import engine_settings
+
+logger = logging.getLogger("journal.slow_query")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя ячейка — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Summary:
+    # Значение для type "summary": квантили по окну последних наблюдений, sum и count — за всё время
+    def __init__(self, quantiles: dict, total: float, count: int):
+        self.quantiles = quantiles  # "0.5" -> значение
+        self.sum = total
+        self.count = count
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "pool_wait")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait = 0.0
+
+
+# Статистика текущего запроса; sync-эндпоинты в пуле потоков получают копию контекста с тем же объектом
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)  # (method, route, status) -> count
+            self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (method, route)
+            self.request_statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+            self.request_db_seconds = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+            self.pool_wait = Histogram(LATENCY_BUCKETS)
+            self.statements = 0
+            self.db_seconds = 0.0
+            self.slow_queries = 0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.latency[key].observe(seconds)
+            self.request_statements[key].observe(stats.statements)
+            self.request_db_seconds[key].observe(stats.db_seconds)
+
+    def observe_statement(self, seconds: float, slow: bool):
+        with self._lock:
+            self.statements += 1
+            self.db_seconds += seconds
+            self.slow_queries += slow
+
+    def observe_pool_wait(self, seconds: float):
+        with self._lock:
+            self.pool_wait.observe(seconds)
+
+
+registry = Registry()
+
+# Внешние источники значений (кеш токенов, пул bcrypt): функция возвращает
+# [(name, help, type, [(labels, value), ...]), ...]; для type "histogram" value — Histogram, "summary" — Summary
+_collectors: List[Callable[[], list]] = []
+
+
+def register_collector(collector: Callable[[], list]):
+    _collectors.append(collector)
+
+
+# ========== SQLAlchemy ==========
+# Слушатели на классе Engine — действуют для всех движков, включая sync_engine асинхронных
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.journal_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "journal_started", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += seconds
+    slow = 0 < engine_settings(conn.engine).slow_query_ms <= seconds * 1000
+    registry.observe_statement(seconds, slow)
+    if slow:
+        log_slow_query(conn, statement, parameters, seconds, executemany)
+
+
+def log_slow_query(conn, statement: str, parameters, seconds: float, executemany: bool):
+    plan = None
+    # План только для одиночных SELECT в SQLite; выполняется на сыром курсоре, мимо событий движка
+    if conn.dialect.name == "sqlite" and not executemany and statement.lstrip().upper().startswith("SELECT"):
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plan = " | ".join(row[-1] for row in cursor.fetchall())
+        except Exception as e:  # план — диагностика, ошибка не должна ломать запрос
+            plan = f"unavailable: {e}"
+        finally:
+            cursor.close()
+    logger.warning(
+        "slow query %.1f ms: %s%s", seconds * 1000, " ".join(statement.split()), f"; plan: {plan}" if plan else ""
+    )
+
+
+class TimedPoolMixin:
+    # Время получения соединения из пула (ожидание свободного + открытие нового)
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            seconds = time.perf_counter() - started
+            registry.observe_pool_wait(seconds)
+            stats = current_request.get()
+            if stats is not None:
+                stats.pool_wait += seconds
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# ========== ASGI ==========
+class MetricsMiddleware:
+    # Чистый ASGI-middleware: не буферизует тело, поэтому подходит и для потоковых выгрузок.
+    # Маршрут берётся из шаблона пути (/students/{student_id}), а не из URL
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            registry.observe_request(scope["method"], route, status, time.perf_counter() - started, stats)
+
+
+# ========== Prometheus ==========
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _histogram_lines(name: str, labels: dict, histogram: Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+def _summary_lines(name: str, labels: dict, summary: Summary) -> List[str]:
+    lines = [f"{name}{_labels({**labels, 'quantile': q})} {value}" for q, value in summary.quantiles.items()]
+    lines.append(f"{name}_sum{_labels(labels)} {summary.sum}")
+    lines.append(f"{name}_count{_labels(labels)} {summary.count}")
+    return lines
+
+
+def render() -> str:
+    out = []
+
+    def header(name: str, help_text: str, kind: str):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+
+    with registry._lock:
+        header("journal_http_requests_total", "HTTP requests by route and status.", "counter")
+        for (method, route, status), count in sorted(registry.requests.items()):
+            out.append(f"journal_http_requests_total{_labels({'method': method, 'route': route, 'status': status})} {count}")
+        for name, help_text, series in (
+            ("journal_http_request_duration_seconds", "Request latency by route.", registry.latency),
+            ("journal_http_request_db_statements", "SQL statements per request by route.", registry.request_statements),
+            ("journal_http_request_db_seconds", "Time spent in SQL per request by route.", registry.request_db_seconds),
+        ):
+            header(name, help_text, "histogram")
+            for (method, route), histogram in sorted(series.items()):
+                out.extend(_histogram_lines(name, {"method": method, "route": route}, histogram))
+        header("journal_db_pool_checkout_seconds", "Time to obtain a connection from the pool.", "histogram")
+        out.extend(_histogram_lines("journal_db_pool_checkout_seconds", {}, registry.pool_wait))
+        for name, help_text, value in (
+            ("journal_db_statements_total", "SQL statements executed.", registry.statements),
+            ("journal_db_seconds_total", "Time spent executing SQL.", registry.db_seconds),
+            ("journal_db_slow_queries_total", "Statements slower than JOURNAL_SLOW_QUERY_MS.", registry.slow_queries),
+        ):
+            header(name, help_text, "counter")
+            out.append(f"{name} {value}")
+
+    for collector in _collectors:
+        for name, help_text, kind, samples in collector():
+            header(name, help_text, kind)
+            for labels, value in samples:
+                if kind == "histogram":  # значение — Histogram
+                    out.extend(_histogram_lines(name, labels, value))
+                elif kind == "summary":  # значение — Summary
+                    out.extend(_summary_lines(name, labels, value))
+                else:
+                    out.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(out) + "\n"
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return Response(content=render(), media_type=CONTENT_TYPE)
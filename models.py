@@ -1,84 +1,165 @@
-from pydantic import BaseModel, EmailStr, validator
-from typing import Optional
-from datetime import date
-
-
-class TeacherBase(BaseModel):
-    email: EmailStr
-    full_name: str
-
-    @validator('email')
-    def email_must_contain_at(cls, v):
-        if '@' not in v:
-            raise ValueError('Invalid email format')
-        return v.lower()
-
-
-class TeacherCreate(TeacherBase):
-    password: str
-
-
-class Teacher(TeacherBase):
-    id: int
-    is_active: bool
-
-    class Config:
-        orm_mode = True
-
-
-class StudentBase(BaseModel):
-    full_name: str
-    class_group: str
-
-
-class StudentCreate(StudentBase):
-    pass
-
-
-class Student(StudentBase):
-    id: int
-
-    class Config:
-        orm_mode = True
-
-
-class SubjectBase(BaseModel):
-    name: str
-
-
-class SubjectCreate(SubjectBase):
-    pass
-
-
-class Subject(SubjectBase):
-    id: int
-
-    class Config:
-        orm_mode = True
-
-
-class GradeBase(BaseModel):
-    student_id: int
-    subject_id: int
-    grade: int
-    date: date
-
-
-class GradeCreate(GradeBase):
-    pass
-
-
-class Grade(GradeBase):
-    id: int
-
-    class Config:
-        orm_mode = True
-
-
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-
-class TokenData(BaseModel):
-    email: Optional[str] = None
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
+from typing import List, Optional
+from datetime import date, datetime
+
+
+class TeacherBase(BaseModel):
+    email: EmailStr
+    full_name: str
+
+    @field_validator('email')
+    @classmethod
+    def email_must_contain_at(cls, v):
+        if '@' not in v:
+            raise ValueError('Invalid email format')
+        return v.lower()
+
+
+class TeacherCreate(TeacherBase):
+    password: str
+
+
+class Teacher(TeacherBase):
+    id: int
+    is_active: bool
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class StudentBase(BaseModel):
+    full_name: str
+    class_group: str
+
+
+class StudentCreate(StudentBase):
+    pass
+
+
+class Student(StudentBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class SubjectBase(BaseModel):
+    name: str
+
+
+class SubjectCreate(SubjectBase):
+    pass
+
+
+class Subject(SubjectBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class GradeBase(BaseModel):
+    student_id: int
+    subject_id: int
+    grade: int
+    date: date
+
+
+class GradeCreate(GradeBase):
+    pass
+
+
+class Grade(GradeBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class GradeBulkError(BaseModel):
+    index: int
+    detail: str
+
+
+class GradeBulkResult(BaseModel):
+    inserted: int
+    errors: List[GradeBulkError]
+
+
+class GradeChange(BaseModel):
+    seq: int
+    op: str  # create | update | delete
+    grade_id: int
+    class_group: Optional[str] = None
+    changed_at: datetime
+    grade: Grade  # после изменения; для delete — последнее состояние перед удалением
+
+
+class ImportRowError(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportReport(BaseModel):
+    rows: int = 0
+    chunks: int = 0
+    students_created: int = 0
+    subjects_created: int = 0
+    grades_inserted: int = 0
+    errors_count: int = 0
+    errors: List[ImportRowError] = []
+    seconds: float = 0.0
+    rows_per_sec: int = 0
+
+
+class ArchiveReport(BaseModel):
+    grades: int = 0
+    students: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+
+class TrendPoint(BaseModel):
+    start: date  # понедельник недели или первое число месяца
+    count: int
+    average: float
+
+
+class StudentTrend(BaseModel):
+    student_id: int
+    bucket: str
+    subject_id: Optional[int] = None
+    points: List[TrendPoint]
+
+
+class ClassStudentReport(BaseModel):
+    student_id: int
+    full_name: str
+    average: Optional[float] = None
+    grades_count: int
+    rank: Optional[int] = None
+    percentile: Optional[float] = None
+
+
+class SubjectDistribution(BaseModel):
+    subject_id: int
+    name: Optional[str] = None
+    histogram: List[int]  # количество оценок 1..5
+    count: int
+    average: float
+    median: float
+
+
+class ClassReport(BaseModel):
+    class_group: str
+    students_count: int
+    grades_count: int
+    class_mean: Optional[float] = None
+    class_median: Optional[float] = None
+    students: List[ClassStudentReport]
+    subjects: List[SubjectDistribution]
+
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+
+
+class TokenData(BaseModel):
+    email: Optional[str] = None
@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import date
+
+from fastapi import HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+
+
+def encode_cursor(*values) -> str:
+    # Непрозрачный токен: base64 от JSON-списка ключей сортировки последней строки
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, *types) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        return tuple(
+            date.fromisoformat(v) if t is date else t(v)
+            for t, v in zip(types, values)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_limit(request: Request, limit: int = Query(100, ge=1)) -> int:
+    # Верхняя граница — max_page_size приложения (app.state.config), поэтому не Query(le=...),
+    # который вычисляется при импорте модуля. Ошибка та же, что дала бы проверка le
+    max_page_size = request.app.state.config.max_page_size
+    if limit > max_page_size:
+        raise RequestValidationError([{
+            "type": "less_than_equal",
+            "loc": ("query", "limit"),
+            "msg": f"Input should be less than or equal to {max_page_size}",
+            "input": limit,
+            "ctx": {"le": max_page_size},
+        }])
+    return limit
@@ -0,0 +1,334 @@
+import threading
+import time
+from bisect import bisect_right
+from typing import Iterable, List, NamedTuple, Optional, Set
+from weakref import WeakKeyDictionary, WeakValueDictionary
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+import serialization
+import versions
+from settings import engine_settings
+
+STUDENTS = versions.STUDENTS
+SUBJECTS = versions.SUBJECTS
+ID_COLUMNS = {STUDENTS: database.Student.id, SUBJECTS: database.Subject.id}
+# Ограничение на число параметров в одном IN (SQLITE_MAX_VARIABLE_NUMBER в старых сборках — 999)
+IN_CHUNK_SIZE = 900
+
+
+def existing_ids(db: Session, column, ids: Iterable[int]) -> Set[int]:
+    ids = list(set(ids))
+    found = set()
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[i:i + IN_CHUNK_SIZE]
+        found.update(db.execute(select(column).where(column.in_(chunk))).scalars())
+    return found
+
+
+class IdSet:
+    # Множество id битовой картой: id из AUTOINCREMENT идут подряд, поэтому 100 000 учеников
+    # занимают 12.5 КБ вместо нескольких МБ у set из int
+    def __init__(self, ids: Iterable[int] = ()):
+        ids = list(ids)
+        bits = self._bits = bytearray((max(ids) >> 3) + 1 if ids else 0)
+        # Заполнение без вызова add на каждый id: при перечитывании таблицы их сотни тысяч
+        for item in ids:
+            bits[item >> 3] |= 1 << (item & 7)
+        self.size = len(set(ids))
+
+    def __contains__(self, item: int) -> bool:
+        return 0 <= item < len(self._bits) * 8 and bool(self._bits[item >> 3] & (1 << (item & 7)))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, item: int):
+        byte = item >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte + 1 - len(self._bits)))
+        if not self._bits[byte] & (1 << (item & 7)):
+            self._bits[byte] |= 1 << (item & 7)
+            self.size += 1
+
+    def discard(self, item: int):
+        if item in self:
+            self._bits[item >> 3] &= ~(1 << (item & 7)) & 0xFF
+            self.size -= 1
+
+
+class Subjects(NamedTuple):
+    # Вся таблица subjects: строки в порядке колонок serialization.SUBJECTS, по возрастанию id
+    version: int
+    updated_at: object
+    rows: list
+    ids: List[int]
+
+    def page(self, skip: int, limit: int, after_id: Optional[int]) -> list:
+        start = skip if after_id is None else bisect_right(self.ids, after_id)
+        return self.rows[start:start + limit]
+
+
+class ReferenceCache:
+    # Id учеников и предметов одной базы и вся таблица subjects.
+    # Свои изменения процесс вносит сразу (added/removed из crud), чужие — сверкой версий из table_versions
+    # не чаще раза в check_seconds: изменившаяся таблица перечитывается целиком.
+    # Id, которого нет в кеше, перепроверяется в БД и добавляется — ученик, созданный другим процессом,
+    # не получит 404; удалённый другим процессом считается существующим до следующей сверки
+    def __init__(self, check_seconds: float):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._checked = None  # time.monotonic() последней сверки
+        self._versions = {}  # таблица -> версия, с которой загружены её id
+        self._ids = {}  # таблица -> IdSet
+        self._subjects: Optional[Subjects] = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def refresh(self, db: Session):
+        checked = self._checked
+        if checked is not None and time.monotonic() - checked < self.check_seconds:
+            return
+        with self._lock:
+            if self._checked is not checked:
+                return  # другой поток уже сверил
+            # Версии читаются до данных: строки не старше версии, при гонке следующая сверка перечитает их ещё раз
+            current = dict(db.execute(
+                select(database.TableVersion.name, database.TableVersion.version)
+                .where(database.TableVersion.name.in_(ID_COLUMNS))
+            ).all())
+            for table in ID_COLUMNS:
+                version = current.get(table, 0)
+                if table not in self._ids or self._versions[table] != version:
+                    self._reload(db, table, version)
+            self._checked = time.monotonic()
+
+    def _reload(self, db: Session, table: str, version: int):
+        self.reloads += 1
+        if table == SUBJECTS:
+            self._subjects = self._load_subjects(db)
+            self._ids[table] = IdSet(self._subjects.ids)
+        else:
+            self._ids[table] = IdSet(self._all_ids(db, ID_COLUMNS[table]))
+        self._versions[table] = version
+
+    @staticmethod
+    def _all_ids(db: Session, column) -> List[int]:
+        # Сотни тысяч id читаются сырым курсором: обработка строк SQLAlchemy в несколько раз дороже самого SELECT
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(f"SELECT {column.name} FROM {column.table.name}")
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _load_subjects(db: Session) -> Subjects:
+        version, updated_at = versions.current(db, SUBJECTS)
+        rows = db.execute(select(*serialization.SUBJECTS.columns).order_by(database.Subject.id)).all()
+        return Subjects(version, updated_at, rows, [row.id for row in rows])
+
+    def existing(self, db: Session, table: str, ids: Iterable[int]) -> Set[int]:
+        self.refresh(db)
+        known = self._ids[table]
+        ids = set(ids)
+        found = {item for item in ids if item in known}
+        missing = ids - found
+        self.hits += len(found)
+        if missing:
+            self.misses += len(missing)
+            verified = existing_ids(db, ID_COLUMNS[table], missing)
+            self.added(table, verified)
+            found |= verified
+        return found
+
+    def subjects(self, db: Session) -> Subjects:
+        self.refresh(db)
+        subjects = self._subjects
+        if subjects is None:
+            # Строки сброшены своей записью в subjects: перечитываем только их, id уже актуальны
+            with self._lock:
+                if self._subjects is None:
+                    self._subjects = self._load_subjects(db)
+                subjects = self._subjects
+        return subjects
+
+    def added(self, table: str, ids: Iterable[int]):
+        with self._lock:
+            if table in self._ids:
+                for item in ids:
+                    self._ids[table].add(item)
+            if table == SUBJECTS:
+                self._subjects = None
+
+    def removed(self, table: str, ids: Iterable[int]):
+        with self._lock:
+            if table in self._ids:
+                for item in ids:
+                    self._ids[table].discard(item)
+            if table == SUBJECTS:
+                self._subjects = None
+
+    def changed(self, table: str):
+        # Изменились строки, но не набор id (переименование предмета)
+        if table == SUBJECTS:
+            with self._lock:
+                self._subjects = None
+
+    def stats(self) -> dict:
+        return {
+            "students": len(self._ids.get(STUDENTS, ())),
+            "subjects": len(self._ids.get(SUBJECTS, ())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
+
+
+def database_key(engine) -> Optional[str]:
+    # Одна база — один кеш: пулы записи и чтения (и async-движки) одного файла видят одни строки,
+    # и своя запись через пул записи должна сразу сбрасывать то, что отдаёт пул чтения.
+    # У каждого движка in-memory SQLite своя база — ключа нет
+    url = engine.url
+    if database.is_sqlite_memory(url):
+        return None
+    return url.set(drivername=url.get_backend_name(), query={}).render_as_string(hide_password=False)
+
+
+class ReferenceCaches:
+    # Кеш на каждую базу: у школ свои базы, у реплики чтения (другой URL) — свой снимок.
+    # Включён ли кеш и как часто сверять версии — из настроек, с которыми создан движок базы;
+    # enabled=False выключает его во всём процессе
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._caches = WeakKeyDictionary()  # Engine -> ReferenceCache
+        self._by_database = WeakValueDictionary()  # database_key -> ReferenceCache, живёт, пока жив хоть один движок
+
+    def get(self, db: Session) -> Optional[ReferenceCache]:
+        if not self.enabled:
+            return None
+        engine = db.get_bind()
+        cache = self._caches.get(engine)
+        if cache is None:
+            config = engine_settings(engine)
+            if not config.reference_cache:
+                return None
+            with self._lock:
+                cache = self._caches.get(engine)
+                if cache is None:
+                    key = database_key(engine)
+                    cache = self._by_database.get(key) if key is not None else None
+                    if cache is None:
+                        cache = ReferenceCache(config.reference_cache_check_ms / 1000)
+                        if key is not None:
+                            self._by_database[key] = cache
+                    self._caches[engine] = cache
+        return cache
+
+    def clear(self):
+        with self._lock:
+            self._caches.clear()
+            self._by_database.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            caches = list({id(cache): cache for cache in self._caches.values()}.values())
+        total = {"students": 0, "subjects": 0, "hits": 0, "misses": 0, "reloads": 0}
+        for cache in caches:
+            for key, value in cache.stats().items():
+                total[key] += value
+        return total
+
+
+reference_caches = ReferenceCaches()
+
+
+# Функции для crud: без кеша (JOURNAL_REFERENCE_CACHE=0) проверки идут в БД, как раньше
+def existing(db: Session, table: str, ids: Iterable[int]) -> Set[int]:
+    cache = reference_caches.get(db)
+    if cache is not None:
+        return cache.existing(db, table, ids)
+    return existing_ids(db, ID_COLUMNS[table], ids)
+
+
+def exists(db: Session, table: str, item: int) -> bool:
+    return item in existing(db, table, (item,))
+
+
+def subjects(db: Session) -> Optional[Subjects]:
+    cache = reference_caches.get(db)
+    return cache.subjects(db) if cache is not None else None
+
+
+def current(db: Session, table: str):
+    # Версия для ETag: для subjects — версия строк в кеше, которые и будут отданы
+    if table == SUBJECTS:
+        cached = subjects(db)
+        if cached is not None:
+            return cached.version, cached.updated_at
+    return versions.current(db, table)
+
+
+# Свои записи: added — после commit, removed — до commit (до него и при откате
+# id просто перепроверится в БД), changed — после commit
+def added(db: Session, table: str, ids: Iterable[int]):
+    cache = reference_caches.get(db)
+    if cache is not None:
+        cache.added(table, ids)
+
+
+def removed(db: Session, table: str, ids: Iterable[int]):
+    cache = reference_caches.get(db)
+    if cache is not None:
+        cache.removed(table, ids)
+
+
+def changed(db: Session, table: str):
+    cache = reference_caches.get(db)
+    if cache is not None:
+        cache.changed(table)
+
+
+def warm(db: Session):
+    cache = reference_caches.get(db)
+    if cache is not None:
+        cache.refresh(db)
+
+
+def _warm_session(session_factory):
+    with session_factory() as db:
+        warm(db)
+
+
+async def warm_database(journal_db: database.Database, async_mode: bool):
+    # При старте приложения: первые запросы не перечитывают таблицы сами
+    if async_mode:
+        for session_factory in (journal_db.AsyncSessionLocal, journal_db.AsyncReadSessionLocal):
+            async with session_factory() as db:
+                await db.run_sync(warm)
+    else:
+        for session_factory in (journal_db.SessionLocal, journal_db.ReadSessionLocal):
+            await run_in_threadpool(_warm_session, session_factory)
+
+
+def _collect_metrics() -> list:
+    cache = reference_caches.stats()
+    return [
+        ("journal_reference_cache_ids", "Student and subject ids held in the reference cache.", "gauge",
+         [({"table": table}, cache[table]) for table in (STUDENTS, SUBJECTS)]),
+        ("journal_reference_cache_hits_total", "Id checks answered from the reference cache.", "counter",
+         [({}, cache["hits"])]),
+        ("journal_reference_cache_misses_total", "Id checks that went to the database.", "counter",
+         [({}, cache["misses"])]),
+        ("journal_reference_cache_reloads_total", "Full reloads of a table after a version change.", "counter",
+         [({}, cache["reloads"])]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,400 @@
+import argparse
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+import database
+from settings import settings
+
+# (student_id, subject_id, grade, date)
+GradeKey = Tuple[int, int, int, Optional[date]]
+
+PAIRS_CHUNK_SIZE = 400
+
+TREND_BUCKETS = ("week", "month")
+
+
+def bucket_start(bucket: str, day: date) -> date:
+    # Неделя начинается с понедельника, месяц — с первого числа
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _load_rollups(db: Session, pairs: List[Tuple[int, int]]) -> dict:
+    # Отбор по student_id (префикс первичного ключа) — row-value IN (VALUES ...) SQLite выполняет сканом
+    wanted = set(pairs)
+    student_ids = sorted({student_id for student_id, _ in wanted})
+    rollups = {}
+    for i in range(0, len(student_ids), PAIRS_CHUNK_SIZE):
+        chunk = student_ids[i:i + PAIRS_CHUNK_SIZE]
+        rows = db.execute(
+            select(
+                database.GradeRollup.student_id,
+                database.GradeRollup.subject_id,
+                database.GradeRollup.count,
+                database.GradeRollup.sum,
+                database.GradeRollup.min,
+                database.GradeRollup.max,
+            ).where(database.GradeRollup.student_id.in_(chunk))
+        )
+        for student_id, subject_id, *values in rows:
+            if (student_id, subject_id) in wanted:
+                rollups[(student_id, subject_id)] = values
+    return rollups
+
+
+def _load_student_rollups(db: Session, student_ids: List[int]) -> dict:
+    rollups = {}
+    for i in range(0, len(student_ids), PAIRS_CHUNK_SIZE):
+        chunk = student_ids[i:i + PAIRS_CHUNK_SIZE]
+        rows = db.execute(
+            select(database.StudentRollup.student_id, database.StudentRollup.count, database.StudentRollup.sum)
+            .where(database.StudentRollup.student_id.in_(chunk))
+        )
+        for student_id, *values in rows:
+            rollups[student_id] = values
+    return rollups
+
+
+def _pair_aggregates_query():
+    return select(
+        database.Grade.student_id,
+        database.Grade.subject_id,
+        func.count(database.Grade.id),
+        func.sum(database.Grade.grade),
+        func.min(database.Grade.grade),
+        func.max(database.Grade.grade),
+    ).group_by(database.Grade.student_id, database.Grade.subject_id)
+
+
+def _recompute_min_max(db: Session, student_id: int, subject_id: int):
+    return db.execute(
+        select(func.min(database.Grade.grade), func.max(database.Grade.grade)).where(
+            database.Grade.student_id == student_id,
+            database.Grade.subject_id == subject_id,
+        )
+    ).one()
+
+
+def _write(db: Session, model, key_columns, inserts: list, updates: list, deletes: list):
+    # Пакетная запись: executemany для INSERT, UPDATE и DELETE по первичному ключу
+    if inserts:
+        db.execute(insert(model), inserts)
+    if updates:
+        db.execute(update(model), updates)
+    if deletes:
+        # ORM не поддерживает DELETE с executemany — выполняем на уровне Core в той же транзакции
+        db.connection().execute(
+            delete(model).where(*(column == bindparam(f"key_{column.key}") for column in key_columns)),
+            [{f"key_{column.key}": value for column, value in zip(key_columns, key)} for key in deletes],
+        )
+
+
+def _trend_key_columns(model):
+    return list(model.__table__.primary_key.columns)
+
+
+def _load_trends(db: Session, model, keys: list) -> dict:
+    # Как _load_rollups: отбор по префиксу первичного ключа student_id и по началам периодов
+    wanted = set(keys)
+    student_ids = sorted({key[0] for key in wanted})
+    starts = sorted({key[-1] for key in wanted})
+    trends = {}
+    for i in range(0, len(student_ids), PAIRS_CHUNK_SIZE):
+        chunk = student_ids[i:i + PAIRS_CHUNK_SIZE]
+        rows = db.execute(
+            select(*_trend_key_columns(model), model.count, model.sum)
+            .where(model.student_id.in_(chunk), model.start.in_(starts))
+        )
+        for *key, count, total in rows:
+            if tuple(key) in wanted:
+                trends[tuple(key)] = (count, total)
+    return trends
+
+
+def _merge_trends(db: Session, model, deltas: dict):
+    deltas = {key: d for key, d in deltas.items() if d[0] or d[1]}  # оценка не сменила период и значение
+    if not deltas:
+        return
+    key_columns = _trend_key_columns(model)
+    existing = _load_trends(db, model, list(deltas))
+    inserts, updates, deletes = [], [], []
+    for key, (count, total) in deltas.items():
+        current = existing.get(key)
+        old_count, old_sum = current or (0, 0)
+        if old_count + count <= 0:
+            if current:
+                deletes.append(key)
+            continue
+        row = {column.key: value for column, value in zip(key_columns, key)}
+        row.update(count=old_count + count, sum=old_sum + total)
+        (updates if current else inserts).append(row)
+    _write(db, model, key_columns, inserts, updates, deletes)
+
+
+def _trend_deltas(rows):
+    # rows: (student_id, subject_id, date, count, sum) -> приращения по (ученик, предмет) и по ученику
+    pairs, totals = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+    for student_id, subject_id, day, count, total in rows:
+        if day is None:
+            continue
+        for bucket in TREND_BUCKETS:
+            start = bucket_start(bucket, day)
+            for d in (pairs[(student_id, subject_id, bucket, start)], totals[(student_id, bucket, start)]):
+                d[0] += count
+                d[1] += total
+    return pairs, totals
+
+
+def _apply_trends(db: Session, added: List[GradeKey], removed: List[GradeKey]):
+    pairs, totals = _trend_deltas(
+        [(student_id, subject_id, day, 1, grade) for student_id, subject_id, grade, day in added]
+        + [(student_id, subject_id, day, -1, -grade) for student_id, subject_id, grade, day in removed]
+    )
+    _merge_trends(db, database.GradeTrendRollup, pairs)
+    _merge_trends(db, database.StudentTrendRollup, totals)
+
+
+def _trend_aggregates(db: Session, student_ids: List[int]):
+    # Оценки сворачиваются по дням в SQL, дни по периодам — в Python: одинаково на любой СУБД
+    return _trend_deltas(db.execute(
+        select(
+            database.Grade.student_id,
+            database.Grade.subject_id,
+            database.Grade.date,
+            func.count(database.Grade.id),
+            func.sum(database.Grade.grade),
+        )
+        .where(database.Grade.student_id.in_(student_ids))
+        .group_by(database.Grade.student_id, database.Grade.subject_id, database.Grade.date)
+    ))
+
+
+def _insert_trends(db: Session, pairs: dict, totals: dict):
+    for model, deltas in ((database.GradeTrendRollup, pairs), (database.StudentTrendRollup, totals)):
+        names = [column.key for column in _trend_key_columns(model)]
+        rows = [dict(zip(names, key), count=count, sum=total) for key, (count, total) in deltas.items()]
+        if rows:
+            # Core-вставка по таблице: без ORM-обработки каждой строки, заполнение идёт сотнями тысяч строк
+            db.execute(insert(model.__table__), rows)
+
+
+def rebuild_trends(db: Session, student_ids=None):
+    # Пересчёт периодов из grades пакетами по PAIRS_CHUNK_SIZE учеников; student_ids=None — все ученики.
+    # Без commit
+    if student_ids is None:
+        db.execute(delete(database.GradeTrendRollup))
+        db.execute(delete(database.StudentTrendRollup))
+        student_ids = db.execute(
+            select(database.Grade.student_id).distinct().order_by(database.Grade.student_id)
+        ).scalars().all()
+    else:
+        for model in (database.GradeTrendRollup, database.StudentTrendRollup):
+            db.execute(delete(model).where(model.student_id.in_(student_ids)))
+    for i in range(0, len(student_ids), PAIRS_CHUNK_SIZE):
+        _insert_trends(db, *_trend_aggregates(db, student_ids[i:i + PAIRS_CHUNK_SIZE]))
+
+
+@event.listens_for(database.Base.metadata, "after_create")
+def backfill(target, connection, **kw):
+    # Таблицы агрегатов и периодов появились позже grades: при обновлении базы заполняем пустые
+    # по уже выставленным оценкам. Без этого /students/{id}/stats не видит оценок ученика,
+    # а архивирование (список учеников из student_rollups) ничего не переносит
+    if not connection.execute(select(database.Grade.id).limit(1)).first():
+        return
+    has_rollups = all(
+        connection.execute(select(model.student_id).limit(1)).first()
+        for model in (database.GradeRollup, database.StudentRollup)
+    )
+    if not has_rollups:
+        _rebuild(connection)  # вместе с периодами
+    elif not connection.execute(select(database.StudentTrendRollup.student_id).limit(1)).first():
+        rebuild_trends(connection)
+
+
+def apply(db: Session, added: Iterable[GradeKey] = (), removed: Iterable[GradeKey] = ()):
+    # Вызывается в той же транзакции, что и изменение оценок, после flush
+    added, removed = list(added), list(removed)
+    _apply_trends(db, added, removed)
+    deltas = defaultdict(lambda: [0, 0, None, None])  # count, sum, min, max
+    for student_id, subject_id, grade, _ in added:
+        d = deltas[(student_id, subject_id)]
+        d[0] += 1
+        d[1] += grade
+        d[2] = grade if d[2] is None else min(d[2], grade)
+        d[3] = grade if d[3] is None else max(d[3], grade)
+    removed_values = defaultdict(list)
+    for student_id, subject_id, grade, _ in removed:
+        d = deltas[(student_id, subject_id)]
+        d[0] -= 1
+        d[1] -= grade
+        removed_values[(student_id, subject_id)].append(grade)
+    if not deltas:
+        return
+
+    existing = _load_rollups(db, list(deltas))
+    student_deltas = defaultdict(lambda: [0, 0])
+    inserts, updates, deletes = [], [], []
+    for pair, (count, total, low, high) in deltas.items():
+        student_deltas[pair[0]][0] += count
+        student_deltas[pair[0]][1] += total
+        current = existing.get(pair)
+        old_count, old_sum, old_min, old_max = current or (0, 0, None, None)
+        new_count, new_sum = old_count + count, old_sum + total
+        if new_count <= 0:
+            if current:
+                deletes.append(pair)
+            continue
+        # Удалённое значение могло быть минимумом/максимумом — такую пару пересчитываем из grades
+        if any(v in (old_min, old_max) for v in removed_values.get(pair, ())):
+            new_min, new_max = _recompute_min_max(db, *pair)
+        elif low is not None:
+            new_min = low if old_min is None else min(old_min, low)
+            new_max = high if old_max is None else max(old_max, high)
+        else:
+            new_min, new_max = old_min, old_max
+        row = {
+            "student_id": pair[0], "subject_id": pair[1],
+            "count": new_count, "sum": new_sum, "min": new_min, "max": new_max,
+        }
+        (updates if current else inserts).append(row)
+    _write(
+        db, database.GradeRollup,
+        (database.GradeRollup.student_id, database.GradeRollup.subject_id),
+        inserts, updates, deletes,
+    )
+
+    existing = _load_student_rollups(db, list(student_deltas))
+    inserts, updates, deletes = [], [], []
+    for student_id, (count, total) in student_deltas.items():
+        current = existing.get(student_id)
+        old_count, old_sum = current or (0, 0)
+        if old_count + count <= 0:
+            if current:
+                deletes.append((student_id,))
+            continue
+        row = {"student_id": student_id, "count": old_count + count, "sum": old_sum + total}
+        (updates if current else inserts).append(row)
+    _write(db, database.StudentRollup, (database.StudentRollup.student_id,), inserts, updates, deletes)
+
+
+def delete_student(db: Session, student_id: int):
+    delete_students(db, [student_id])
+
+
+def delete_students(db: Session, student_ids: List[int]):
+    db.execute(delete(database.GradeRollup).where(database.GradeRollup.student_id.in_(student_ids)))
+    db.execute(delete(database.StudentRollup).where(database.StudentRollup.student_id.in_(student_ids)))
+    for model in (database.GradeTrendRollup, database.StudentTrendRollup):
+        db.execute(delete(model).where(model.student_id.in_(student_ids)))
+
+
+def _rebuild(db: Session, student_ids=None):
+    # student_ids=None — все ученики
+    pairs = _pair_aggregates_query()
+    totals = select(
+        database.Grade.student_id, func.count(database.Grade.id), func.sum(database.Grade.grade)
+    ).group_by(database.Grade.student_id)
+    if student_ids is None:
+        db.execute(delete(database.GradeRollup))
+        db.execute(delete(database.StudentRollup))
+    else:
+        delete_students(db, student_ids)
+        pairs = pairs.where(database.Grade.student_id.in_(student_ids))
+        totals = totals.where(database.Grade.student_id.in_(student_ids))
+    db.execute(
+        insert(database.GradeRollup).from_select(["student_id", "subject_id", "count", "sum", "min", "max"], pairs)
+    )
+    db.execute(insert(database.StudentRollup).from_select(["student_id", "count", "sum"], totals))
+    if student_ids is None:
+        rebuild_trends(db)
+    else:
+        _insert_trends(db, *_trend_aggregates(db, student_ids))
+
+
+def rebuild(db: Session):
+    _rebuild(db)
+    db.commit()
+
+
+def rebuild_students(db: Session, student_ids: List[int]):
+    # Пересчёт агрегатов учеников после массового удаления их оценок (архивирование); без commit —
+    # выполняется в транзакции вызывающего
+    for i in range(0, len(student_ids), PAIRS_CHUNK_SIZE):
+        _rebuild(db, student_ids[i:i + PAIRS_CHUNK_SIZE])
+
+
+def verify(db: Session) -> List[str]:
+    # Сравнивает накопленные агрегаты с пересчитанными с нуля, возвращает описание расхождений
+    expected = {
+        (row[0], row[1]): tuple(row[2:]) for row in db.execute(_pair_aggregates_query())
+    }
+    stored = {
+        (r.student_id, r.subject_id): (r.count, r.sum, r.min, r.max)
+        for r in db.query(database.GradeRollup)
+    }
+    drift = []
+    for pair in sorted(expected.keys() | stored.keys()):
+        if expected.get(pair) != stored.get(pair):
+            drift.append(f"student {pair[0]} subject {pair[1]}: expected {expected.get(pair)}, stored {stored.get(pair)}")
+
+    expected_students = {
+        row[0]: (row[1], row[2]) for row in db.execute(
+            select(
+                database.Grade.student_id, func.count(database.Grade.id), func.sum(database.Grade.grade)
+            ).group_by(database.Grade.student_id)
+        )
+    }
+    stored_students = {r.student_id: (r.count, r.sum) for r in db.query(database.StudentRollup)}
+    for student_id in sorted(expected_students.keys() | stored_students.keys()):
+        if expected_students.get(student_id) != stored_students.get(student_id):
+            drift.append(
+                f"student {student_id} total: expected {expected_students.get(student_id)}, "
+                f"stored {stored_students.get(student_id)}"
+            )
+
+    student_ids = db.execute(select(database.Grade.student_id).distinct()).scalars().all()
+    expected_trends = defaultdict(dict)
+    for i in range(0, len(student_ids), PAIRS_CHUNK_SIZE):
+        pairs, totals = _trend_aggregates(db, student_ids[i:i + PAIRS_CHUNK_SIZE])
+        expected_trends[database.GradeTrendRollup].update(pairs)
+        expected_trends[database.StudentTrendRollup].update(totals)
+    for model in (database.GradeTrendRollup, database.StudentTrendRollup):
+        expected = {key: tuple(value) for key, value in expected_trends[model].items()}
+        stored = {
+            tuple(row[:-2]): tuple(row[-2:])
+            for row in db.execute(select(*_trend_key_columns(model), model.count, model.sum))
+        }
+        for key in sorted(expected.keys() | stored.keys()):
+            if expected.get(key) != stored.get(key):
+                drift.append(f"{model.__tablename__} {key}: expected {expected.get(key)}, stored {stored.get(key)}")
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify grade rollup tables")
+    # trends — заполнить только агрегаты по неделям и месяцам (после загрузки оценок в обход API)
+    parser.add_argument("command", choices=["verify", "rebuild", "trends"])
+    args = parser.parse_args()
+
+    journal_db = database.Database(settings)
+    journal_db.ensure_schema()
+    with journal_db.SessionLocal() as db:
+        if args.command == "rebuild":
+            rebuild(db)
+        elif args.command == "trends":
+            rebuild_trends(db)
+            db.commit()
+        drift = verify(db)
+    for line in drift:
+        print(line)
+    print(f"{len(drift)} rollup rows drifted")
+    raise SystemExit(1 if drift else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+from typing import List
+
+from sqlalchemy import or_, select, text
+from sqlalchemy.orm import Session
+
+import database
+
+# Триграммный индекс находит только подстроки от трёх символов
+MIN_TRIGRAM = 3
+# Верхняя граница диапазона для поиска по префиксу в индексе full_name
+PREFIX_END = "\U0010ffff"
+# bm25 считается для каждого совпадения (~1.5 мкс на строку): частая подстрока вроде "ivan" даёт
+# десятки тысяч совпадений, поэтому ранжируются только первые RANK_CANDIDATES из них
+RANK_CANDIDATES = 1000
+
+FTS_SEARCH = r"""
+SELECT students.id, students.full_name, students.class_group
+FROM (
+    SELECT rowid, rank FROM students_fts
+    WHERE students_fts MATCH :match {short}
+    LIMIT :candidates
+) AS hits JOIN students ON students.id = hits.rowid
+{exclude}
+ORDER BY students.full_name LIKE :prefix ESCAPE '\' DESC, hits.rank, students.id
+LIMIT :limit
+"""
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _match_expression(words: List[str]) -> str:
+    # Каждое слово — отдельная фраза FTS5 (кавычки удваиваются), слова соединяются через AND
+    return " AND ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _prefix_search(db: Session, q: str, limit: int):
+    # Набор по префиксу: диапазон по индексу full_name — как введено, с заглавной буквы и с заглавными
+    # во всех словах ("ivanov mar" -> "Ivanov Mar"), плюс точное совпадение класса
+    variants = {q, q[:1].upper() + q[1:], q.title()}
+    return db.execute(
+        select(database.Student.id, database.Student.full_name, database.Student.class_group)
+        .where(or_(
+            *((database.Student.full_name >= v) & (database.Student.full_name < v + PREFIX_END) for v in variants),
+            database.Student.class_group == q,
+        ))
+        .order_by(database.Student.full_name, database.Student.id)
+        .limit(limit)
+    ).all()
+
+
+def _fts_search(db: Session, words: List[str], limit: int, exclude: List[int]):
+    indexed = [word for word in words if len(word) >= MIN_TRIGRAM]
+    params = {
+        "match": _match_expression(indexed),
+        "prefix": _like_escape(words[0]) + "%",
+        "candidates": RANK_CANDIDATES,
+        "limit": limit,
+    }
+    # Слова короче трёх символов проверяются подстрокой среди совпадений индекса
+    short = []
+    for i, word in enumerate(w for w in words if len(w) < MIN_TRIGRAM):
+        params[f"short{i}"] = "%" + _like_escape(word) + "%"
+        short.append(f"AND (full_name LIKE :short{i} ESCAPE '\\' OR class_group LIKE :short{i} ESCAPE '\\')")
+    exclude_sql = ""
+    if exclude:
+        exclude_sql = f"WHERE students.id NOT IN ({', '.join(str(int(i)) for i in exclude)})"
+    sql = FTS_SEARCH.format(short=" ".join(short), exclude=exclude_sql)
+    return db.execute(text(sql), params).all()
+
+
+def search_students(db: Session, q: str, limit: int):
+    words = q.split()
+    if not words:
+        return []
+    q = " ".join(words)
+    if db.get_bind().dialect.name != "sqlite":
+        # Без FTS5: подстрока по full_name и class_group без индекса
+        conditions = [
+            or_(database.Student.full_name.ilike(f"%{w}%"), database.Student.class_group.ilike(f"%{w}%"))
+            for w in words
+        ]
+        return db.execute(
+            select(database.Student.id, database.Student.full_name, database.Student.class_group)
+            .where(*conditions).order_by(database.Student.full_name).limit(limit)
+        ).all()
+
+    # Сначала имена, начинающиеся с запроса (по индексу, дёшево), затем подстроки: начинающиеся с первого
+    # слова — выше, дальше по релевантности bm25
+    found = _prefix_search(db, q, limit)
+    if len(found) == limit or all(len(word) < MIN_TRIGRAM for word in words):
+        return found
+    return found + _fts_search(db, words, limit - len(found), [row.id for row in found])
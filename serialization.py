@@ -0,0 +1,140 @@
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import HTTPException, Response
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+
+import database
+import models
+import versions
+
+
+class RowSerializer:
+    # Быстрый путь для списков: из БД выбираются только колонки (без ORM-объектов и identity map),
+    # а JSON собирается готовым сериализатором pydantic-core без валидации response_model.
+    # Колонки идут в порядке полей модели ответа — JSON совпадает с обычным путём байт в байт
+    def __init__(self, model, entity):
+        self.names = list(model.model_fields)
+        self.columns = [getattr(entity, name) for name in self.names]
+        row_type = TypedDict(f"{model.__name__}Row", {
+            name: field.annotation for name, field in model.model_fields.items()
+        })
+        self.adapter = TypeAdapter(List[row_type])
+
+    def dump(self, rows) -> bytes:
+        names = self.names
+        return self.adapter.dump_json([dict(zip(names, row)) for row in rows])
+
+
+STUDENTS = RowSerializer(models.Student, database.Student)
+SUBJECTS = RowSerializer(models.Subject, database.Subject)
+GRADES = RowSerializer(models.Grade, database.Grade)
+
+
+# ========== fields= и include= для оценок ==========
+# include=student,subject встраивает ученика и предмет в каждую оценку — клиенту не нужны
+# GET /students/{id} и GET /subjects/{id} на строку. fields= оставляет только перечисленные поля:
+# "grade,date" — поля оценки, "student.full_name" — поля встроенного объекта (и подключает его).
+# Если полей оценки в fields нет, отдаются все; у встроенного объекта без своих полей — тоже все
+INCLUDES = {
+    "student": (models.Student, database.Student, database.Grade.student_id, versions.STUDENTS),
+    "subject": (models.Subject, database.Subject, database.Grade.subject_id, versions.SUBJECTS),
+}
+
+
+class GradeFieldset:
+    # Набор колонок для одного select с LEFT JOIN и сериализатор под него. Тип ответа (TypedDict)
+    # строится один раз на сочетание полей: экземпляры кешируются в grade_fieldset
+    def __init__(self, fields: tuple, includes: tuple):
+        self.fields = fields
+        self.includes = includes  # ((имя, поля), ...)
+        # Таблицы, из которых собран ответ: ETag меняется при записи в любую из них
+        self.tables = (versions.GRADES, *(INCLUDES[include][3] for include, _ in includes))
+        # id и date выбираются всегда: по ним строится курсор, в ответ попадают, только если запрошены
+        self.columns = [database.Grade.id.label("id"), database.Grade.date.label("date")]
+        self.columns += [getattr(database.Grade, name).label(name) for name in fields if name not in ("id", "date")]
+        positions = {column.name: i for i, column in enumerate(self.columns)}
+        self._plan = [(name, positions[name]) for name in fields]
+        self.joins = []
+        self._embeds = []  # (имя, позиция id для проверки LEFT JOIN, [(поле, позиция)])
+        row_fields = {name: models.Grade.model_fields[name].annotation for name in fields}
+        for include, include_fields in includes:
+            model, entity, foreign_key, _ = INCLUDES[include]
+            self.joins.append((entity, entity.id == foreign_key))
+            id_position = len(self.columns)
+            self.columns.append(entity.id.label(f"{include}__id"))
+            plan = []
+            for name in include_fields:
+                if name != "id":
+                    self.columns.append(getattr(entity, name).label(f"{include}__{name}"))
+                plan.append((name, id_position if name == "id" else len(self.columns) - 1))
+            self._embeds.append((include, id_position, plan))
+            embed_type = TypedDict(f"{model.__name__}Embed", {
+                name: model.model_fields[name].annotation for name in include_fields
+            })
+            row_fields[include] = Optional[embed_type]  # None, если ученик уже в архиве
+        row_type = TypedDict("GradeFieldsRow", row_fields)
+        self.adapter = TypeAdapter(List[row_type])
+        self.one_adapter = TypeAdapter(row_type)
+
+    def query(self, db):
+        query = db.query(*self.columns).select_from(database.Grade)
+        for entity, onclause in self.joins:
+            query = query.outerjoin(entity, onclause)
+        return query
+
+    def _item(self, row) -> dict:
+        item = {name: row[i] for name, i in self._plan}
+        for include, id_position, plan in self._embeds:
+            item[include] = {name: row[i] for name, i in plan} if row[id_position] is not None else None
+        return item
+
+    def dump(self, rows) -> bytes:
+        return self.adapter.dump_json([self._item(row) for row in rows])
+
+    def dump_one(self, row) -> bytes:
+        return self.one_adapter.dump_json(self._item(row))
+
+
+@lru_cache(maxsize=256)
+def _grade_fieldset(fields: tuple, includes: tuple) -> GradeFieldset:
+    return GradeFieldset(fields, includes)
+
+
+def grade_fieldset(fields: Optional[str], include: Optional[str]) -> Optional[GradeFieldset]:
+    # None — параметры не заданы, ответ обычный (response_model)
+    names = [name.strip() for name in (fields or "").split(",") if name.strip()]
+    includes = {name.strip() for name in (include or "").split(",") if name.strip()}
+    if not names and not includes:
+        return None
+    grade_fields, include_fields = [], {}
+    for name in names:
+        include, _, field = name.rpartition(".")
+        if not include:
+            grade_fields.append(field)
+            continue
+        includes.add(include)
+        include_fields.setdefault(include, []).append(field)
+    unknown = sorted(includes - INCLUDES.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(unknown)}")
+    # Поля в порядке модели: одно сочетание — один ключ кеша независимо от порядка в запросе
+    selected = {"": _select_fields(models.Grade, grade_fields, "")}
+    for include in includes:
+        selected[include] = _select_fields(INCLUDES[include][0], include_fields.get(include, []), f"{include}.")
+    return _grade_fieldset(selected[""], tuple((include, selected[include]) for include in sorted(includes)))
+
+
+def _select_fields(model, names, prefix: str) -> tuple:
+    unknown = sorted(set(names) - model.model_fields.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field: {', '.join(prefix + name for name in unknown)}")
+    return tuple(name for name in model.model_fields if not names or name in names)
+
+
+def render(items, response: Response):
+    # bytes — уже сериализованный список быстрого пути; заголовки из response переносим в ответ
+    if isinstance(items, bytes):
+        return Response(content=items, media_type="application/json", headers=dict(response.headers))
+    return items
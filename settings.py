@@ -0,0 +1,150 @@
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+
+def parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def from_env(name: str, default, cast=str):
+    # Значение читается из переменной окружения JOURNAL_* при создании Settings
+    def factory():
+        value = os.getenv(name)
+        if value is None:
+            return default
+        return cast(value)
+    return field(default_factory=factory)
+
+
+def to_async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    return url
+
+
+@dataclass
+class Settings:
+    database_url: str = from_env("JOURNAL_DATABASE_URL", "sqlite:///./journal.db")
+    # Реплика или отдельный URL для чтения (для серверных БД); для SQLite — тот же файл
+    read_database_url: Optional[str] = from_env("JOURNAL_READ_DATABASE_URL", None)
+    # Отдельная база на каждую школу: шаблон URL с {tenant}, например sqlite:///./schools/{tenant}.db.
+    # Школа берётся из токена преподавателя или заголовка tenant_header; пусто — одна общая database_url
+    tenant_database_url: Optional[str] = from_env("JOURNAL_TENANT_DATABASE_URL", None)
+    tenant_header: str = from_env("JOURNAL_TENANT_HEADER", "X-School")
+    # Сколько баз школ держать открытыми в процессе (LRU) и через сколько секунд простоя закрывать движки
+    tenant_cache_size: int = from_env("JOURNAL_TENANT_CACHE_SIZE", 64, int)
+    tenant_idle_seconds: float = from_env("JOURNAL_TENANT_IDLE_SECONDS", 600.0, float)
+    # Школы по узлам: имена узлов через запятую и имя этого узла. Чужая школа — 421 с именем владельца
+    tenant_nodes: str = from_env("JOURNAL_TENANT_NODES", "")
+    node_name: str = from_env("JOURNAL_NODE_NAME", "")
+    # Асинхронный режим: AsyncSession + aiosqlite вместо синхронной сессии в пуле потоков
+    async_mode: bool = from_env("JOURNAL_ASYNC", False, parse_bool)
+
+    # Верхняя граница limit в списочных эндпоинтах; для полной выгрузки есть /grades/export
+    max_page_size: int = from_env("JOURNAL_MAX_PAGE_SIZE", 1000, int)
+    # Списки без ORM-объектов: выборка колонок и сериализация сразу в JSON-байты
+    fast_lists: bool = from_env("JOURNAL_FAST_LISTS", False, parse_bool)
+
+    # Размер пакета (строк CSV) на одну транзакцию при импорте
+    import_chunk_size: int = from_env("JOURNAL_IMPORT_CHUNK_SIZE", 5000, int)
+    # Сколько оценок переносится в архив за одну транзакцию
+    archive_chunk_size: int = from_env("JOURNAL_ARCHIVE_CHUNK_SIZE", 5000, int)
+
+    # Group commit для POST /grades/: оценки копятся в очереди и записываются одной транзакцией
+    # по group_commit_batch_size штук или через group_commit_interval_ms после первой в пакете.
+    # Ответ отправляется после commit своего пакета. Пишет синхронный движок: в режиме JOURNAL_ASYNC
+    # с in-memory базой включать нельзя (у async-движка другая база)
+    group_commit: bool = from_env("JOURNAL_GROUP_COMMIT", False, parse_bool)
+    group_commit_batch_size: int = from_env("JOURNAL_GROUP_COMMIT_BATCH_SIZE", 100, int)
+    group_commit_interval_ms: float = from_env("JOURNAL_GROUP_COMMIT_INTERVAL_MS", 2.0, float)
+    group_commit_max_pending: int = from_env("JOURNAL_GROUP_COMMIT_MAX_PENDING", 10000, int)
+
+    # Пулы соединений
+    pool_size: int = from_env("JOURNAL_POOL_SIZE", 10, int)
+    max_overflow: int = from_env("JOURNAL_MAX_OVERFLOW", 20, int)
+    pool_timeout: float = from_env("JOURNAL_POOL_TIMEOUT", 30.0, float)
+    read_pool_size: int = from_env("JOURNAL_READ_POOL_SIZE", 20, int)
+    read_max_overflow: int = from_env("JOURNAL_READ_MAX_OVERFLOW", 20, int)
+
+    # PRAGMA для SQLite
+    sqlite_wal: bool = from_env("JOURNAL_SQLITE_WAL", True, parse_bool)
+    sqlite_synchronous: str = from_env("JOURNAL_SQLITE_SYNCHRONOUS", "NORMAL")
+    sqlite_busy_timeout_ms: int = from_env("JOURNAL_SQLITE_BUSY_TIMEOUT_MS", 5000, int)
+    sqlite_cache_size: int = from_env("JOURNAL_SQLITE_CACHE_SIZE", -20000, int)  # < 0 — в КиБ
+    sqlite_mmap_size: int = from_env("JOURNAL_SQLITE_MMAP_SIZE", 256 * 1024 * 1024, int)
+
+    # Кеш токен -> преподаватель для get_current_teacher
+    token_cache_enabled: bool = from_env("JOURNAL_TOKEN_CACHE", True, parse_bool)
+    token_cache_size: int = from_env("JOURNAL_TOKEN_CACHE_SIZE", 4096, int)
+    token_cache_ttl: float = from_env("JOURNAL_TOKEN_CACHE_TTL", 300.0, float)
+
+    # Кеш id учеников и предметов и всей таблицы subjects (refcache.py). Изменения из других процессов
+    # подхватываются сверкой версий таблиц не реже раза в reference_cache_check_ms: до неё удалённый
+    # другим процессом ученик ещё считается существующим. 0 — сверка на каждой проверке (один запрос вместо двух)
+    reference_cache: bool = from_env("JOURNAL_REFERENCE_CACHE", True, parse_bool)
+    reference_cache_check_ms: float = from_env("JOURNAL_REFERENCE_CACHE_CHECK_MS", 1000.0, float)
+
+    # Лента изменений оценок (changes.py): GET /grades/changes и SSE-поток /grades/changes/stream.
+    # Процесс опрашивает grade_changes раз в changes_poll_ms на базу, сколько бы ни было подписчиков;
+    # подписчик, отставший на changes_queue_size событий, догоняет ленту чтением из БД
+    changes_poll_ms: float = from_env("JOURNAL_CHANGES_POLL_MS", 500.0, float)
+    changes_queue_size: int = from_env("JOURNAL_CHANGES_QUEUE_SIZE", 1000, int)
+    changes_heartbeat_seconds: float = from_env("JOURNAL_CHANGES_HEARTBEAT_SECONDS", 15.0, float)
+    # Сколько дней хранить журнал (python -m changes prune)
+    changes_retention_days: int = from_env("JOURNAL_CHANGES_RETENTION_DAYS", 30, int)
+
+    # Отдельный пул для bcrypt в /register/ и /token
+    hash_workers: int = from_env("JOURNAL_HASH_WORKERS", min(4, os.cpu_count() or 1), int)
+    hash_max_pending: int = from_env("JOURNAL_HASH_MAX_PENDING", 32, int)
+    hash_retry_after: int = from_env("JOURNAL_HASH_RETRY_AFTER", 1, int)
+    bcrypt_rounds: int = from_env("JOURNAL_BCRYPT_ROUNDS", 12, int)
+
+    # Admission control (admission.py): ограничение одновременных запросов с очередью и отказом 503/429.
+    # admission_capacity — на всё приложение (по умолчанию как пул потоков anyio для sync-эндпоинтов)
+    admission_control: bool = from_env("JOURNAL_ADMISSION", False, parse_bool)
+    admission_capacity: int = from_env("JOURNAL_ADMISSION_CAPACITY", 40, int)
+    admission_queue: int = from_env("JOURNAL_ADMISSION_QUEUE", 200, int)
+    admission_wait_ms: float = from_env("JOURNAL_ADMISSION_WAIT_MS", 1000.0, float)
+    # Лимиты дорогих маршрутов: "МЕТОД шаблон=одновременно:очередь:ожидание_мс" через запятую
+    admission_routes: str = from_env(
+        "JOURNAL_ADMISSION_ROUTES",
+        "POST /token=2:32:2000,POST /register/=2:16:2000,GET /grades/=4:32:1000,"
+        "GET /grades/export=2:2:0,GET /students/export=2:2:0",
+    )
+    # Классы приоритета: при нехватке мест первыми проходят high, затем прочие, последними low.
+    # Маршруты low (аналитика) вместе занимают не больше admission_low_capacity мест — по ядру на запрос
+    admission_high: str = from_env(
+        "JOURNAL_ADMISSION_HIGH", "POST /grades/,POST /grades/bulk,PUT /grades/{grade_id},GET /teachers/me/"
+    )
+    admission_low: str = from_env(
+        "JOURNAL_ADMISSION_LOW",
+        "GET /students/{student_id}/stats,GET /students/{student_id}/trend,GET /classes/{class_group}/report,"
+        "GET /grades/export,GET /students/export",
+    )
+    admission_low_capacity: int = from_env("JOURNAL_ADMISSION_LOW_CAPACITY", os.cpu_count() or 1, int)
+
+    # Запросы дольше порога пишутся в лог journal.slow_query вместе с EXPLAIN QUERY PLAN; 0 — выключено
+    slow_query_ms: float = from_env("JOURNAL_SLOW_QUERY_MS", 0.0, float)
+
+    @property
+    def async_database_url(self) -> str:
+        return to_async_url(self.database_url)
+
+
+# Настройки по умолчанию — для CLI и модулей вне приложения. Приложение (main.create_app) работает
+# со своими Settings: они лежат в app.state.config, а у движков его баз — в engine_settings
+settings = Settings()
+
+# Engine -> Settings, с которыми он создан: слушатели событий движка (медленные запросы) и кеш id
+# берут настройки своей базы, а не глобальные
+_engine_settings = WeakKeyDictionary()
+
+
+def bind_engine(engine, config: Settings):
+    _engine_settings[engine] = config
+
+
+def engine_settings(engine) -> Settings:
+    return _engine_settings.get(engine, settings)
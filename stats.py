@@ -0,0 +1,229 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from statistics import fmean, median
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import database
+
+
+def subject_aggregates_query(
+        student_id: int,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        grades=database.Grade.__table__
+):
+    # Один сгруппированный запрос с JOIN вместо отдельного SELECT на каждую оценку.
+    # grades — таблица grades или рабочие оценки вместе с архивом (archive.grades_source)
+    query = (
+        select(
+            database.Subject.name,
+            func.count(grades.c.id),
+            func.sum(grades.c.grade),
+            func.min(grades.c.grade),
+            func.max(grades.c.grade),
+        )
+        .join(database.Subject, database.Subject.id == grades.c.subject_id)
+        .where(grades.c.student_id == student_id)
+        .group_by(database.Subject.id, database.Subject.name)
+    )
+    if start_date:
+        query = query.where(grades.c.date >= start_date)
+    if end_date:
+        query = query.where(grades.c.date <= end_date)
+    return query
+
+
+def subject_rollups_query(student_id: int):
+    # Готовые агрегаты из grade_rollups: O(предметов) вместо O(оценок)
+    return (
+        select(
+            database.Subject.name,
+            database.GradeRollup.count,
+            database.GradeRollup.sum,
+            database.GradeRollup.min,
+            database.GradeRollup.max,
+        )
+        .join(database.Subject, database.Subject.id == database.GradeRollup.subject_id)
+        .where(database.GradeRollup.student_id == student_id)
+        .where(database.GradeRollup.count > 0)
+    )
+
+
+def build_stats(student: database.Student, rows) -> dict:
+    # rows: (subject_name, count, sum, min, max) — по одной строке на предмет
+    subjects_stats = {}
+    total_count = 0
+    total_sum = 0
+    min_grade = None
+    max_grade = None
+    for name, count, total, low, high in rows:
+        subjects_stats[name] = {
+            "count": count,
+            "sum": total,
+            "average": total / count,
+            "min": low,
+            "max": high,
+        }
+        total_count += count
+        total_sum += total
+        min_grade = low if min_grade is None else min(min_grade, low)
+        max_grade = high if max_grade is None else max(max_grade, high)
+
+    if not total_count:
+        return {"message": "No grades found for this student"}
+
+    return {
+        "student_id": student.id,
+        "full_name": student.full_name,
+        "class_group": student.class_group,
+        "average_grade": round(total_sum / total_count, 2),
+        "grades_count": total_count,
+        "min_grade": min_grade,
+        "max_grade": max_grade,
+        "subjects": {name: s["average"] for name, s in subjects_stats.items()},
+        "subjects_stats": subjects_stats,
+    }
+
+
+def student_stats(
+        db: Session,
+        student: database.Student,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        grades=database.Grade.__table__
+) -> dict:
+    # Накопительные агрегаты есть только для рабочей таблицы grades
+    if start_date or end_date or grades is not database.Grade.__table__:
+        query = subject_aggregates_query(student.id, start_date, end_date, grades)
+    else:
+        query = subject_rollups_query(student.id)
+    rows = db.execute(query).all()
+    return build_stats(student, rows)
+
+
+def class_grades_query(
+        student_ids,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        grades=database.Grade.__table__
+):
+    # Оценки класса одним запросом в колоночном виде: (student_id, subject_id, grade, count).
+    # Группировка в БД: в Python приходит не больше students * subjects * 5 строк.
+    # Отбор по id учеников, а не JOIN с students: условие переносится и в ветви UNION ALL с архивом.
+    # API принимает только 1-5, но в таблице нет CHECK: строки вне шкалы, записанные в обход API,
+    # не попадают ни в средние и ранги, ни в гистограммы (6 уронила бы отчёт IndexError)
+    query = (
+        select(grades.c.student_id, grades.c.subject_id, grades.c.grade, func.count())
+        .where(grades.c.student_id.in_(student_ids), grades.c.grade.between(1, 5))
+        .group_by(grades.c.student_id, grades.c.subject_id, grades.c.grade)
+    )
+    if start_date:
+        query = query.where(grades.c.date >= start_date)
+    if end_date:
+        query = query.where(grades.c.date <= end_date)
+    return query
+
+
+def _grade_at(histogram, position: int) -> int:
+    seen = 0
+    for grade, count in enumerate(histogram, start=1):
+        seen += count
+        if position < seen:
+            return grade
+
+
+def histogram_median(histogram) -> Optional[float]:
+    # Медиана по гистограмме оценок 1-5 без разворачивания в список значений
+    total = sum(histogram)
+    if not total:
+        return None
+    return (_grade_at(histogram, (total - 1) // 2) + _grade_at(histogram, total // 2)) / 2
+
+
+def class_report(
+        db: Session,
+        class_group: str,
+        students,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        grades=database.Grade.__table__
+) -> dict:
+    # students: [(id, full_name)] учеников класса. Счётчики хранятся в компактных массивах array('q'),
+    # индексируемых позицией ученика/предмета, — без словаря объектов на каждую оценку
+    positions = {student_id: i for i, (student_id, _) in enumerate(students)}
+    counts = array("q", bytes(8 * len(students)))
+    sums = array("q", bytes(8 * len(students)))
+    histograms = {}
+    query = class_grades_query(list(positions), start_date, end_date, grades)
+    for student_id, subject_id, grade, count in db.execute(query):
+        i = positions[student_id]
+        counts[i] += count
+        sums[i] += grade * count
+        if subject_id not in histograms:
+            histograms[subject_id] = array("q", bytes(8 * 5))
+        histograms[subject_id][grade - 1] += count
+
+    averages = [total / count if count else None for total, count in zip(sums, counts)]
+    # Ранг и перцентиль — одной сортировкой: ранг "1224" по убыванию среднего,
+    # перцентиль — доля одноклассников со средним строго ниже
+    ranked = sorted(a for a in averages if a is not None)
+    graded = len(ranked)
+    report_students = []
+    for (student_id, full_name), average, count in zip(students, averages, counts):
+        rank = percentile = None
+        if average is not None:
+            below = bisect_left(ranked, average)
+            rank = graded - bisect_right(ranked, average) + 1
+            percentile = round(100 * below / (graded - 1), 1) if graded > 1 else 100.0
+        report_students.append({
+            "student_id": student_id,
+            "full_name": full_name,
+            "average": round(average, 2) if average is not None else None,
+            "grades_count": count,
+            "rank": rank,
+            "percentile": percentile,
+        })
+    report_students.sort(key=lambda s: (s["rank"] is None, s["rank"] or 0, s["student_id"]))
+
+    names = dict(db.execute(
+        select(database.Subject.id, database.Subject.name).where(database.Subject.id.in_(list(histograms)))
+    ).all()) if histograms else {}
+    subjects = []
+    for subject_id, histogram in sorted(histograms.items()):
+        total = sum(histogram)
+        subjects.append({
+            "subject_id": subject_id,
+            "name": names.get(subject_id),
+            "histogram": histogram.tolist(),
+            "count": total,
+            "average": round(sum(g * c for g, c in enumerate(histogram, start=1)) / total, 2),
+            "median": histogram_median(histogram),
+        })
+
+    return {
+        "class_group": class_group,
+        "students_count": len(students),
+        "grades_count": sum(counts),
+        "class_mean": round(fmean(ranked), 2) if ranked else None,
+        "class_median": round(median(ranked), 2) if ranked else None,
+        "students": report_students,
+        "subjects": subjects,
+    }
+
+
+def student_trend(db: Session, student_id: int, bucket: str, subject_id: Optional[int] = None) -> List[dict]:
+    # Точки графика из grade_trend_rollups / student_trend_rollups: O(периодов) вместо O(оценок)
+    if subject_id is None:
+        model, conditions = database.StudentTrendRollup, []
+    else:
+        model, conditions = database.GradeTrendRollup, [database.GradeTrendRollup.subject_id == subject_id]
+    rows = db.execute(
+        select(model.start, model.count, model.sum)
+        .where(model.student_id == student_id, model.bucket == bucket, *conditions)
+        .order_by(model.start)
+    )
+    return [{"start": start, "count": count, "average": round(total / count, 2)} for start, count, total in rows]
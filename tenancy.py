@@ -0,0 +1,203 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import replace
+from typing import List, Optional
+
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from jose import JWTError, jwt
+from sqlalchemy.engine import make_url
+
+import auth
+from database import Database
+from settings import Settings
+
+# Идентификатор школы подставляется в путь к файлу БД — только безопасные символы
+TENANT_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Claim токена со школой преподавателя
+TENANT_CLAIM = "school"
+
+
+def tenant_node(tenant: str, nodes: List[str]) -> str:
+    # Rendezvous hashing: у каждой школы ровно один узел-владелец, при добавлении узла переезжает ~1/N школ.
+    # Та же функция годится для балансировщика перед узлами
+    return max(nodes, key=lambda node: hashlib.sha1(f"{node}/{tenant}".encode()).digest())
+
+
+def current_tenant(request: Request) -> Optional[str]:
+    # Школа, определённая зависимостью get_db для этого запроса; None в режиме одной базы
+    return getattr(request.state, "tenant", None)
+
+
+def token_tenant(request: Request) -> Optional[str]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        return None  # недействительный токен отклонит get_current_teacher
+    tenant = payload.get(TENANT_CLAIM)
+    if tenant is None:
+        # Токен без школы нельзя привязать к базе: кеш токенов выдал бы преподавателя другой школы
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token is not bound to a school",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return tenant
+
+
+class _Tenant:
+    __slots__ = ("database", "leases", "last_used", "schema_ready", "lock")
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.leases = 0  # запросы, которые сейчас держат сессию этой базы
+        self.last_used = time.monotonic()
+        self.schema_ready = False
+        self.lock = threading.Lock()
+
+
+class TenantDatabases:
+    # База на каждую школу: запись одной школы не блокирует остальные (у SQLite одна блокировка записи на файл).
+    # Движки открываются при первом запросе школы и живут в LRU: сверх tenant_cache_size или после
+    # tenant_idle_seconds простоя движок закрывается, но только если его сессии никто не держит.
+    # Процессы одного узла могут обслуживать любую школу (SQLite сам разделяет файл между процессами),
+    # между узлами школы делятся через tenant_node
+    def __init__(self, config: Settings):
+        self.config = config
+        self.capacity = config.tenant_cache_size
+        self.idle_seconds = config.tenant_idle_seconds
+        self.nodes = [node.strip() for node in config.tenant_nodes.split(",") if node.strip()]
+        self.opened = 0
+        self.evicted = 0
+        self._tenants = OrderedDict()  # tenant -> _Tenant, от давно использованных к недавним
+        self._lock = threading.Lock()
+
+    def settings_for(self, tenant: str) -> Settings:
+        return replace(
+            self.config,
+            database_url=self.config.tenant_database_url.format(tenant=tenant),
+            read_database_url=None,
+            tenant_database_url=None,
+        )
+
+    def tenant(self, request: Request) -> str:
+        tenant = current_tenant(request)
+        if tenant is not None:
+            return tenant
+        header = request.headers.get(self.config.tenant_header)
+        claimed = token_tenant(request)
+        if claimed and header and header != claimed:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token was issued for another school")
+        tenant = claimed or header
+        if not tenant:
+            raise HTTPException(status_code=400, detail=f"{self.config.tenant_header} header is required")
+        if not TENANT_RE.match(tenant):
+            raise HTTPException(status_code=400, detail="Invalid school id")
+        if self.nodes:
+            owner = tenant_node(tenant, self.nodes)
+            if owner != self.config.node_name:
+                raise HTTPException(
+                    status_code=status.HTTP_421_MISDIRECTED_REQUEST,
+                    detail=f"School {tenant} is served by node {owner}",
+                    headers={"X-School-Node": owner},
+                )
+        request.state.tenant = tenant
+        return tenant
+
+    def acquire(self, tenant: str):
+        # Возвращает (запись школы, вытесненные базы — их закрывает вызывающий вне блокировки)
+        with self._lock:
+            entry = self._tenants.get(tenant)
+            if entry is None:
+                entry = self._tenants[tenant] = _Tenant(self._open(tenant))
+                self.opened += 1
+            else:
+                self._tenants.move_to_end(tenant)
+            entry.leases += 1
+            entry.last_used = time.monotonic()
+            return entry, self._evict()
+
+    def release(self, entry: _Tenant):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+
+    def _open(self, tenant: str) -> Database:
+        config = self.settings_for(tenant)
+        url = make_url(config.database_url)
+        if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+        return Database(config)
+
+    def _evict(self) -> List[Database]:
+        now = time.monotonic()
+        excess = len(self._tenants) - self.capacity
+        victims = []
+        for tenant, entry in self._tenants.items():
+            if excess <= len(victims) and now - entry.last_used <= self.idle_seconds:
+                break
+            if not entry.leases:
+                victims.append(tenant)
+        self.evicted += len(victims)
+        return [self._tenants.pop(tenant).database for tenant in victims]
+
+    def _prepare(self, entry: _Tenant):
+        # Схема проверяется один раз на процесс при первом обращении к школе
+        if entry.schema_ready:
+            return
+        with entry.lock:
+            if not entry.schema_ready:
+                entry.database.ensure_schema()
+                entry.schema_ready = True
+
+    @contextmanager
+    def lease(self, request: Request):
+        entry, evicted = self.acquire(self.tenant(request))
+        try:
+            for database in evicted:
+                database.close()
+            self._prepare(entry)
+            yield entry.database
+        finally:
+            self.release(entry)
+
+    @asynccontextmanager
+    async def lease_async(self, request: Request):
+        entry, evicted = self.acquire(self.tenant(request))
+        try:
+            for database in evicted:
+                await database.dispose()
+            if not entry.schema_ready:
+                await run_in_threadpool(self._prepare, entry)
+            yield entry.database
+        finally:
+            self.release(entry)
+
+    def stats(self) -> dict:
+        return {"open": len(self._tenants), "opened": self.opened, "evicted": self.evicted}
+
+    # Интерфейс lifespan такой же, как у Database: схемы школ проверяются при первом обращении
+    def ensure_schema(self) -> bool:
+        return False
+
+    async def ensure_schema_async(self) -> bool:
+        return False
+
+    def databases(self) -> List[Database]:
+        with self._lock:
+            return [entry.database for entry in self._tenants.values()]
+
+    async def dispose(self):
+        with self._lock:
+            databases = [entry.database for entry in self._tenants.values()]
+            self._tenants.clear()
+        for database in databases:
+            await database.dispose()
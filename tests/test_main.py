@@ -1,161 +1,1203 @@
-import sys
-from pathlib import Path
-import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from datetime import date
-
-# Добавляем корень проекта в PYTHOPATH
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
-from main import app
-import database
-from database import Base
-
-# Настройка тестовой базы данных
-TEST_DB_URL = "sqlite:///./test.db"
-engine = create_engine(TEST_DB_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-# Фикстура для БД (выполняется для каждой функции)
-@pytest.fixture(scope="function")
-def db():
-    # Создаем все таблицы
-    Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-        # Удаляем все таблицы после теста
-        Base.metadata.drop_all(bind=engine)
-
-
-# Фикстура для клиента (пересоздается для каждого теста)
-@pytest.fixture(scope="function")
-def client(db):
-    def override_get_db():
-        try:
-            yield db
-        finally:
-            db.rollback()
-
-    app.dependency_overrides[database.get_db] = override_get_db
-    return TestClient(app)
-
-
-# Фикстуры для тестовых данных
-@pytest.fixture
-def test_teacher():
-    return {
-        "email": "teacher@example.com",
-        "full_name": "Test Teacher",
-        "password": "testpassword"
-    }
-
-
-@pytest.fixture
-def test_student():
-    return {
-        "full_name": "Test Student",
-        "class_group": "10A"
-    }
-
-
-@pytest.fixture
-def test_subject():
-    return {"name": "Mathematics"}
-
-
-@pytest.fixture
-def test_grade():
-    return {
-        "student_id": 1,
-        "subject_id": 1,
-        "grade": 5,
-        "date": str(date.today())
-    }
-
-
-# Тесты
-def test_teacher_registration(client, test_teacher):
-    response = client.post("/teachers/register/", json=test_teacher)
-    assert response.status_code == 200
-    assert response.json()["email"] == test_teacher["email"]
-
-
-def test_teacher_login(client, test_teacher):
-    client.post("/teachers/register/", json=test_teacher)
-    response = client.post("/teachers/login/", data={
-        "username": test_teacher["email"],
-        "password": test_teacher["password"]
-    })
-    assert response.status_code == 200
-    assert "access_token" in response.json()
-
-
-def test_create_student(client, test_student):
-    response = client.post("/students/", json=test_student)
-    assert response.status_code == 201
-    assert response.json()["full_name"] == test_student["full_name"]
-
-
-def test_get_student(client, test_student):
-    # Создаем студента
-    create_resp = client.post("/students/", json=test_student)
-    student_id = create_resp.json()["id"]
-
-    # Получаем студента
-    response = client.get(f"/students/{student_id}")
-    assert response.status_code == 200
-    assert response.json()["full_name"] == test_student["full_name"]
-
-
-def test_create_subject(client, test_subject):
-    response = client.post("/subjects/", json=test_subject)
-    assert response.status_code == 200
-    assert response.json()["name"] == test_subject["name"]
-
-
-def test_create_grade(client, test_student, test_subject, test_grade):
-    # Создаем необходимые данные
-    client.post("/students/", json=test_student)
-    client.post("/subjects/", json=test_subject)
-
-    # Создаем оценку
-    response = client.post("/grades/", json=test_grade)
-    assert response.status_code == 201
-    assert response.json()["grade"] == test_grade["grade"]
-
-
-def test_student_stats(client, test_student, test_subject, test_grade):
-    # Подготавливаем данные
-    client.post("/students/", json=test_student)
-    client.post("/subjects/", json=test_subject)
-    client.post("/grades/", json=test_grade)
-
-    # Получаем статистику
-    response = client.get("/students/1/stats")
-    assert response.status_code == 200
-    assert response.json()["average_grade"] == 5.0
-    assert "Mathematics" in response.json()["subjects"]
-
-
-def test_protected_endpoint(client, test_teacher):
-    # Регистрация и логин
-    client.post("/teachers/register/", json=test_teacher)
-    login_resp = client.post("/teachers/login/", data={
-        "username": test_teacher["email"],
-        "password": test_teacher["password"]
-    })
-    token = login_resp.json()["access_token"]
-
-    # Защищенный эндпоинт
-    response = client.get(
-        "/teachers/me/",
-        headers={"Authorization": f"Bearer {token}"}
-    )
-    assert response.status_code == 200
-    assert response.json()["email"] == test_teacher["email"]
+import os
+import sqlite3
+import sys
+from pathlib import Path
+import pytest
+from fastapi.testclient import TestClient
+from dataclasses import replace
+from datetime import date
+from sqlalchemy import insert
+
+# Добавляем корень проекта в PYTHOPATH
+sys.path.insert(0, str(Path(__file__).parent.parent))
+# Минимальная сложность bcrypt: хеширование в тестах не должно занимать секунды
+os.environ.setdefault("JOURNAL_BCRYPT_ROUNDS", "4")
+
+from main import create_app
+import database
+import auth
+import refcache
+import tenancy
+from database import Base
+from settings import Settings
+
+# Тестовая база — общая in-memory SQLite: схема создаётся один раз в lifespan приложения,
+# между тестами таблицы только очищаются
+test_settings = Settings(database_url="sqlite://")
+app = create_app(test_settings)
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    with TestClient(app) as client:
+        yield client
+
+
+# Фикстура для БД (выполняется для каждой функции)
+@pytest.fixture(scope="function")
+def db(app_client):
+    db = app.state.database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+        # Очищаем все таблицы после теста
+        with app.state.database.engine.begin() as connection:
+            for table in reversed(Base.metadata.sorted_tables):
+                if table is not database.SchemaVersion.__table__:
+                    connection.execute(table.delete())
+            # Счётчики AUTOINCREMENT: id в каждом тесте снова начинаются с 1
+            connection.exec_driver_sql("DELETE FROM sqlite_sequence")
+        # Строки удалены в обход crud: кеш id перечитается в следующем тесте
+        refcache.reference_caches.clear()
+
+
+# Фикстура для клиента (пересоздается для каждого теста)
+@pytest.fixture(scope="function")
+def client(db, app_client):
+    def override_get_db():
+        try:
+            yield db
+        finally:
+            db.rollback()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    return app_client
+
+
+# Фикстуры для тестовых данных
+@pytest.fixture
+def test_teacher():
+    return {
+        "email": "teacher@example.com",
+        "full_name": "Test Teacher",
+        "password": "testpassword"
+    }
+
+
+@pytest.fixture
+def test_student():
+    return {
+        "full_name": "Test Student",
+        "class_group": "10A"
+    }
+
+
+@pytest.fixture
+def test_subject():
+    return {"name": "Mathematics"}
+
+
+@pytest.fixture
+def test_grade():
+    return {
+        "student_id": 1,
+        "subject_id": 1,
+        "grade": 5,
+        "date": str(date.today())
+    }
+
+
+# Тесты
+def test_teacher_registration(client, test_teacher):
+    response = client.post("/teachers/register/", json=test_teacher)
+    assert response.status_code == 200
+    assert response.json()["email"] == test_teacher["email"]
+
+
+def test_teacher_login(client, test_teacher):
+    client.post("/teachers/register/", json=test_teacher)
+    response = client.post("/teachers/login/", data={
+        "username": test_teacher["email"],
+        "password": test_teacher["password"]
+    })
+    assert response.status_code == 200
+    assert "access_token" in response.json()
+
+
+def test_create_student(client, test_student):
+    response = client.post("/students/", json=test_student)
+    assert response.status_code == 201
+    assert response.json()["full_name"] == test_student["full_name"]
+
+
+def test_get_student(client, test_student):
+    # Создаем студента
+    create_resp = client.post("/students/", json=test_student)
+    student_id = create_resp.json()["id"]
+
+    # Получаем студента
+    response = client.get(f"/students/{student_id}")
+    assert response.status_code == 200
+    assert response.json()["full_name"] == test_student["full_name"]
+
+
+def test_create_subject(client, test_subject):
+    response = client.post("/subjects/", json=test_subject)
+    assert response.status_code == 200
+    assert response.json()["name"] == test_subject["name"]
+
+
+def test_create_grade(client, test_student, test_subject, test_grade):
+    # Создаем необходимые данные
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+
+    # Создаем оценку
+    response = client.post("/grades/", json=test_grade)
+    assert response.status_code == 201
+    assert response.json()["grade"] == test_grade["grade"]
+
+
+def test_student_stats(client, test_student, test_subject, test_grade):
+    # Подготавливаем данные
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    client.post("/grades/", json=test_grade)
+
+    # Получаем статистику
+    response = client.get("/students/1/stats")
+    assert response.status_code == 200
+    assert response.json()["average_grade"] == 5.0
+    assert "Mathematics" in response.json()["subjects"]
+
+
+def test_protected_endpoint(client, test_teacher):
+    # Регистрация и логин
+    client.post("/teachers/register/", json=test_teacher)
+    login_resp = client.post("/teachers/login/", data={
+        "username": test_teacher["email"],
+        "password": test_teacher["password"]
+    })
+    token = login_resp.json()["access_token"]
+
+    # Защищенный эндпоинт
+    response = client.get(
+        "/teachers/me/",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert response.json()["email"] == test_teacher["email"]
+
+
+def test_student_stats_aggregates(client, test_student, test_subject):
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    client.post("/subjects/", json={"name": "Physics"})
+    for subject_id, grade, day in [(1, 5, "2024-09-02"), (1, 3, "2024-09-10"), (2, 4, "2024-10-01")]:
+        client.post("/grades/", json={
+            "student_id": 1, "subject_id": subject_id, "grade": grade, "date": day
+        })
+
+    response = client.get("/students/1/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["grades_count"] == 3
+    assert data["average_grade"] == 4.0
+    assert data["min_grade"] == 3 and data["max_grade"] == 5
+    assert data["subjects"] == {"Mathematics": 4.0, "Physics": 4.0}
+    assert data["subjects_stats"]["Mathematics"] == {"count": 2, "sum": 8, "average": 4.0, "min": 3, "max": 5}
+
+    # Фильтр по датам
+    response = client.get("/students/1/stats", params={"start_date": "2024-09-05", "end_date": "2024-09-30"})
+    assert response.json()["subjects"] == {"Mathematics": 3.0}
+
+
+def test_class_report(client, test_subject):
+    for name, group in [("Anna", "10A"), ("Boris", "10A"), ("Clara", "10A"), ("Dmitry", "10A"), ("Egor", "10B")]:
+        client.post("/students/", json={"full_name": name, "class_group": group})
+    client.post("/subjects/", json=test_subject)
+    client.post("/subjects/", json={"name": "Physics"})
+    grades = [(1, 1, 5), (1, 1, 5), (2, 1, 3), (2, 2, 4), (3, 1, 5), (5, 1, 1)]
+    for student_id, subject_id, grade in grades:
+        client.post("/grades/", json={
+            "student_id": student_id, "subject_id": subject_id, "grade": grade, "date": "2024-09-02"
+        })
+
+    response = client.get("/classes/10A/report")
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["students_count"], data["grades_count"]) == (4, 5)
+    assert (data["class_mean"], data["class_median"]) == (4.5, 5.0)
+    ranking = [(s["full_name"], s["average"], s["rank"], s["percentile"]) for s in data["students"]]
+    assert ranking == [
+        ("Anna", 5.0, 1, 50.0), ("Clara", 5.0, 1, 50.0), ("Boris", 3.5, 3, 0.0), ("Dmitry", None, None, None)
+    ]
+    math, physics = data["subjects"]
+    assert (math["name"], math["histogram"], math["average"], math["median"]) == (
+        "Mathematics", [0, 0, 1, 0, 3], 4.5, 5.0
+    )
+    assert (physics["histogram"], physics["median"]) == ([0, 0, 0, 1, 0], 4.0)
+
+    # Оценки вне 1-5, записанные в обход API, не учитываются ни в средних, ни в гистограммах
+    with app.state.database.engine.begin() as connection:
+        connection.execute(insert(database.Grade), [
+            {"student_id": 4, "subject_id": 2, "grade": grade, "date": date(2024, 9, 2)} for grade in (0, 6)
+        ])
+    response = client.get("/classes/10A/report")
+    assert response.status_code == 200
+    data = response.json()
+    assert [(s["average"], s["grades_count"]) for s in data["students"] if s["full_name"] == "Dmitry"] == [(None, 0)]
+    assert data["grades_count"] == 5
+    assert [s["histogram"] for s in data["subjects"]] == [[0, 0, 1, 0, 3], [0, 0, 0, 1, 0]]
+
+    assert client.get("/classes/11C/report").status_code == 404
+
+
+def test_bulk_grades(client, test_student, test_subject):
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    today = str(date.today())
+    payload = [
+        {"student_id": 1, "subject_id": 1, "grade": 5, "date": today},
+        {"student_id": 1, "subject_id": 1, "grade": 7, "date": today},
+        {"student_id": 42, "subject_id": 1, "grade": 4, "date": today},
+        {"student_id": 1, "subject_id": 42, "grade": 4, "date": today},
+        {"student_id": 1, "subject_id": 1, "grade": 3, "date": today},
+    ]
+
+    # Режим "всё или ничего" отклоняет весь пакет
+    response = client.post("/grades/bulk", params={"atomic": True}, json=payload)
+    assert response.status_code == 400
+    assert len(client.get("/grades/").json()) == 0
+
+    response = client.post("/grades/bulk", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["inserted"] == 2
+    assert data["errors"] == [
+        {"index": 1, "detail": "Grade must be between 1 and 5"},
+        {"index": 2, "detail": "Student not found"},
+        {"index": 3, "detail": "Subject not found"},
+    ]
+    assert [g["grade"] for g in client.get("/grades/").json()] == [5, 3]
+
+
+def test_grades_cursor_pagination(client, test_student, test_subject):
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    for day in ["2024-09-03", "2024-09-01", "2024-09-02", "2024-09-01", "2024-09-04"]:
+        client.post("/grades/", json={"student_id": 1, "subject_id": 1, "grade": 4, "date": day})
+
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/grades/", params=params)
+        assert response.status_code == 200
+        seen.extend((g["date"], g["id"]) for g in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        params = {"limit": 2, "after": cursor}
+
+    assert seen == sorted(seen)
+    assert len(seen) == 5
+    assert client.get("/grades/", params={"after": "not-a-cursor"}).status_code == 400
+
+
+def test_rollups_follow_grade_writes(client, db, test_student, test_subject):
+    import rollups
+
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    today = str(date.today())
+    ids = [
+        client.post("/grades/", json={"student_id": 1, "subject_id": 1, "grade": g, "date": today}).json()["id"]
+        for g in (5, 2, 4)
+    ]
+    client.post("/grades/bulk", json=[{"student_id": 1, "subject_id": 1, "grade": 3, "date": today}])
+    client.put(f"/grades/{ids[0]}", json={"student_id": 1, "subject_id": 1, "grade": 4, "date": today})
+    invalid = {"student_id": 1, "subject_id": 1, "grade": 7, "date": today}
+    assert client.put(f"/grades/{ids[0]}", json=invalid).status_code == 400
+    client.delete(f"/grades/{ids[1]}")
+
+    rollup = db.get(database.GradeRollup, (1, 1))
+    assert (rollup.count, rollup.sum, rollup.min, rollup.max) == (3, 11, 3, 4)
+    assert rollups.verify(db) == []
+    assert client.get("/students/1/stats").json()["subjects_stats"]["Mathematics"]["min"] == 3
+
+    # Ручное изменение в обход API обнаруживается и исправляется пересборкой
+    db.query(database.Grade).filter(database.Grade.id == ids[2]).update({"grade": 1})
+    db.commit()
+    # Пара, ученик и четыре периода (неделя и месяц — по предмету и по ученику)
+    assert len(rollups.verify(db)) == 6
+    rollups.rebuild(db)
+    assert rollups.verify(db) == []
+
+    client.delete("/students/1")
+    assert db.get(database.StudentRollup, 1) is None
+
+    # Удаление последней оценки пары удаляет и её агрегат
+    student_id = client.post("/students/", json=test_student).json()["id"]
+    grade = {"student_id": student_id, "subject_id": 1, "grade": 5, "date": today}
+    grade_id = client.post("/grades/", json=grade).json()["id"]
+    client.delete(f"/grades/{grade_id}")
+    db.expire_all()
+    assert db.get(database.GradeRollup, (student_id, 1)) is None
+    assert db.get(database.StudentRollup, student_id) is None
+
+
+@pytest.fixture
+def async_client():
+    # Отдельное приложение в асинхронном режиме со своей in-memory базой
+    async_app = create_app(Settings(database_url="sqlite://", async_mode=True))
+    # Один event loop на весь тест — пул асинхронных соединений привязан к нему
+    with TestClient(async_app) as client:
+        yield client
+
+
+def test_async_endpoints(async_client, test_teacher, test_student, test_subject, test_grade):
+    assert async_client.post("/register/", json=test_teacher).status_code == 201
+    login_resp = async_client.post("/token", data={
+        "username": test_teacher["email"],
+        "password": test_teacher["password"]
+    })
+    token = login_resp.json()["access_token"]
+    response = async_client.get("/teachers/me/", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["email"] == test_teacher["email"]
+
+    async_client.post("/students/", json=test_student)
+    async_client.post("/subjects/", json=test_subject)
+    assert async_client.post("/grades/", json=test_grade).json()["grade"] == 5
+    response = async_client.get("/grades/", params={"student_id": 1})
+    assert len(response.json()) == 1
+    headers = {"If-None-Match": response.headers["ETag"]}
+    assert async_client.get("/grades/", params={"student_id": 1}, headers=headers).status_code == 304
+
+    response = async_client.get("/students/1/stats")
+    assert response.json()["subjects"] == {"Mathematics": 5.0}
+    response = async_client.get("/grades/export", params={"format": "csv"})
+    assert response.text.splitlines()[1] == f"1,1,1,5,{test_grade['date']}"
+    assert async_client.get("/students/2").status_code == 404
+
+
+def test_engine_factory_pragmas(tmp_path):
+    from sqlalchemy.exc import OperationalError
+
+    config = Settings(database_url=f"sqlite:///{tmp_path}/factory.db", sqlite_busy_timeout_ms=1234)
+    writer = database.create_engine_from_settings(config)
+    reader = database.create_engine_from_settings(config, read_only=True)
+    with writer.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 1234
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+
+    # Пул для чтения не может писать
+    with reader.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("CREATE TABLE t (id INTEGER)")
+    writer.dispose()
+    reader.dispose()
+
+
+def test_token_cache(client, db, test_teacher):
+    token_cache = app.state.token_cache
+    token_cache.clear()
+    client.post("/register/", json=test_teacher)
+    token = client.post("/token", data={
+        "username": test_teacher["email"],
+        "password": test_teacher["password"]
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/teachers/me/", headers=headers).json()["full_name"] == "Test Teacher"
+    assert client.get("/teachers/me/", headers=headers).json()["full_name"] == "Test Teacher"
+    assert token_cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+    # Изменение преподавателя сбрасывает закешированный токен
+    teacher = auth.get_teacher_by_email(db, test_teacher["email"])
+    teacher.full_name = "Renamed Teacher"
+    db.commit()
+    assert client.get("/teachers/me/", headers=headers).json()["full_name"] == "Renamed Teacher"
+    assert token_cache.stats()["misses"] == 2
+
+    # Сброс — после commit: до него параллельный запрос читает старую строку и вернул бы её в кеш.
+    # Откат ничего не меняет — кеш остаётся
+    client.get("/teachers/me/", headers=headers)
+    teacher.full_name = "Rolled Back"
+    db.flush()
+    db.rollback()
+    assert token_cache.get(token).full_name == "Renamed Teacher"
+    teacher = auth.get_teacher_by_email(db, test_teacher["email"])
+    teacher.full_name = "Committed Teacher"
+    db.flush()
+    assert token_cache.get(token) is not None
+    db.commit()
+    assert token_cache.get(token) is None
+
+
+def test_password_hasher_rehash_and_backpressure(client, db, test_teacher, monkeypatch):
+    import threading
+    from fastapi import HTTPException
+
+    monkeypatch.setattr(app.state, "password_hasher", auth.PasswordHasher(workers=1, max_pending=0, rounds=4))
+    client.post("/register/", json=test_teacher)
+    assert auth.get_teacher_by_email(db, test_teacher["email"]).hashed_password.startswith("$2b$04$")
+
+    # Сложность bcrypt изменилась — пароль перехешируется при входе
+    monkeypatch.setattr(app.state, "password_hasher", auth.PasswordHasher(workers=1, max_pending=0, rounds=5))
+    response = client.post("/token", data={
+        "username": test_teacher["email"],
+        "password": test_teacher["password"]
+    })
+    assert response.status_code == 200
+    db.expire_all()
+    assert auth.get_teacher_by_email(db, test_teacher["email"]).hashed_password.startswith("$2b$05$")
+
+    # Пул занят, очередь переполнена — 503 с Retry-After
+    release = threading.Event()
+    hasher = app.state.password_hasher
+    hasher.submit(release.wait)
+    with pytest.raises(HTTPException) as exc_info:
+        hasher.hash("secret")
+    release.set()
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == "1"
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_login_storm_leaves_threadpool_free(tmp_path, test_teacher, test_student):
+    import asyncio
+    import threading
+    import anyio
+    import httpx
+    config = Settings(database_url=f"sqlite:///{tmp_path}/journal.db", hash_workers=1, hash_max_pending=8)
+    storm_app = create_app(config)
+    with TestClient(storm_app) as client:
+        client.post("/register/", json=test_teacher)
+        client.post("/students/", json=test_student)
+    login = {"username": test_teacher["email"], "password": test_teacher["password"]}
+
+    # Пул bcrypt занят, логины ждут в его очереди; пул anyio на 2 потока.
+    # Ожидающие логины не держат потоки — чтение учеников выполняется
+    async def scenario():
+        anyio.to_thread.current_default_thread_limiter().total_tokens = 2
+        release = threading.Event()
+        storm_app.state.password_hasher.submit(release.wait)
+        transport = httpx.ASGITransport(app=storm_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            logins = [asyncio.create_task(client.post("/token", data=login)) for _ in range(4)]
+            try:
+                await asyncio.sleep(0.2)
+                students = await asyncio.wait_for(client.get("/students/"), 5)
+                assert not any(task.done() for task in logins)
+            finally:
+                release.set()
+            return students, await asyncio.gather(*logins)
+
+    students, logins = asyncio.run(scenario())
+    assert students.status_code == 200 and len(students.json()) == 1
+    assert [response.status_code for response in logins] == [200] * 4
+    storm_app.state.database.close()
+
+
+def test_export_grades(client, test_student, test_subject):
+    import json
+
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    for grade, day in [(5, "2024-09-02"), (3, "2024-09-01"), (4, "2024-10-01")]:
+        client.post("/grades/", json={"student_id": 1, "subject_id": 1, "grade": grade, "date": day})
+
+    response = client.get("/grades/export", params={"end_date": "2024-09-30"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [
+        {"id": 2, "student_id": 1, "subject_id": 1, "grade": 3, "date": "2024-09-01"},
+        {"id": 1, "student_id": 1, "subject_id": 1, "grade": 5, "date": "2024-09-02"},
+    ]
+
+    response = client.get("/students/export", params={"format": "csv"})
+    assert response.text.splitlines() == ["id,full_name,class_group", "1,Test Student,10A"]
+
+    # Размер страницы в обычных списках ограничен
+    assert client.get("/grades/", params={"limit": 1_000_000}).status_code == 422
+
+
+def test_import_csv(client, test_subject):
+    client.post("/subjects/", json=test_subject)
+    client.post("/students/", json={"full_name": "Ivan Petrov", "class_group": "10A"})
+    content = "\n".join([
+        "full_name,class_group,subject,grade,date",
+        "Ivan Petrov,10A,Mathematics,5,2024-09-02",
+        "Anna Smirnova,10A,Physics,4,2024-09-03",
+        "Anna Smirnova,10A,,,",
+        ",,Chemistry,,",
+        "Ivan Petrov,10A,Physics,9,2024-09-03",
+        "Anna Smirnova,10A,Mathematics,3,2024-09-04",
+    ])
+    response = client.post(
+        "/import/csv",
+        params={"chunk_size": 2},
+        files={"file": ("gradebook.csv", content.encode(), "text/csv")},
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["rows"] == 6
+    assert report["chunks"] == 3
+    assert report["students_created"] == 1
+    assert report["subjects_created"] == 2
+    assert report["grades_inserted"] == 3
+    assert report["errors"] == [{"line": 6, "detail": "Grade must be between 1 and 5"}]
+
+    students = client.get("/students/").json()
+    assert [s["full_name"] for s in students] == ["Ivan Petrov", "Anna Smirnova"]
+    assert client.get("/students/2/stats").json()["subjects"] == {"Mathematics": 3.0, "Physics": 4.0}
+
+
+def test_import_csv_rejects_broken_file(client):
+    rows = "".join(f"Student {i},10A,Mathematics,5,2024-09-02\n" for i in range(1000))
+    good = ("full_name,class_group,subject,grade,date\n" + rows).encode()
+    # Не UTF-8 после нескольких пакетов: 400 с отчётом, записанные пакеты остаются
+    response = client.post(
+        "/import/csv", params={"chunk_size": 100}, files={"file": ("gradebook.csv", good + b"\xff\xfe,10A,Math,5,\n")}
+    )
+    assert response.status_code == 400
+    report = response.json()["detail"]
+    assert report["chunks"] > 0 and report["grades_inserted"] == report["chunks"] * 100
+    assert report["errors"][-1]["detail"] == "File is not valid UTF-8"
+    assert len(client.get("/grades/", params={"limit": 1000}).json()) == report["grades_inserted"]
+
+    broken = good + b"x" * 200_000 + b",10A,Mathematics,5,2024-09-02\n"
+    response = client.post("/import/csv", params={"chunk_size": 100}, files={"file": ("gradebook.csv", broken)})
+    assert response.status_code == 400
+    assert response.json()["detail"]["errors"][-1]["detail"].startswith("Malformed CSV")
+    assert response.json()["detail"]["chunks"] == 10
+
+
+def test_async_import_runs_off_event_loop(tmp_path, monkeypatch):
+    import asyncio
+    import importer
+    threads = []
+    import_csv = importer.import_csv
+
+    def tracked(db, *args):
+        # В потоке event loop есть работающий цикл, в пуле потоков — нет
+        threads.append(asyncio._get_running_loop())
+        return import_csv(db, *args)
+
+    monkeypatch.setattr(importer, "import_csv", tracked)
+    async_app = create_app(Settings(database_url=f"sqlite:///{tmp_path}/journal.db", async_mode=True))
+    with TestClient(async_app) as client:
+        content = "full_name,class_group,subject,grade,date\nIvan Petrov,10A,Mathematics,5,2024-09-02\n"
+        response = client.post("/import/csv", files={"file": ("gradebook.csv", content.encode(), "text/csv")})
+        assert response.json()["grades_inserted"] == 1
+        assert client.get("/grades/").json()[0]["grade"] == 5
+        # Архивация в async-режиме тоже идёт через пул потоков
+        assert client.post("/archive/grades", params={"before": "2025-01-01"}).json()["grades"] == 1
+        assert client.post("/classes/10A/graduate").json()["students"] == 1
+    assert threads == [None]
+
+
+def test_conditional_get(client, test_student, test_subject):
+    client.post("/students/", json=test_student)
+    first = client.get("/students/")
+    etag = first.headers["ETag"]
+    assert first.headers["Last-Modified"]
+
+    cached = client.get("/students/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    # Запись в другую таблицу не сбрасывает ETag студентов
+    client.post("/subjects/", json=test_subject)
+    assert client.get("/students/", headers={"If-None-Match": etag}).status_code == 304
+
+    client.put("/students/1", json={"full_name": "Renamed", "class_group": "10A"})
+    fresh = client.get("/students/", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["ETag"] != etag
+    assert fresh.json()[0]["full_name"] == "Renamed"
+
+    grades_etag = client.get("/grades/", params={"student_id": 1}).headers["ETag"]
+    client.post("/grades/bulk", json=[{"student_id": 1, "subject_id": 1, "grade": 5, "date": "2024-09-02"}])
+    assert client.get("/grades/", params={"student_id": 1}, headers={"If-None-Match": grades_etag}).status_code == 200
+
+
+def test_version_bump_upserts(db):
+    import versions
+    # Строк версий ещё нет: первая запись вставляет их тем же оператором, что и увеличивает
+    versions.bump(db, versions.STUDENTS, versions.GRADES, versions.STUDENTS)
+    versions.bump(db, versions.GRADES)
+    db.commit()
+    assert versions.current(db, versions.STUDENTS)[0] == 1
+    assert versions.current(db, versions.GRADES)[0] == 2
+
+
+def test_fast_lists_match_orm_path(client, test_student, test_subject, monkeypatch):
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    client.post("/grades/bulk", json=[
+        {"student_id": 1, "subject_id": 1, "grade": g, "date": f"2024-09-0{g}"} for g in (1, 2, 3)
+    ])
+    urls = ["/students/", "/subjects/", "/grades/?student_id=1&limit=2"]
+    orm = [client.get(url) for url in urls]
+
+    monkeypatch.setattr(test_settings, "fast_lists", True)
+    for url, expected in zip(urls, orm):
+        response = client.get(url)
+        assert response.content == expected.content
+        assert response.headers["content-type"] == "application/json"
+        assert response.headers["ETag"] == expected.headers["ETag"]
+    assert response.headers["X-Next-Cursor"] == orm[2].headers["X-Next-Cursor"]
+
+
+def test_metrics_endpoint(client, test_student, monkeypatch, caplog):
+    import metrics
+
+    metrics.registry.reset()
+    client.post("/students/", json=test_student)
+    client.get("/students/1")
+    client.get("/students/1")
+    client.get("/students/42")
+
+    text = client.get("/metrics").text
+    assert 'journal_http_requests_total{method="GET",route="/students/{student_id}",status="200"} 2' in text
+    assert 'journal_http_requests_total{method="GET",route="/students/{student_id}",status="404"} 1' in text
+    # Один SELECT на запрос студента
+    assert 'journal_http_request_db_statements_count{method="GET",route="/students/{student_id}"} 3' in text
+    assert 'journal_http_request_db_statements_sum{method="GET",route="/students/{student_id}"} 3' in text
+    assert "journal_db_pool_checkout_seconds_count" in text
+    assert "journal_token_cache_hits_total" in text
+
+    # Время bcrypt — summary: квантили с _sum и _count
+    app.state.password_hasher.hash("secret")
+    text = client.get("/metrics").text
+    assert "# TYPE journal_password_hash_seconds summary" in text
+    assert 'journal_password_hash_seconds{stage="run",quantile="0.5"}' in text
+    assert 'journal_password_hash_seconds_count{stage="total"}' in text
+    assert 'journal_password_hash_seconds_sum{stage="run"}' in text
+
+    monkeypatch.setattr(test_settings, "slow_query_ms", 1e-6)
+    with caplog.at_level("WARNING", logger="journal.slow_query"):
+        client.get("/students/1")
+    assert any("plan: SEARCH students" in record.getMessage() for record in caplog.records)
+
+
+def test_create_app_checks_schema_version(tmp_path):
+    path = tmp_path / "app.db"
+    config = Settings(database_url=f"sqlite:///{path}")
+    journal_db = database.Database(config)
+    assert not path.exists()  # движки создаются без подключения к БД
+
+    assert journal_db.ensure_schema() is True
+    assert journal_db.ensure_schema() is False
+    with journal_db.engine.begin() as connection:
+        connection.execute(database.SchemaVersion.__table__.update().values(version=0))
+    assert journal_db.ensure_schema() is True
+    journal_db.engine.dispose()
+
+    with TestClient(create_app(config)) as client:
+        assert client.post("/subjects/", json={"name": "Physics"}).json()["id"] == 1
+
+
+def test_schema_upgrade_backfills_rollups(tmp_path):
+    import rollups
+    config = Settings(database_url=f"sqlite:///{tmp_path}/journal.db")
+    journal_db = database.Database(config)
+    journal_db.ensure_schema()
+    with journal_db.SessionLocal() as db:
+        db.add_all([database.Student(full_name="Ivan Petrov", class_group="10A"), database.Subject(name="Math")])
+        db.flush()
+        db.add_all([database.Grade(student_id=1, subject_id=1, grade=g, date=date(2020, 9, g)) for g in (4, 5)])
+        db.commit()
+    # База до появления агрегатов: таблиц нет, версия схемы старая
+    with journal_db.engine.begin() as connection:
+        for model in (database.GradeRollup, database.StudentRollup,
+                      database.GradeTrendRollup, database.StudentTrendRollup):
+            model.__table__.drop(connection)
+        connection.execute(database.SchemaVersion.__table__.update().values(version=1))
+    assert journal_db.ensure_schema() is True
+    with journal_db.SessionLocal() as db:
+        assert rollups.verify(db) == []
+    journal_db.engine.dispose()
+
+    with TestClient(create_app(config)) as client:
+        assert client.get("/students/1/stats").json()["subjects"] == {"Math": 4.5}
+        assert client.post("/archive/grades", params={"before": "2021-01-01"}).json()["grades"] == 2
+
+
+def test_schema_upgrade_rebuilds_autoincrement_tables(tmp_path):
+    # База старой версии: students и grades без AUTOINCREMENT и новых индексов, в архиве — id выпущенных
+    path = tmp_path / "old.db"
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE students (id INTEGER PRIMARY KEY, full_name VARCHAR, class_group VARCHAR);
+        CREATE TABLE subjects (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE);
+        CREATE TABLE grades (id INTEGER PRIMARY KEY, student_id INTEGER REFERENCES students (id),
+                             subject_id INTEGER REFERENCES subjects (id), grade INTEGER, date DATE);
+        CREATE TABLE students_archive (id INTEGER PRIMARY KEY, full_name VARCHAR, class_group VARCHAR,
+                                       graduated_on DATE);
+        CREATE TABLE grades_archive (id INTEGER PRIMARY KEY, student_id INTEGER, subject_id INTEGER,
+                                     grade INTEGER, date DATE);
+        CREATE TABLE schema_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL);
+        INSERT INTO schema_version VALUES (1, 1);
+        INSERT INTO students VALUES (1, 'Ivan Petrov', '10A');
+        INSERT INTO subjects VALUES (1, 'Math');
+        INSERT INTO grades VALUES (1, 1, 1, 5, '2024-09-02');
+        INSERT INTO students_archive VALUES (7, 'Graduated', '11B', '2024-06-01');
+        INSERT INTO grades_archive VALUES (12, 7, 1, 4, '2024-05-20');
+    """)
+    connection.commit()
+    connection.close()
+
+    with TestClient(create_app(Settings(database_url=f"sqlite:///{path}"))) as client:
+        # Новые id выше выпущенных в архив
+        assert client.post("/students/", json={"full_name": "Anna Smirnova", "class_group": "10A"}).json()["id"] == 8
+        grade = {"student_id": 1, "subject_id": 1, "grade": 4, "date": "2024-09-03"}
+        assert client.post("/grades/", json=grade).json()["id"] == 13
+        assert [s["full_name"] for s in client.get("/students/search", params={"q": "petrov"}).json()] == [
+            "Ivan Petrov"
+        ]
+        assert client.get("/students/1/stats").json()["subjects"] == {"Math": 4.5}
+
+    connection = sqlite3.connect(path)
+    tables = dict(connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall())
+    indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    connection.close()
+    assert "AUTOINCREMENT" in tables["students"] and "AUTOINCREMENT" in tables["grades"]
+    assert {"ix_grades_date_id", "ix_grades_student_subject", "ix_students_full_name"} <= indexes
+
+
+def test_apps_use_their_own_settings(client, test_student):
+    # Два приложения в одном процессе: размер страницы, быстрые списки и кеш токенов — у каждого свои
+    small = create_app(Settings(database_url="sqlite://", max_page_size=5, fast_lists=True, token_cache_enabled=False))
+    assert small.state.token_cache is not app.state.token_cache and not small.state.token_cache.enabled
+    with TestClient(small) as small_client:
+        small_client.post("/students/", json=test_student)
+        response = small_client.get("/students/", params={"limit": 6})
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["query", "limit"]
+        assert small_client.get("/students/", params={"limit": 5}).headers["content-type"] == "application/json"
+        assert client.get("/students/", params={"limit": 6}).status_code == 200
+
+
+def test_tenant_databases(tmp_path, test_teacher, test_student):
+    config = Settings(database_url="sqlite://", tenant_database_url=f"sqlite:///{tmp_path}/{{tenant}}.db",
+                      tenant_cache_size=1)
+    tenant_app = create_app(config)
+    with TestClient(tenant_app) as client:
+        assert client.post("/students/", json=test_student, headers={"X-School": "a"}).status_code == 200
+        assert client.get("/students/", headers={"X-School": "b"}).json() == []
+        assert len(client.get("/students/", headers={"X-School": "a"}).json()) == 1
+        assert client.get("/students/").status_code == 400
+        assert client.get("/students/", headers={"X-School": "../a"}).status_code == 400
+        # Вне LRU осталась одна база, файлы обеих школ на месте
+        assert tenant_app.state.database.stats()["open"] == 1
+        assert (tmp_path / "a.db").exists() and (tmp_path / "b.db").exists()
+
+        # Выгрузка держит базу школы, пока идёт тело ответа: вытеснение из LRU её не закрывает
+        import export
+        from starlette.requests import Request
+        request = Request({"type": "http", "app": tenant_app, "headers": [(b"x-school", b"a")], "state": {}})
+        chunks = export.stream_rows(request, export.students_query(), "csv")
+        assert next(chunks) == b"id,full_name,class_group\r\n"
+        assert tenant_app.state.database._tenants["a"].leases == 1
+        assert client.get("/students/", headers={"X-School": "b"}).status_code == 200
+        assert "a" in tenant_app.state.database._tenants
+        assert len(list(chunks)) == 1 and tenant_app.state.database._tenants["a"].leases == 0
+
+        client.post("/register/", json=test_teacher, headers={"X-School": "b"})
+        token = client.post("/token", headers={"X-School": "b"}, data={
+            "username": test_teacher["email"], "password": test_teacher["password"]
+        }).json()["access_token"]
+        auth_header = {"Authorization": f"Bearer {token}"}
+        # Школа берётся из токена, чужой заголовок отклоняется
+        assert client.get("/teachers/me/", headers=auth_header).json()["email"] == test_teacher["email"]
+        assert client.get("/students/", headers={**auth_header, "X-School": "a"}).status_code == 403
+
+    nodes = ["n1", "n2"]
+    foreign = next(f"s{i}" for i in range(100) if tenancy.tenant_node(f"s{i}", nodes) == "n2")
+    with TestClient(create_app(replace(config, tenant_nodes="n1,n2", node_name="n1"))) as client:
+        response = client.get("/students/", headers={"X-School": foreign})
+        assert response.status_code == 421
+        assert response.headers["X-School-Node"] == "n2"
+
+
+def test_archive_and_graduate(client, db, test_subject):
+    import rollups
+    senior = client.post("/students/", json={"full_name": "Senior Student", "class_group": "11A"}).json()["id"]
+    junior = client.post("/students/", json={"full_name": "Junior Student", "class_group": "10A"}).json()["id"]
+    subject = client.post("/subjects/", json=test_subject).json()["id"]
+    for student_id, grade, day in [(senior, 5, "2023-05-10"), (senior, 3, "2024-10-01"),
+                                   (junior, 4, "2023-04-01"), (junior, 2, "2024-10-02")]:
+        client.post("/grades/", json={"student_id": student_id, "subject_id": subject, "grade": grade, "date": day})
+
+    since = client.get("/grades/changes").json()[-1]["seq"]
+    report = client.post("/archive/grades", params={"before": "2024-09-01", "chunk_size": 1}).json()
+    assert (report["grades"], report["students"], report["chunks"]) == (2, 2, 2)
+    # Лента изменений видит перенос в архив как удаление
+    archived = client.get("/grades/changes", params={"since": since}).json()
+    assert [(c["op"], c["grade"]["date"]) for c in archived] == [("delete", "2023-05-10"), ("delete", "2023-04-01")]
+    assert [g["date"] for g in client.get("/grades/").json()] == ["2024-10-01", "2024-10-02"]
+    assert rollups.verify(db) == []
+    assert client.get(f"/students/{senior}/stats").json()["grades_count"] == 1
+    data = client.get(f"/students/{senior}/stats", params={"include_archived": True}).json()
+    assert (data["grades_count"], data["average_grade"]) == (2, 4.0)
+
+    since = archived[-1]["seq"]
+    report = client.post("/classes/11A/graduate").json()
+    assert (report["students"], report["grades"]) == (1, 1)
+    graduated = client.get("/grades/changes", params={"since": since}).json()
+    assert [(c["op"], c["grade"]["date"], c["class_group"]) for c in graduated] == [("delete", "2024-10-01", "11A")]
+    assert client.get(f"/students/{senior}").status_code == 404
+    assert client.get("/classes/11A/report").status_code == 404
+    data = client.get("/classes/11A/report", params={"include_archived": True}).json()
+    assert (data["students_count"], data["grades_count"], data["class_mean"]) == (1, 2, 4.0)
+    assert client.get(f"/students/{senior}/stats", params={"include_archived": True}).json()["grades_count"] == 2
+    exported = client.get("/grades/export", params={"include_archived": True}).text.splitlines()
+    assert len(exported) == 4 and len(client.get("/grades/export").text.splitlines()) == 1
+    # Предмет с архивными оценками удалить нельзя
+    assert client.delete(f"/subjects/{subject}").status_code == 400
+
+
+def test_student_search(client):
+    for full_name, class_group in [("Ivanov Petr", "10A"), ("Petrova Anna", "10A"),
+                                   ("Иванова Мария", "9B"), ("Sidorov Ivan", "11A")]:
+        client.post("/students/", json={"full_name": full_name, "class_group": class_group})
+
+    def names(q):
+        response = client.get("/students/search", params={"q": q})
+        assert response.status_code == 200
+        return [s["full_name"] for s in response.json()]
+
+    # Подстрока без учёта регистра, начинающиеся с запроса имена — первыми
+    assert names("iva") == ["Ivanov Petr", "Sidorov Ivan"]
+    assert names("петр") == [] and names("ИВАН") == ["Иванова Мария"]
+    assert names("petr 10") == ["Petrova Anna", "Ivanov Petr"]
+    assert names("Si") == ["Sidorov Ivan"] and names("9B") == ["Иванова Мария"]
+    assert names('"') == []
+
+    # Индекс следует за изменениями и удалениями
+    client.put("/students/1", json={"full_name": "Kuznetsov Petr", "class_group": "10A"})
+    assert names("ivanov") == []
+    assert names("kuzn") == ["Kuznetsov Petr"]
+    client.delete("/students/2")
+    assert names("petr") == ["Kuznetsov Petr"]
+
+
+def test_student_trend(client, db, test_student, test_subject):
+    import rollups
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    client.post("/subjects/", json={"name": "Physics"})
+    ids = [
+        client.post("/grades/", json={"student_id": 1, "subject_id": subject, "grade": grade, "date": day}).json()["id"]
+        for subject, grade, day in [(1, 5, "2024-09-02"), (1, 3, "2024-09-08"), (2, 4, "2024-09-09"),
+                                    (1, 2, "2024-10-01")]
+    ]
+    # Вторая оценка переносится в другую неделю, первая удаляется
+    client.put(f"/grades/{ids[1]}", json={"student_id": 1, "subject_id": 1, "grade": 3, "date": "2024-09-10"})
+    client.delete(f"/grades/{ids[0]}")
+
+    weeks = client.get("/students/1/trend").json()
+    assert weeks["bucket"] == "week" and weeks["subject_id"] is None
+    assert weeks["points"] == [
+        {"start": "2024-09-09", "count": 2, "average": 3.5},
+        {"start": "2024-09-30", "count": 1, "average": 2.0},
+    ]
+    months = client.get("/students/1/trend", params={"bucket": "month", "subject_id": 1}).json()["points"]
+    assert months == [{"start": "2024-09-01", "count": 1, "average": 3.0},
+                      {"start": "2024-10-01", "count": 1, "average": 2.0}]
+    assert client.get("/students/1/trend", params={"bucket": "day"}).status_code == 422
+    assert client.get("/students/99/trend").status_code == 404
+
+    # Пересборка с нуля даёт те же периоды
+    assert rollups.verify(db) == []
+    db.query(database.GradeTrendRollup).delete()
+    db.query(database.StudentTrendRollup).delete()
+    db.commit()
+    assert rollups.verify(db)
+    rollups.rebuild_trends(db)
+    db.commit()
+    assert client.get("/students/1/trend").json() == weeks
+
+
+def test_group_commit(tmp_path, test_student, test_subject):
+    import groupcommit
+    import models
+    import rollups
+    from concurrent.futures import ThreadPoolExecutor
+    config = Settings(database_url=f"sqlite:///{tmp_path}/journal.db", group_commit=True,
+                      group_commit_interval_ms=50)
+    group_app = create_app(config)
+    with TestClient(group_app) as client:
+        client.post("/students/", json=test_student)
+        client.post("/subjects/", json=test_subject)
+        batches = groupcommit.stats.batch_size.count
+
+        def post(grade):
+            return client.post("/grades/", json={"student_id": 1, "subject_id": 1, "grade": grade, "date": "2024-09-02"})
+
+        # Параллельные запросы попадают в один пакет; каждый получает свою оценку с id после commit
+        with ThreadPoolExecutor(8) as pool:
+            responses = list(pool.map(post, [5, 4, 3, 2, 1, 5, 4, 9]))
+        assert [r.status_code for r in responses] == [200] * 7 + [400]
+        assert sorted(r.json()["id"] for r in responses[:7]) == list(range(1, 8))
+        assert groupcommit.stats.batch_size.count - batches < 7
+        assert client.post("/grades/", json={"student_id": 99, "subject_id": 1, "grade": 5,
+                                             "date": "2024-09-02"}).status_code == 404
+
+        assert len(client.get("/grades/").json()) == 7
+        assert client.get("/students/1/stats").json()["grades_count"] == 7
+        with group_app.state.database.SessionLocal() as db:
+            assert rollups.verify(db) == []
+        assert "journal_group_commit_batch_size_bucket" in client.get("/metrics").text
+
+        # Строка, на которой падает транзакция пакета, не отменяет остальные оценки пакета
+        apply = rollups.apply
+
+        def failing_apply(db, added=(), removed=()):
+            if any(grade == 2 for _, _, grade, _ in added):
+                raise ValueError("broken row")
+            return apply(db, added, removed)
+
+        grade_writer = groupcommit.writer(group_app.state.database)
+        rollups.apply = failing_apply
+        try:
+            futures = [grade_writer.submit(models.GradeCreate(
+                student_id=1, subject_id=1, grade=grade, date=date(2024, 9, 3)
+            )) for grade in (5, 2, 4)]
+            assert [f.exception(5) is None for f in futures] == [True, False, True]
+        finally:
+            rollups.apply = apply
+        assert str(futures[1].exception()) == "broken row"
+        assert len(client.get("/grades/").json()) == 9
+
+        # Остановка приложения дописывает очередь: принятые оценки не теряются
+        grade_writer.interval = 60
+        futures = [grade_writer.submit(models.GradeCreate(
+            student_id=1, subject_id=1, grade=grade, date=date(2024, 9, 4)
+        )) for grade in (3, 4)]
+    assert [f.result(0).grade for f in futures] == [3, 4]
+    with group_app.state.database.SessionLocal() as db:
+        assert db.query(database.Grade).count() == 11
+
+
+def test_admission_limiter():
+    import asyncio
+    import admission
+
+    async def scenario():
+        limiter = admission.Limiter(limit=1, max_waiting=2)
+        assert await limiter.acquire(admission.NORMAL, 1) is None
+        admitted = []
+
+        async def request(priority, name):
+            if await limiter.acquire(priority, 1) is None:
+                admitted.append(name)
+                limiter.release()
+
+        waiters = [asyncio.create_task(request(admission.LOW, "low")),
+                   asyncio.create_task(request(admission.HIGH, "high"))]
+        await asyncio.sleep(0)
+        # Очередь полна — отказ сразу; освободившееся место первым получает high
+        assert await limiter.acquire(admission.HIGH, 1) == "queue_full"
+        limiter.release()
+        await asyncio.gather(*waiters)
+        assert admitted == ["high", "low"]
+
+        assert await limiter.acquire(admission.NORMAL, 1) is None
+        assert await limiter.acquire(admission.NORMAL, 0.01) == "timeout"
+        limiter.release()
+        assert (limiter.active, limiter.waiting) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_admission_middleware(tmp_path, test_student):
+    config = Settings(database_url=f"sqlite:///{tmp_path}/journal.db", admission_control=True,
+                      admission_routes="GET /students/{student_id}/stats=0:0:0")
+    with TestClient(create_app(config)) as client:
+        student_id = client.post("/students/", json=test_student).json()["id"]
+        # Маршрут с исчерпанным лимитом отклоняется сразу, соседние шаблоны пути — нет
+        response = client.get(f"/students/{student_id}/stats")
+        assert response.status_code == 429 and response.headers["Retry-After"] == "1"
+        assert client.get("/students/search", params={"q": "Test"}).status_code == 200
+        assert client.get(f"/students/{student_id}").status_code == 200
+        assert client.get("/missing").status_code == 404
+        exported = client.get("/metrics").text
+        assert ('journal_admission_rejected_total{route="GET /students/{student_id}/stats",reason="queue_full"} 1'
+                in exported)
+        # Отказ учтён в метриках запросов по маршруту, а не как unmatched
+        assert ('journal_http_requests_total{method="GET",route="/students/{student_id}/stats",status="429"} 1'
+                in exported)
+
+
+def test_reference_cache(client, db, test_student, test_subject, monkeypatch):
+    import crud
+    import models
+    import versions
+    from sqlalchemy import event
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    cache = refcache.ReferenceCache(check_seconds=60)
+    monkeypatch.setattr(refcache.reference_caches, "get", lambda session: cache)
+    assert cache.existing(db, refcache.STUDENTS, [1, 2]) == {1}
+
+    # Проверка ссылок оценки не обращается к БД, пока версии не пора сверять
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        crud.check_grade_refs(db, models.GradeCreate(student_id=1, subject_id=1, grade=5, date=date(2024, 9, 2)))
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+    assert statements == []
+
+    # Ученик другого процесса (в обход crud) находится перепроверкой промаха
+    db.add(database.Student(full_name="Other Process", class_group="10B"))
+    versions.bump(db, versions.STUDENTS)
+    db.commit()
+    assert refcache.exists(db, refcache.STUDENTS, 2)
+    # Удаление через crud видно сразу, удаление другим процессом — после сверки версий
+    crud.delete_student(db, 2)
+    assert not refcache.exists(db, refcache.STUDENTS, 2)
+    db.query(database.Student).filter(database.Student.id == 1).delete()
+    versions.bump(db, versions.STUDENTS)
+    db.commit()
+    assert refcache.exists(db, refcache.STUDENTS, 1)
+    cache.check_seconds = 0
+    assert not refcache.exists(db, refcache.STUDENTS, 1)
+
+    # GET /subjects/ отдаётся из памяти; ETag совпадает с версией таблицы
+    client.post("/subjects/", json={"name": "Physics"})
+    response = client.get("/subjects/", params={"limit": 1})
+    assert response.json() == [{"id": 1, "name": test_subject["name"]}]
+    assert response.headers["ETag"] == versions.etag(versions.SUBJECTS, 2)
+    assert client.get("/subjects/", params={"after": response.headers["X-Next-Cursor"]}).json() == [
+        {"id": 2, "name": "Physics"}
+    ]
+    client.put("/subjects/2", json={"name": "Chemistry"})
+    assert [s["name"] for s in client.get("/subjects/").json()] == [test_subject["name"], "Chemistry"]
+    assert client.delete("/subjects/2").status_code == 200
+    assert not refcache.exists(db, refcache.SUBJECTS, 2)
+    assert refcache.IdSet([3, 17]).size == 2 and 17 in refcache.IdSet([17]) and -1 not in refcache.IdSet([1])
+
+
+def test_reference_cache_shared_by_read_pool(tmp_path, test_subject):
+    # На файловой базе GET /subjects/ идёт через пул чтения, запись — через пул записи: кеш у них общий
+    config = Settings(database_url=f"sqlite:///{tmp_path}/journal.db", reference_cache_check_ms=60_000)
+    file_app = create_app(config)
+    with TestClient(file_app) as client:
+        journal_db = file_app.state.database
+        assert journal_db.read_engine is not journal_db.engine
+        etag = client.get("/subjects/").headers["ETag"]
+        client.post("/subjects/", json=test_subject)
+        created = client.get("/subjects/", headers={"If-None-Match": etag})
+        assert created.status_code == 200
+        assert created.json() == [{"id": 1, **test_subject}]
+        client.put("/subjects/1", json={"name": "Chemistry"})
+        renamed = client.get("/subjects/", headers={"If-None-Match": created.headers["ETag"]})
+        assert renamed.json() == [{"id": 1, "name": "Chemistry"}]
+        assert refcache.reference_caches.stats()["subjects"] == 1
+
+
+def test_grade_changes(client, db, test_student, test_subject):
+    import changes
+    from datetime import datetime
+    client.post("/students/", json=test_student)
+    client.post("/students/", json={"full_name": "Other Student", "class_group": "11B"})
+    client.post("/subjects/", json=test_subject)
+    grade = {"student_id": 1, "subject_id": 1, "grade": 5, "date": "2024-09-02"}
+    client.post("/grades/", json=grade)
+    client.put("/grades/1", json={**grade, "grade": 4})
+    client.post("/grades/bulk", json=[{**grade, "student_id": 2}, {**grade, "grade": 3}])
+    client.delete("/grades/1")
+    client.delete("/students/1")
+
+    feed = client.get("/grades/changes").json()
+    assert [(c["seq"], c["op"], c["grade_id"]) for c in feed] == [
+        (1, "create", 1), (2, "update", 1), (3, "create", 2), (4, "create", 3), (5, "delete", 1), (6, "delete", 3)
+    ]
+    assert feed[1]["grade"] == {**grade, "grade": 4, "id": 1} and feed[1]["class_group"] == "10A"
+    assert [c["seq"] for c in client.get("/grades/changes", params={"since": 4}).json()] == [5, 6]
+    assert [c["grade_id"] for c in client.get("/grades/changes", params={"class_group": "11B"}).json()] == [2]
+
+    # После чистки журнала клиент со старым since получает 410 и перечитывает оценки
+    assert changes.prune(db, datetime(2100, 1, 1)) == 5
+    assert client.get("/grades/changes", params={"since": 3}).status_code == 410
+    assert client.get("/grades/changes/stream", params={"since": 3}).status_code == 410
+    assert [c["seq"] for c in client.get("/grades/changes", params={"since": 5}).json()] == [6]
+
+    # Журнал пишется по переданным id: соседние строки с id внутри диапазона не попадают
+    db.add_all([database.Grade(id=i, student_id=2, subject_id=1, grade=5, date=date(2024, 9, 3)) for i in (10, 11, 12)])
+    db.flush()
+    changes.record(db, changes.CREATE, [12, 10])
+    db.commit()
+    assert [c["grade_id"] for c in client.get("/grades/changes", params={"since": 6}).json()] == [10, 12]
+
+
+def test_grade_changes_stream(tmp_path, test_student, test_subject):
+    import asyncio
+    import changes
+    import crud
+    import models
+    stream_app = create_app(Settings(database_url=f"sqlite:///{tmp_path}/journal.db"))
+    grade = {"student_id": 1, "subject_id": 1, "grade": 5, "date": "2024-09-02"}
+    with TestClient(stream_app) as client:
+        client.post("/students/", json=test_student)
+        client.post("/subjects/", json=test_subject)
+        client.post("/subjects/", json={"name": "Physics"})
+        for value in (1, 2, 3):
+            client.post("/grades/", json={**grade, "grade": value})
+        client.post("/grades/", json={**grade, "subject_id": 2})
+    journal_db = stream_app.state.database
+
+    def write(value):
+        with journal_db.SessionLocal() as db:
+            crud.create_grade(db, models.GradeCreate(**{**grade, "grade": value}))
+
+    # Догон из БД после since, затем новые изменения из опроса. Очередь на одно событие переполняется:
+    # подписчик догоняет пропущенное из БД без пропусков и повторов; изменение по другому предмету не приходит
+    async def scenario():
+        broadcaster = changes.Broadcaster(changes.reader(journal_db), poll_ms=10, queue_size=1)
+        events = changes.stream(broadcaster, 1, heartbeat=5, subject_id=1)
+        assert await anext(events) == b"retry: 1000\n\n"
+        received = [await anext(events) for _ in range(2)]
+        for value in (1, 2, 3):
+            await asyncio.to_thread(write, value)
+        received += [await anext(events) for _ in range(3)]
+        assert broadcaster.subscribers() == 1
+        await events.aclose()
+        assert broadcaster.subscribers() == 0
+        return received
+
+    received = asyncio.run(scenario())
+    assert [int(event.split(b"\n")[0][4:]) for event in received] == [2, 3, 5, 6, 7]
+    assert received[-1].startswith(b"id: 7\nevent: create\ndata: {")
+    journal_db.close()
+
+
+def test_grade_fields_and_include(client, test_student, test_subject):
+    client.post("/students/", json=test_student)
+    client.post("/subjects/", json=test_subject)
+    client.post("/grades/bulk", json=[
+        {"student_id": 1, "subject_id": 1, "grade": g, "date": f"2024-09-0{g}"} for g in (1, 2, 3)
+    ])
+
+    rows = client.get("/grades/", params={"include": "student,subject"}).json()
+    assert rows[0]["student"] == {"id": 1, **test_student}
+    assert rows[0]["subject"] == {"id": 1, **test_subject}
+    assert rows[0]["grade"] == 1
+
+    # Только запрошенные поля; курсор строится по date и id, даже если их нет в ответе
+    first = client.get("/grades/", params={"fields": "grade,student.full_name", "limit": 2})
+    assert first.json()[0] == {"grade": 1, "student": {"full_name": test_student["full_name"]}}
+    rest = client.get("/grades/", params={"fields": "grade,student.full_name", "after": first.headers["X-Next-Cursor"]})
+    assert [row["grade"] for row in rest.json()] == [3]
+
+    one = client.get("/grades/2", params={"include": "subject", "fields": "grade"})
+    assert one.json() == {"grade": 2, "subject": {"id": 1, **test_subject}}
+    assert client.get("/grades/99", params={"include": "subject"}).status_code == 404
+    assert client.get("/grades/", params={"include": "teacher"}).status_code == 400
+    assert client.get("/grades/", params={"fields": "student.password"}).status_code == 400
+
+    # ETag с include меняется и при переименовании ученика
+    etag = client.get("/grades/", params={"include": "student"}).headers["ETag"]
+    client.put("/students/1", json={**test_student, "full_name": "Renamed"})
+    renamed = client.get("/grades/", params={"include": "student"}, headers={"If-None-Match": etag})
+    assert renamed.status_code == 200
+    assert renamed.json()[0]["student"]["full_name"] == "Renamed"
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Optional
+
+from fastapi import Response, status
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import database
+
+STUDENTS = "students"
+SUBJECTS = "subjects"
+GRADES = "grades"
+
+
+# Upsert одним оператором: UPDATE с INSERT при rowcount == 0 гонится на первой записи в таблицу —
+# обе транзакции не видят строку, и вторая падает на первичном ключе
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def bump(db: Session, *tables: str):
+    # Вызывается в той же транзакции, что и запись: версия видна читателям вместе с данными
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    upsert_insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert_insert is not None:
+        query = upsert_insert(database.TableVersion).values(
+            [{"name": table, "version": 1, "updated_at": now} for table in dict.fromkeys(tables)]
+        )
+        db.execute(query.on_conflict_do_update(
+            index_elements=[database.TableVersion.name],
+            set_={"version": database.TableVersion.version + 1, "updated_at": query.excluded.updated_at},
+        ))
+        return
+    for table in tables:
+        result = db.execute(
+            update(database.TableVersion)
+            .where(database.TableVersion.name == table)
+            .values(version=database.TableVersion.version + 1, updated_at=now)
+        )
+        if not result.rowcount:
+            db.execute(insert(database.TableVersion).values(name=table, version=1, updated_at=now))
+
+
+def current(db: Session, table: str):
+    row = db.execute(
+        select(database.TableVersion.version, database.TableVersion.updated_at)
+        .where(database.TableVersion.name == table)
+    ).first()
+    return tuple(row) if row else (0, None)
+
+
+def combined(db: Session, tables) -> tuple:
+    # Версия ответа из нескольких таблиц ("12.3.7") и время последнего изменения любой из них
+    rows = {
+        name: (version, updated_at) for name, version, updated_at in db.execute(
+            select(database.TableVersion.name, database.TableVersion.version, database.TableVersion.updated_at)
+            .where(database.TableVersion.name.in_(tables))
+        )
+    }
+    version = ".".join(str(rows.get(table, (0, None))[0]) for table in tables)
+    return version, max((updated_at for _, updated_at in rows.values() if updated_at), default=None)
+
+
+def etag(table: str, version) -> str:
+    return f'W/"{table}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Слабое сравнение: W/"x" и "x" считаются одним тегом
+    return "*" in candidates or tag.removeprefix("W/") in (c.removeprefix("W/") for c in candidates)
+
+
+def conditional(
+        db: Session, table: str, if_none_match: Optional[str], response: Response, known: Optional[tuple] = None
+) -> Optional[Response]:
+    # Версия читается до данных: при записи между двумя запросами клиент получит свежие строки
+    # со старым ETag и просто перезапросит их при следующем опросе.
+    # known — уже известная (version, updated_at), например версия копии в памяти; тогда БД не читается.
+    # Возвращает готовый ответ 304, если у клиента актуальная копия, иначе проставляет заголовки
+    version, updated_at = known or current(db, table)
+    headers = {"ETag": etag(table, version)}
+    if updated_at:
+        headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def conditional_many(db: Session, tables, if_none_match: Optional[str], response: Response) -> Optional[Response]:
+    # То же для ответа, собранного из нескольких таблиц (оценки со встроенными учениками и предметами)
+    if len(tables) == 1:
+        return conditional(db, tables[0], if_none_match, response)
+    return conditional(db, "+".join(tables), if_none_match, response, combined(db, tables))